@@ -0,0 +1,123 @@
+import io
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import itertools
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import main
+import metrics
+from vfs_json import open_vfs_from_json
+
+# пакетный запуск: матрица (образ VFS, скрипт) выполняется в пуле процессов без GUI
+# каждый процесс сам загружает команды и образы и выполняет скрипты через run_startup_script/use_command
+
+# загрузка команд в процессе пула (один раз на процесс)
+def init_worker():
+    main.OUT = io.StringIO()
+    main.commands_loader()
+
+# один прогон: скрипт на своем экземпляре образа; возвращает запись отчета
+def run_one(job):
+    image, script = job
+    out = io.StringIO()
+    # состояние эмулятора от предыдущего прогона в этом процессе сбрасываем
+    main.OUT = out
+    main.EXIT_REQUESTED = False
+    main.HISTORY.clear()
+    main.CANCEL.clear()
+    metrics.COMMAND_STATS.clear()
+    record = {"vfs": image, "script": script, "pid": os.getpid()}
+    start = time.perf_counter()
+    try:
+        main.vfs = open_vfs_from_json(image, readonly=True) # прогоны одного образа не видят изменений друг друга
+        record["load_seconds"] = time.perf_counter() - start
+        main.bind_commands_module()
+        ok = main.run_startup_script(script)
+        record["status"] = "ok" if ok else "failed"
+    except Exception: # прогон упал - остальные продолжаются
+        out.write(traceback.format_exc())
+        record["status"] = "error"
+    finally:
+        if main.vfs is not None and main.vfs._buf is not None: # отпускаем mmap образа
+            main.vfs._release()
+        main.vfs = None
+    record["seconds"] = time.perf_counter() - start
+    record["commands"] = sum(st["calls"] for st in metrics.COMMAND_STATS.values())
+    record["output"] = out.getvalue()
+    return record
+
+# матрица прогонов: все пары образ x скрипт (или пары из файла: "образ скрипт" на строке)
+def build_matrix(images, scripts, pairs_file=None):
+    if pairs_file:
+        jobs = []
+        with open(pairs_file, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and not line.lstrip().startswith("#"):
+                    jobs.append((os.path.abspath(parts[0]), os.path.abspath(parts[1])))
+        return jobs
+    images = sorted({os.path.abspath(p) for pattern in images for p in glob.glob(pattern)})
+    scripts = sorted({os.path.abspath(p) for pattern in scripts for p in glob.glob(pattern)})
+    return list(itertools.product(images, scripts))
+
+# выполнить матрицу на workers процессах (1 - в текущем процессе); возвращает отчет
+def run_batch(jobs, workers=None):
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    if workers == 1:
+        init_worker()
+        runs = [run_one(job) for job in jobs]
+    else:
+        # мелкие прогоны отдаем пачками, чтобы не упираться в пересылку между процессами
+        chunksize = max(1, len(jobs) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            runs = list(pool.map(run_one, jobs, chunksize=chunksize))
+    wall = time.perf_counter() - start
+    busy = sum(r["seconds"] for r in runs)
+    summary = {
+        "runs": len(runs),
+        "ok": sum(1 for r in runs if r["status"] == "ok"),
+        "failed": sum(1 for r in runs if r["status"] == "failed"),
+        "error": sum(1 for r in runs if r["status"] == "error"),
+        "workers": workers,
+        "wall_seconds": wall,
+        "run_seconds": busy, # сумма времени прогонов
+        "parallelism": busy / wall if wall else None, # сколько прогонов в среднем шло одновременно
+    }
+    return {"summary": summary, "runs": runs}
+
+def parse_cli(argv=None):
+    p = argparse.ArgumentParser(description="Пакетный запуск скриптов эмулятора на образах VFS в пуле процессов")
+    p.add_argument("--vfs", nargs="+", default=[], help="Образы VFS (можно маски, например vfs/*.json)")
+    p.add_argument("--script", nargs="+", default=[], help="Скрипты (можно маски, например scripts/script_*.txt)")
+    p.add_argument("--pairs", default=None, help="Файл с парами 'образ скрипт' по строке (вместо --vfs x --script)")
+    p.add_argument("--workers", type=int, default=None, help="Число процессов (по умолчанию - число ядер)")
+    p.add_argument("--report", default=None, help="Файл отчета в JSON (по умолчанию stdout)")
+    p.add_argument("--no-output", dest="keep_output", action="store_false", help="Не включать вывод прогонов в отчет")
+    return p.parse_args(argv)
+
+if __name__ == "__main__":
+    a = parse_cli()
+    jobs = build_matrix(a.vfs, a.script, a.pairs)
+    if not jobs:
+        sys.stderr.write("Нет прогонов: задайте --vfs и --script или --pairs\n")
+        sys.exit(2)
+    report = run_batch(jobs, a.workers)
+    if not a.keep_output:
+        for run in report["runs"]:
+            run.pop("output")
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if a.report:
+        with open(a.report, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    s = report["summary"]
+    sys.stderr.write(f"Прогонов: {s['runs']}, успешно {s['ok']}, с ошибкой {s['failed'] + s['error']}, "
+                     f"{s['wall_seconds']:.2f} с на {s['workers']} процессах (параллельность {s['parallelism']:.2f})\n")
+    sys.exit(0 if s["ok"] == s["runs"] else 1)
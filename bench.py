@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import time
+import random
+import base64
+import platform
+import argparse
+import tempfile
+import tracemalloc
+
+import main
+from vfs_json import open_vfs_from_json, convert_vfs
+
+# бенчмарки VFS, парсера и скриптов на синтетических образах (без GUI)
+
+# имя директории и файла синтетического образа по номеру
+def _dir_name(i):
+    return f"d{i}"
+
+def _file_name(i):
+    return f"f{i}.txt"
+
+# генерация синтетического образа: depth уровней по fanout директорий, в каждой files файлов по size байт
+# образ пишется потоком, дерево целиком в памяти не строится
+def generate_image(path, depth=3, fanout=4, files=8, size=256, unique=0, seed=0):
+    rnd = random.Random(seed)
+    # пул содержимого: unique > 0 - столько разных файлов на весь образ (остальные - повторы)
+    pool = [base64.b64encode(rnd.randbytes(size)).decode("ascii") for _ in range(unique)]
+    counts = {"dirs": 0, "files": 0}
+
+    def write_dir(f, level):
+        f.write('{"type":"dir","entries":{')
+        first = True
+        for i in range(files):
+            data = pool[rnd.randrange(unique)] if unique else base64.b64encode(rnd.randbytes(size)).decode("ascii")
+            f.write(('' if first else ',') + f'"{_file_name(i)}":{{"type":"file","data":"{data}"}}')
+            first = False
+            counts["files"] += 1
+        if level < depth:
+            for i in range(fanout):
+                f.write(('' if first else ',') + f'"{_dir_name(i)}":')
+                first = False
+                counts["dirs"] += 1
+                write_dir(f, level + 1)
+        f.write('}}')
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"cwd":"/","root":')
+        write_dir(f, 0)
+        f.write('}')
+    return counts
+
+# случайный путь до существующего файла (или директории) синтетического образа
+def random_path(rnd, depth, fanout, files, want_dir=False):
+    parts = [_dir_name(rnd.randrange(fanout)) for _ in range(rnd.randint(0 if not want_dir else 1, depth))]
+    if not want_dir:
+        parts.append(_file_name(rnd.randrange(files)))
+    return "/" + "/".join(parts)
+
+# замер: fn выполняется один раз, ops - число операций внутри
+def measure(results, name, fn, ops=1):
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    results[name] = {"seconds": seconds, "ops": ops, "ops_per_sec": ops / seconds if seconds else None}
+    return seconds
+
+# сколько памяти занимает результат fn() (по tracemalloc)
+def memory_of(fn):
+    tracemalloc.start()
+    try:
+        obj = fn()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del obj
+    return size
+
+# память дерева: словари json (как было) против узлов VFS (DirNode/FileNode)
+def compare_memory(image):
+    def load_dicts():
+        with open(image, "r", encoding="utf-8") as f:
+            return json.load(f)
+    dicts = memory_of(load_dicts)
+    nodes = memory_of(lambda: open_vfs_from_json(image, lazy=False))
+    return {"dict_bytes": dicts, "node_bytes": nodes, "ratio": dicts / nodes if nodes else None}
+
+# набор замеров на образе
+def run_benchmarks(a, workdir):
+    results = {}
+    rnd = random.Random(a.seed)
+    image = os.path.join(workdir, "image.json")
+    pack = os.path.join(workdir, "image.vfspack")
+    shape = (a.depth, a.fanout, a.files)
+
+    counts = {}
+    measure(results, "generate", lambda: counts.update(generate_image(image, a.depth, a.fanout, a.files, a.size, a.unique, a.seed)))
+    convert_vfs(image, pack)
+
+    # загрузка образа
+    holder = {}
+    measure(results, "open_eager", lambda: holder.update(v=open_vfs_from_json(image, lazy=False)))
+    measure(results, "open_lazy", lambda: open_vfs_from_json(image, lazy=True))
+    measure(results, "open_pack", lambda: open_vfs_from_json(pack))
+    v = holder["v"]
+
+    # поиск путей (_walk_parent): первый проход - холодный кэш, второй - теплый
+    paths = [random_path(rnd, *shape) for _ in range(a.ops)]
+    measure(results, "lookup_cold", lambda: [v.is_file(p) for p in paths], a.ops)
+    measure(results, "lookup_warm", lambda: [v.is_file(p) for p in paths], a.ops)
+
+    dirs = [random_path(rnd, *shape, want_dir=True) for _ in range(a.ops)]
+    measure(results, "listdir", lambda: [v.listdir(p) for p in dirs], a.ops)
+    measure(results, "read_bytes", lambda: [v.read_bytes(p) for p in paths], a.ops)
+    payload = rnd.randbytes(a.size)
+    measure(results, "write_bytes", lambda: [v.write_bytes(p + ".new", payload) for p in paths], a.ops)
+
+    # сохранение (то же, что делает save, но по точному пути)
+    measure(results, "save_json", lambda: v._dump(os.path.join(workdir, "saved.json")))
+    measure(results, "save_pack", lambda: v._dump(os.path.join(workdir, "saved.vfspack")))
+
+    # парсер командной строки
+    lines = [rnd.choice(["ls", "cd d0/d1", "cat f1.txt", 'echo "hello world" x y', "echo $HOME ~ %HOME%", "write a.txt text"])
+             for _ in range(a.ops)]
+    measure(results, "parser", lambda: [main.parser(line) for line in lines], a.ops)
+
+    # полный прогон скрипта через parser/use_command (вывод - в никуда)
+    script = os.path.join(workdir, "script.txt")
+    with open(script, "w", encoding="utf-8") as f:
+        for p, d in zip(paths, dirs):
+            f.write(f"cd {d}\nls\ncat {p}\nwrite {p}.s text\n")
+    w = open_vfs_from_json(image)
+    main.vfs = w
+    main.OUT = open(os.devnull, "w", encoding="utf-8")
+    try:
+        main.commands_loader()
+        main.bind_commands_module()
+        measure(results, "script", lambda: main.run_startup_script(script), 4 * a.ops)
+        # повторный прогон того же скрипта - уже разобранный на токены (из кэша)
+        measure(results, "script_rerun", lambda: main.run_startup_script(script), 4 * a.ops)
+    finally:
+        main.OUT.close()
+        main.OUT = None
+
+    memory = compare_memory(image) if a.memory else None
+
+    meta = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {"depth": a.depth, "fanout": a.fanout, "files": a.files, "size": a.size, "unique": a.unique, "ops": a.ops, "seed": a.seed},
+        "image": {"dirs": counts.get("dirs"), "files": counts.get("files"), "bytes": os.path.getsize(image)},
+    }
+    report = {"meta": meta, "results": results}
+    if memory is not None:
+        report["memory"] = memory
+    return report
+
+# сравнение с предыдущим прогоном: во сколько раз изменилось время
+def compare(old, new):
+    lines = [f"{'замер':<14}{'было, с':>12}{'стало, с':>12}{'ускорение':>11}"]
+    for name, res in new["results"].items():
+        prev = old.get("results", {}).get(name)
+        if not prev:
+            continue
+        speedup = prev["seconds"] / res["seconds"] if res["seconds"] else float("inf")
+        lines.append(f"{name:<14}{prev['seconds']:>12.4f}{res['seconds']:>12.4f}{speedup:>10.2f}x")
+    return "\n".join(lines)
+
+def parse_cli(argv=None):
+    p = argparse.ArgumentParser(description="Бенчмарки VFS, парсера и скриптов эмулятора")
+    p.add_argument("--depth", type=int, default=3, help="Глубина дерева директорий")
+    p.add_argument("--fanout", type=int, default=4, help="Поддиректорий в каждой директории")
+    p.add_argument("--files", type=int, default=8, help="Файлов в каждой директории")
+    p.add_argument("--size", type=int, default=256, help="Размер файла, байт")
+    p.add_argument("--unique", type=int, default=0, help="Сколько разных содержимых файлов (0 - все разные)")
+    p.add_argument("--ops", type=int, default=2000, help="Операций в каждом замере")
+    p.add_argument("--seed", type=int, default=0, help="Зерно генератора случайных чисел")
+    p.add_argument("--no-memory", dest="memory", action="store_false", help="Не сравнивать память словарей json и узлов VFS")
+    p.add_argument("--output", help="Файл для результатов в JSON (по умолчанию stdout)", default=None)
+    p.add_argument("--compare", help="JSON предыдущего прогона для сравнения", default=None)
+    p.add_argument("--workdir", help="Папка для временных образов (по умолчанию - временная)", default=None)
+    return p.parse_args(argv)
+
+if __name__ == "__main__":
+    a = parse_cli()
+    if a.workdir:
+        os.makedirs(a.workdir, exist_ok=True)
+        report = run_benchmarks(a, a.workdir)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            report = run_benchmarks(a, workdir)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if a.output:
+        with open(a.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if a.compare:
+        with open(a.compare, "r", encoding="utf-8") as f:
+            sys.stderr.write(compare(json.load(f), report) + "\n")
@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+from bench import generate_image, random_path
+from vfs_client import VFSClient
+
+# нагрузочный бенчмарк сервера VFS: сервер с синтетическим образом, N клиентов-процессов шлют
+# случайные команды (в основном чтение, доля записи - --write-ratio); для каждого N - пропускная способность и задержки
+
+# запуск сервера в отдельном процессе; возвращает процесс, когда сокет уже слушает
+def start_server(image, sock, workers):
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.Popen([sys.executable, os.path.join(here, "vfs_server.py"), "--vfs", image, "--unix", sock,
+                             "--workers", str(workers)], stdout=subprocess.PIPE, text=True, encoding="utf-8")
+    for line in proc.stdout:
+        if line.startswith("Сервер VFS"):
+            return proc
+    raise RuntimeError("сервер не запустился")
+
+# один клиент: ops случайных команд; возвращает (время начала, время конца, задержки в секундах, число ошибок)
+def client_run(job):
+    sock, ops, seed, shape, write_ratio = job
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(ops):
+        if rnd.random() < write_ratio:
+            lines.append(f"write {random_path(rnd, *shape)}.w{seed} text{i}")
+        else:
+            kind = rnd.randrange(4)
+            if kind == 0:
+                lines.append(f"cat {random_path(rnd, *shape)}")
+            elif kind == 1:
+                lines.append(f"ls {random_path(rnd, *shape, want_dir=True)}")
+            elif kind == 2:
+                lines.append(f"head -c 16 {random_path(rnd, *shape)}")
+            else:
+                lines.append(f"cd {random_path(rnd, *shape, want_dir=True)}")
+    latencies = []
+    errors = 0
+    with VFSClient(sock) as client:
+        client.run("ls") # соединение установлено до начала замера
+        start = time.time()
+        for line in lines:
+            t = time.perf_counter()
+            ok, _ = client.run(line)
+            latencies.append(time.perf_counter() - t)
+            errors += not ok
+        end = time.time()
+    return start, end, latencies, errors
+
+# перцентиль отсортированного списка
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+# замер для каждого числа клиентов
+def run_benchmarks(a, workdir):
+    image = os.path.join(workdir, "image.json")
+    counts = generate_image(image, a.depth, a.fanout, a.files, a.size, seed=a.seed)
+    sock = os.path.join(workdir, "vfs.sock")
+    shape = (a.depth, a.fanout, a.files)
+    results = {}
+    proc = start_server(image, sock, a.workers)
+    try:
+        for n in a.clients:
+            jobs = [(sock, a.ops, a.seed * 1000 + i, shape, a.write_ratio) for i in range(n)]
+            with multiprocessing.Pool(n) as pool:
+                runs = pool.map(client_run, jobs)
+            seconds = max(r[1] for r in runs) - min(r[0] for r in runs)
+            latencies = sorted(x for r in runs for x in r[2])
+            results[f"clients_{n}"] = {
+                "clients": n,
+                "ops": len(latencies),
+                "seconds": seconds,
+                "ops_per_sec": len(latencies) / seconds if seconds else None,
+                "p50_ms": percentile(latencies, 0.5) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "errors": sum(r[3] for r in runs),
+            }
+    finally:
+        proc.terminate()
+        proc.wait()
+    meta = {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "depth": a.depth, "fanout": a.fanout, "files": a.files, "size": a.size, "image": counts,
+            "ops_per_client": a.ops, "write_ratio": a.write_ratio, "workers": a.workers}
+    return {"meta": meta, "results": results}
+
+# таблица результатов
+def format_table(report):
+    lines = [f"{'клиентов':>8} {'оп/с':>10} {'p50 мс':>8} {'p99 мс':>8} {'ошибок':>7}"]
+    for r in report["results"].values():
+        lines.append(f"{r['clients']:>8} {r['ops_per_sec']:>10.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['errors']:>7}")
+    return "\n".join(lines)
+
+def parse_cli(argv=None):
+    p = argparse.ArgumentParser(description="Нагрузочный бенчмарк сервера VFS")
+    p.add_argument("--depth", type=int, default=3, help="Глубина дерева директорий")
+    p.add_argument("--fanout", type=int, default=4, help="Поддиректорий в каждой директории")
+    p.add_argument("--files", type=int, default=8, help="Файлов в каждой директории")
+    p.add_argument("--size", type=int, default=256, help="Размер файла, байт")
+    p.add_argument("--clients", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 4, 8],
+                   help="Числа клиентов через запятую")
+    p.add_argument("--ops", type=int, default=500, help="Команд на клиента")
+    p.add_argument("--write-ratio", dest="write_ratio", type=float, default=0.05, help="Доля команд записи")
+    p.add_argument("--workers", type=int, default=8, help="Потоков команд сервера")
+    p.add_argument("--seed", type=int, default=0, help="Зерно генератора случайных чисел")
+    p.add_argument("--output", help="Файл для результатов в JSON (по умолчанию stdout)", default=None)
+    return p.parse_args(argv)
+
+if __name__ == "__main__":
+    a = parse_cli()
+    with tempfile.TemporaryDirectory() as workdir:
+        report = run_benchmarks(a, workdir)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if a.output:
+        with open(a.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    sys.stderr.write(format_table(report) + "\n")
@@ -0,0 +1,230 @@
+import os
+import re
+import sys
+import hashlib
+import threading
+import importlib.util
+
+# плагины команд: модули *.py в директории плагинов
+# имена команд плагина берутся из его исходника (объявления @command("name")) без импорта модуля;
+# модуль импортируется при первом вызове одной из его команд
+# при перезагрузке перечитываются только файлы, у которых изменились время изменения или размер,
+# и переимпортируются только модули, у которых изменилось содержимое (хэш)
+#
+# плагин объявляет команды так же, как модуль commands, но в своем словаре:
+#     import commands
+#     COMMANDS = {}
+#     command = commands.registrar(COMMANDS)
+#
+#     @command("name", stdin=True)
+#     def cmd_name(*args, stdin=None): ...
+
+# директория плагинов по умолчанию (рядом с main.py)
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plugins")
+# префикс имени модуля плагина в sys.modules
+MODULE_PREFIX = "vfs_plugin_"
+# как часто наблюдатель проверяет файлы, секунды
+WATCH_INTERVAL = 1.0
+
+# объявление команды в исходнике: @command("name", ...) или @command(name="name", ...)
+_COMMAND_DECL = re.compile(r"""^[ \t]*@command\(\s*(?:name\s*=\s*)?["']([^"'\n]+)["']([^)\n]*)\)""", re.M)
+_STDIN_TRUE = re.compile(r"\bstdin\s*=\s*True\b")
+
+# исходный файл модуля: изменился ли он с прошлой проверки
+class Source:
+    __slots__ = ("path", "stamp", "digest")
+
+    def __init__(self, path):
+        self.path = path
+        self.stamp = None # (mtime_ns, размер) при последней проверке
+        self.digest = None # хэш содержимого при последней проверке
+
+    # (mtime_ns, размер) файла; None - файла нет
+    def current_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    # время изменения или размер отличаются от последней проверки (только stat, без чтения)
+    def touched(self):
+        return self.current_stamp() != self.stamp
+
+    # перечитать файл, если он тронут: возвращает содержимое, если оно изменилось, иначе None
+    # (файл сохранили без изменений - отметка обновляется, модуль не переимпортируется)
+    def refresh(self):
+        stamp = self.current_stamp()
+        if stamp == self.stamp:
+            return None
+        with open(self.path, "rb") as f:
+            data = f.read()
+        self.stamp = stamp
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        if digest == self.digest:
+            return None
+        self.digest = digest
+        return data
+
+# команда плагина, модуль которого еще не импортирован: импорт - при первом вызове
+class LazyCommand:
+    __slots__ = ("name", "registry", "reads_stdin")
+
+    def __init__(self, name, registry, reads_stdin):
+        self.name = name
+        self.registry = registry
+        self.reads_stdin = reads_stdin
+
+    def __call__(self, *args, **kwargs):
+        return self.registry.resolve(self.name)(*args, **kwargs)
+
+    def __repr__(self):
+        return f"LazyCommand({self.name!r})"
+
+# один файл плагина
+class Plugin(Source):
+    __slots__ = ("module_name", "names", "module")
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.module_name = MODULE_PREFIX + os.path.splitext(os.path.basename(path))[0]
+        self.names = {} # имя команды -> читает ли ввод конвейера (по исходнику)
+        self.module = None # импортированный модуль (None - еще не нужен)
+
+    # имена команд из исходника
+    def scan(self, data):
+        text = data.decode("utf-8", errors="replace")
+        self.names = {m.group(1): bool(_STDIN_TRUE.search(m.group(2))) for m in _COMMAND_DECL.finditer(text)}
+
+    # импорт модуля (каждый раз - новый объект модуля из текущего исходника)
+    def load(self):
+        spec = importlib.util.spec_from_file_location(self.module_name, self.path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[self.module_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            sys.modules.pop(self.module_name, None)
+            raise
+        table = getattr(module, "COMMANDS", None)
+        if not isinstance(table, dict):
+            sys.modules.pop(self.module_name, None)
+            raise ImportError(f"плагин {self.path}: нет словаря COMMANDS")
+        self.module = module
+        # объявления, которые не нашлись разбором исходника (имя из переменной и т.п.), тоже становятся командами
+        self.names = {str(k): getattr(v, "reads_stdin", False) for k, v in table.items() if callable(v)}
+        return module
+
+    def unload(self):
+        if self.module is not None:
+            sys.modules.pop(self.module_name, None)
+            self.module = None
+
+# реестр плагинов директории
+class PluginRegistry:
+    def __init__(self, directory=PLUGIN_DIR):
+        self.directory = directory
+        self.plugins = {} # путь файла -> Plugin
+        self.owners = {} # имя команды -> Plugin
+        self.reloads = 0 # сколько модулей переимпортировано при перезагрузках
+        self.errors = [] # ошибки последнего scan: (путь, сообщение)
+        self._lock = threading.RLock() # команды вызываются из рабочего потока, наблюдатель проверяет из своего
+
+    # файлы плагинов в директории
+    def _paths(self):
+        try:
+            with os.scandir(self.directory) as it:
+                return [e.path for e in it if e.name.endswith(".py") and not e.name.startswith("_") and e.is_file()]
+        except FileNotFoundError:
+            return []
+
+    # перечитать директорию: новые и удаленные файлы, измененные - перечитать (и переимпортировать уже загруженные);
+    # возвращает число файлов, содержимое которых изменилось
+    def scan(self):
+        with self._lock:
+            self.errors = []
+            paths = self._paths()
+            changed = 0
+            for path in self.plugins.keys() - set(paths): # удаленные плагины
+                self.plugins.pop(path).unload()
+                changed += 1
+            for path in paths:
+                plugin = self.plugins.get(path)
+                if plugin is None:
+                    plugin = self.plugins[path] = Plugin(path)
+                try:
+                    data = plugin.refresh()
+                except OSError as e:
+                    self.errors.append((path, str(e)))
+                    continue
+                if data is None: # не изменился - не трогаем
+                    continue
+                changed += 1
+                plugin.scan(data)
+                if plugin.module is not None: # модуль уже использовался - переимпортируем сразу
+                    plugin.unload()
+                    self.reloads += 1
+                    try:
+                        plugin.load()
+                    except Exception as e: # команды останутся ленивыми: ошибка повторится при вызове
+                        self.errors.append((path, f"{type(e).__name__}: {e}"))
+            if changed:
+                self.owners = {name: plugin for plugin in self.plugins.values() for name in plugin.names}
+            return changed
+
+    # есть ли изменения в директории плагинов (только stat, для наблюдателя)
+    def touched(self):
+        paths = self._paths()
+        with self._lock:
+            if len(paths) != len(self.plugins):
+                return True
+            for path in paths:
+                plugin = self.plugins.get(path)
+                if plugin is None or plugin.touched():
+                    return True
+        return False
+
+    # команды плагинов: у загруженных модулей - сами функции, у остальных - ленивые заглушки
+    def commands(self):
+        with self._lock:
+            result = {}
+            for name, plugin in self.owners.items():
+                if plugin.module is not None:
+                    fn = plugin.module.COMMANDS.get(name)
+                    if callable(fn):
+                        result[name] = fn
+                        continue
+                result[name] = LazyCommand(name, self, plugin.names.get(name, False))
+            return result
+
+    # функция команды (модуль плагина импортируется при первом обращении); KeyError - команды нет
+    def resolve(self, name):
+        with self._lock:
+            plugin = self.owners[name]
+            if plugin.module is None:
+                plugin.load()
+            fn = plugin.module.COMMANDS.get(name)
+            if not callable(fn):
+                raise KeyError(name)
+            return fn
+
+    # имена модулей плагинов, уже импортированных
+    def loaded(self):
+        with self._lock:
+            return sorted(p.module_name[len(MODULE_PREFIX):] for p in self.plugins.values() if p.module is not None)
+
+# наблюдатель: поток, который раз в interval секунд проверяет файлы (stat) и при изменениях вызывает on_change()
+# остановить - stop.set()
+def watch(check, on_change, interval=WATCH_INTERVAL):
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                if check():
+                    on_change()
+            except Exception: # файл удалили между scandir и stat и т.п. - проверим в следующий раз
+                pass
+
+    threading.Thread(target=loop, name="plugin-watch", daemon=True).start()
+    return stop
@@ -1,15 +1,63 @@
-import platform
+import re
+import threading
+import collections
+
+import metrics
+from history import History
 
 COMMANDS = {}
 vfs = None   # main присвоит объект vfs
-HISTORY = [] # main будет пушить сюда вводы
+HISTORY = History() # main подменит на историю сеанса (кольцевой буфер с файлом)
+CANCEL = None # main присвоит threading.Event, выставляемый по Ctrl+C
+VFS_READY = None # main присвоит threading.Event, выставляемый после (фоновой) загрузки vfs
+SESSION = threading.local() # сеанс сервера в текущем потоке (vfs_server): SESSION.history - история сеанса
+
+# декоратор команд, регистрирующий их в словаре table (плагины команд заводят свой словарь COMMANDS)
+# stdin=True - команда может стоять не первой в конвейере и получает ввод аргументом stdin (поток кусков байт)
+def registrar(table):
+    def command(name=None, stdin=False):
+        def deco(fn):
+            cmd_name = name or fn.__name__
+            fn.reads_stdin = stdin
+            table[cmd_name] = fn
+            return fn
+        return deco
+    return command
+
+command = registrar(COMMANDS)
 
-def command(name=None):
-    def deco(fn):
-        cmd_name = name or fn.__name__
-        COMMANDS[cmd_name] = fn
-        return fn
-    return deco
+def cancelled(): # пользователь прервал команду (Ctrl+C)
+    return CANCEL is not None and CANCEL.is_set()
+
+# строки потока кусков байт (ввод из конвейера) с переводом строки; в памяти - только недописанная строка
+def iter_lines(chunks):
+    tail = b""
+    for chunk in chunks:
+        data = tail + bytes(chunk)
+        end = data.rfind(b"\n") + 1
+        if end:
+            for line in data[:end - 1].split(b"\n"):
+                yield line + b"\n"
+        tail = data[end:]
+    if tail:
+        yield tail
+
+# число строк, слов и байт в потоке кусков
+def count_chunks(chunks):
+    lines = words = size = 0
+    in_word = False
+    for chunk in chunks:
+        if cancelled():
+            raise InterruptedError("команда прервана")
+        chunk = bytes(chunk)
+        size += len(chunk)
+        lines += chunk.count(b"\n")
+        split = chunk.split()
+        words += len(split)
+        if in_word and split and not chunk[:1].isspace(): # слово продолжается из прошлого куска
+            words -= 1
+        in_word = bool(split) and not chunk[-1:].isspace()
+    return lines, words, size
 
 # КОМАНДЫ БЕЗ VFS
 
@@ -23,24 +71,27 @@ def cmd_echo(*args):
 
 @command("uname") # вывести имя
 def cmd_uname():
+    import platform
     u = platform.uname()
     return f"{u.system} {u.node} {u.release}"
 
-@command("history") # история комманд
-def cmd_history():
-    global HISTORY
-    lines = HISTORY
-    return "\n".join(lines)
-
-@command("help") # вывести отсортированный список комманд
-def cmd_help(*args):
-    names = sorted(COMMANDS.keys())
-    return "Доступные команды: " + ", ".join(names)
+@command("history") # история комманд (history N - только последние N)
+def cmd_history(n=None):
+    try:
+        count = int(n) if n is not None else None
+    except ValueError:
+        return "Usage: history [N]"
+    history = getattr(SESSION, "history", HISTORY) # у сеанса сервера - своя история
+    # строки, добавленные во время вывода, не показываем
+    return iter(history.last(count))
 
 # КОМАНДЫ РАБОТАЮЩИЕ С VFS
 
-def need_vfs(): # проверка, что vfs подключен
-    if 'vfs' not in globals():
+def need_vfs(): # проверка, что vfs подключен (пока vfs грузится в фоне - ждем)
+    while VFS_READY is not None and not VFS_READY.wait(0.05):
+        if cancelled():
+            return False, "ожидание загрузки VFS прервано"
+    if vfs is None:
         return False, "VFS не подключён"
     return True, None
 
@@ -67,18 +118,283 @@ def cmd_cd(path=None):
     except Exception as e:
         return f"Ошибка cd: {e}"
 
-@command("cat") # вывод содержимого файла
-def cmd_cat(path=None):
+@command("cat", stdin=True) # вывод содержимого файла (без пути в конвейере - ввод как есть)
+def cmd_cat(path=None, stdin=None):
+    if not path and stdin is not None:
+        return stdin
     ok, err = need_vfs()
     if not ok:
         return f"Ошибка: {err}"
     if not path:
         return "Usage: cat <path>"
     try:
-        return vfs.read_text(path)
+        return vfs.iter_bytes(path) # файл выводится кусками, целиком в память не читается
     except Exception as e:
         return f"Ошибка cat: {e}"
 
+# кусок, которым head и tail читают файл (читается только то, что выводится)
+READ_CHUNK = 8192
+
+# разбор [-n N | -c N] [path] для head и tail: (путь или None, число, по байтам ли) или None
+def parse_count(args, default=10, piped=False):
+    count, by_bytes = default, False
+    if len(args) >= 2 and args[0] in ("-n", "-c"):
+        by_bytes = args[0] == "-c"
+        try:
+            count = int(args[1])
+        except ValueError:
+            return None
+        args = args[2:]
+    if len(args) != (0 if piped else 1) or count < 0: # в конвейере путь не нужен
+        return None
+    return args[0] if args else None, count, by_bytes
+
+# первые n строк файла: читается с начала кусками, пока не встретится n переводов строки
+def head_lines(path, n, size):
+    pos = 0
+    while n > 0 and pos < size and not cancelled():
+        chunk = bytes(vfs.read_range(path, pos, READ_CHUNK))
+        pos += len(chunk)
+        end = 0
+        while n > 0: # ищем конец n-й строки в куске
+            nl = chunk.find(b"\n", end)
+            if nl == -1:
+                end = len(chunk)
+                break
+            end = nl + 1
+            n -= 1
+        yield chunk[:end]
+
+# последние n строк файла: читается с конца кусками, пока не встретится n переводов строки
+def tail_lines(path, n, size):
+    parts, pos = [], size
+    while n > 0 and pos > 0 and not cancelled():
+        start = max(0, pos - READ_CHUNK)
+        chunk = bytes(vfs.read_range(path, start, pos - start))
+        idx = len(chunk)
+        if pos == size and chunk.endswith(b"\n"): # перевод строки в конце файла новую строку не начинает
+            idx -= 1
+        while n > 0:
+            nl = chunk.rfind(b"\n", 0, idx)
+            if nl == -1:
+                break
+            idx = nl
+            n -= 1
+        parts.append(chunk[idx + 1:] if n == 0 else chunk)
+        pos = start
+    yield from reversed(parts)
+
+# первые n строк (или байт) потока: дальше поток не читается
+def head_stream(chunks, n, by_bytes):
+    if by_bytes:
+        for chunk in chunks:
+            if n <= 0:
+                return
+            chunk = bytes(chunk[:n])
+            n -= len(chunk)
+            yield chunk
+        return
+    for line in iter_lines(chunks):
+        if n <= 0:
+            return
+        n -= 1
+        yield line
+
+# последние n строк (или байт) потока: хранятся только они
+def tail_stream(chunks, n, by_bytes):
+    if by_bytes:
+        buf = bytearray()
+        for chunk in chunks:
+            buf += chunk
+            del buf[:max(0, len(buf) - n)]
+        yield bytes(buf)
+        return
+    yield from collections.deque(iter_lines(chunks), maxlen=n)
+
+@command("head", stdin=True) # первые строки (или байты) файла или ввода
+def cmd_head(*args, stdin=None):
+    parsed = parse_count(args, piped=stdin is not None)
+    if parsed is None:
+        return "Usage: head [-n N | -c N] <path>"
+    path, count, by_bytes = parsed
+    if stdin is not None:
+        return head_stream(stdin, count, by_bytes)
+    ok, err = need_vfs()
+    if not ok:
+        return f"Ошибка: {err}"
+    try:
+        path = vfs.abspath(path)
+        size = vfs.file_size(path)
+        if by_bytes:
+            return iter((vfs.read_range(path, 0, count),))
+        return head_lines(path, count, size)
+    except Exception as e:
+        return f"Ошибка head: {e}"
+
+@command("tail", stdin=True) # последние строки (или байты) файла или ввода
+def cmd_tail(*args, stdin=None):
+    parsed = parse_count(args, piped=stdin is not None)
+    if parsed is None:
+        return "Usage: tail [-n N | -c N] <path>"
+    path, count, by_bytes = parsed
+    if stdin is not None:
+        return tail_stream(stdin, count, by_bytes)
+    ok, err = need_vfs()
+    if not ok:
+        return f"Ошибка: {err}"
+    try:
+        path = vfs.abspath(path)
+        size = vfs.file_size(path)
+        if by_bytes:
+            return iter((vfs.read_range(path, -count, count) if count else b"",))
+        return tail_lines(path, count, size)
+    except Exception as e:
+        return f"Ошибка tail: {e}"
+
+@command("wc", stdin=True) # число строк, слов и байт в файле или вводе (-c по файлу - по размеру, без чтения)
+def cmd_wc(*args, stdin=None):
+    flags = [a for a in args if a in ("-l", "-w", "-c")]
+    paths = [a for a in args if a not in flags]
+    if len(paths) != (0 if stdin is not None else 1):
+        return "Usage: wc [-l] [-w] [-c] <path>"
+    flags = flags or ["-l", "-w", "-c"]
+    if stdin is None:
+        ok, err = need_vfs()
+        if not ok:
+            return f"Ошибка: {err}"
+    try:
+        if stdin is not None:
+            lines, words, size = count_chunks(stdin)
+        elif "-l" in flags or "-w" in flags: # строки и слова - потоком, файл целиком в память не читается
+            lines, words, size = count_chunks(vfs.iter_bytes(paths[0]))
+        else:
+            lines, words, size = 0, 0, vfs.file_size(paths[0])
+    except InterruptedError:
+        return "Команда прервана."
+    except Exception as e:
+        return f"Ошибка wc: {e}"
+    counts = {"-l": lines, "-w": words, "-c": size}
+    return " ".join(str(counts[f]) for f in ("-l", "-w", "-c") if f in flags) + "".join(f" {p}" for p in paths)
+
+# размер для вывода: байты или (human) 1.5K, 20M
+def format_size(n, human=False):
+    if not human:
+        return str(n)
+    for unit in ("", "K", "M", "G", "T"):
+        if n < 1024 or unit == "T":
+            return f"{n}{unit}" if not unit or n >= 10 else f"{n:.1f}{unit}"
+        n /= 1024
+
+@command("du") # размер директорий (по итогам поддеревьев, без чтения файлов)
+def cmd_du(*args):
+    ok, err = need_vfs()
+    if not ok:
+        return f"Ошибка: {err}"
+    usage = "Usage: du [-h] [-s | -d N] [path ...]"
+    human, depth, paths = False, None, []
+    try:
+        i = 0
+        while i < len(args):
+            if args[i] == "-h":
+                human = True
+            elif args[i] == "-s":
+                depth = 0
+            elif args[i] == "-d":
+                depth = int(args[i + 1])
+                i += 1
+            elif args[i].startswith("-"):
+                return usage
+            else:
+                paths.append(args[i])
+            i += 1
+    except (IndexError, ValueError):
+        return usage
+    try:
+        rows = [vfs.du(path, depth) for path in paths or ["."]] # ошибки путей - до начала вывода
+    except Exception as e:
+        return f"Ошибка du: {e}"
+    return (f"{format_size(size, human)}\t{path}" for row in rows for path, size, _ in row)
+
+@command("stat") # сведения об элементе: размер, для директории - итоги поддерева, для файла - хэш и ссылки
+def cmd_stat(path=None):
+    ok, err = need_vfs()
+    if not ok:
+        return f"Ошибка: {err}"
+    if not path:
+        return "Usage: stat <path>"
+    try:
+        st = vfs.stat(path)
+    except Exception as e:
+        return f"Ошибка stat: {e}"
+    if st["type"] == "dir":
+        return [
+            f"Путь: {st['path']}",
+            "Тип: директория",
+            f"Размер: {st['size']} байт (все файлы поддерева)",
+            f"Элементов: {st['entries']}, файлов в поддереве: {st['files']}, директорий: {st['dirs']}",
+        ]
+    lines = [f"Путь: {st['path']}", "Тип: файл", f"Размер: {st['size']} байт"]
+    if st["hash"] is not None:
+        lines.append(f"Содержимое: {st['hash']}, ссылок: {st['refs']}")
+    if st["stored"] is not None:
+        lines.append(f"В образе: {st['stored']} байт" + (f" ({st['codec']})" if st["codec"] else ""))
+    return lines
+
+# строк дерева на страницу по умолчанию
+TREE_PAGE = 100
+
+@command("tree") # дерево директории по страницам (размеры - по итогам поддеревьев)
+def cmd_tree(*args):
+    ok, err = need_vfs()
+    if not ok:
+        return f"Ошибка: {err}"
+    usage = "Usage: tree [-L depth] [-n lines] [-p page] [path]"
+    depth, size, page, path = None, TREE_PAGE, 1, "."
+    try:
+        i = 0
+        while i < len(args):
+            if args[i] in ("-L", "-n", "-p"):
+                n = int(args[i + 1])
+                if n < 1:
+                    return usage
+                if args[i] == "-L":
+                    depth = n
+                elif args[i] == "-n":
+                    size = n
+                else:
+                    page = n
+                i += 2
+            elif not args[i].startswith("-") and path == ".":
+                path = args[i]
+                i += 1
+            else:
+                return usage
+    except (IndexError, ValueError):
+        return usage
+    try:
+        total, files, _ = vfs.totals(path)
+        rows = vfs.tree(path, depth, skip=(page - 1) * size)
+    except Exception as e:
+        return f"Ошибка tree: {e}"
+
+    def lines():
+        yield f"{vfs.abspath(path)} [{format_size(total, True)}, файлов {files}]"
+        shown = 0
+        for indent, name, is_dir, bytes_, count in rows:
+            if shown == size: # строки дальше есть - подсказка, как открыть следующую страницу
+                more = "tree" + (f" -L {depth}" if depth else "") + (f" -n {size}" if size != TREE_PAGE else "")
+                more += f" -p {page + 1}" + (f' "{path}"' if path != "." else "")
+                yield f"-- страница {page}, дальше: {more} --"
+                return
+            shown += 1
+            if is_dir:
+                yield f"{indent}{name}/ [{format_size(bytes_, True)}, файлов {count}]"
+            else:
+                yield f"{indent}{name} [{format_size(bytes_, True)}]"
+        if not shown and page > 1:
+            yield f"-- страница {page} пуста --"
+    return lines()
+
 @command("mkdir") # создать директорию
 def cmd_mkdir(path=None):
     ok, err = need_vfs()
@@ -106,6 +422,19 @@ def cmd_write(path=None, *text):
     except Exception as e:
         return f"Ошибка write: {e}"
 
+@command("cp") # копировать файл (содержимое не дублируется)
+def cmd_cp(src=None, dst=None):
+    ok, err = need_vfs()
+    if not ok:
+        return f"Ошибка: {err}"
+    if not src or not dst:
+        return "Usage: cp <src> <dst>"
+    try:
+        vfs.copy(src, dst)
+        return "ok"
+    except Exception as e:
+        return f"Ошибка cp: {e}"
+
 @command("rm") # удалить файл или пустую директорию
 def cmd_rm(path=None):
     ok, err = need_vfs()
@@ -132,6 +461,100 @@ def cmd_rmdir(path=None):
     except Exception as e:
         return f"Ошибка rmdir: {e}"
 
+@command("stats") # статистика: время команд, работа vfs, дедупликация содержимого файлов
+def cmd_stats():
+    lines = ["=== Команды ==="] + (metrics.command_report() or ["(нет вызовов)"])
+    if vfs is None:
+        return lines
+    v = vfs.vfs_stats()
+    lines.append("=== VFS ===")
+    lines.append(f"Пройдено узлов при поиске путей: {v['node_visits']}")
+    lines.append(f"Кэш путей: попаданий {v['cache']['hits']}, промахов {v['cache']['misses']}, записей {v['cache']['size']}")
+    d = v["decoded"]
+    lines.append(f"Кэш содержимого: попаданий {d['hits']}, промахов {d['misses']} ({d['hit_rate']:.0%}), "
+                 f"файлов {d['items']}, {d['size']} из {d['limit']} байт")
+    lines.append(f"Снимков: {v['snapshots']}, скопировано директорий при записи: {v['cow_copies']}")
+    lines.append("Вызовы: " + ", ".join(f"{k}={n}" for k, n in sorted(v["ops"].items())))
+    s = vfs.blob_stats()
+    lines += [
+        f"Блобов (уникальных содержимых): {s['blobs']}",
+        f"Ссылок на блобы (файлов): {s['refs']}",
+        f"Хранится байт: {s['physical']} (после сжатия {s['stored']}, сжатых блобов {s['compressed']})",
+        f"Байт в файлах: {s['logical']}",
+        f"Коэффициент дедупликации: {s['ratio']:.2f}",
+    ]
+    return lines
+
+# условие на размер для find: "+10k" - больше, "-10k" - меньше, "10k" - ровно
+def parse_size(spec):
+    units = {"k": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    sign = spec[0] if spec[:1] in ("+", "-") else ""
+    num = spec[len(sign):]
+    mult = units.get(num[-1:], 1)
+    n = int(num[:-1] if num[-1:] in units else num) * mult
+    if sign == "+":
+        return lambda size: size > n
+    if sign == "-":
+        return lambda size: size < n
+    return lambda size: size == n
+
+@command("find") # поиск по имени, типу и размеру (по индексу, без обхода дерева)
+def cmd_find(*args):
+    ok, err = need_vfs()
+    if not ok:
+        return f"Ошибка: {err}"
+    usage = "Usage: find [path] [-name <glob>] [-type f|d] [-size [+-]N[kMG]]"
+    path, name, kind, size = ".", None, None, None
+    try:
+        i = 0
+        while i < len(args):
+            if args[i] == "-name":
+                name = args[i + 1]
+            elif args[i] == "-type" and args[i + 1] in ("f", "d"):
+                kind = args[i + 1]
+            elif args[i] == "-size":
+                size = parse_size(args[i + 1])
+            elif i == 0 and not args[i].startswith("-"):
+                path = args[i]
+                i += 1
+                continue
+            else:
+                return usage
+            i += 2
+    except (IndexError, ValueError):
+        return usage
+    try:
+        return vfs.find(path, name=name, kind=kind, size=size)
+    except Exception as e:
+        return f"Ошибка find: {e}"
+
+# строки потока, подходящие под регулярное выражение
+def grep_stream(chunks, rx):
+    for line in iter_lines(chunks):
+        if rx.search(line.decode("utf-8", errors="replace")):
+            yield line if line.endswith(b"\n") else line + b"\n" # как grep: строка вывода всегда законченная
+
+@command("grep", stdin=True) # поиск по содержимому файлов (читаются только подходящие по индексу триграмм) или по вводу
+def cmd_grep(*args, stdin=None):
+    ignore_case = bool(args) and args[0] == "-i"
+    if ignore_case:
+        args = args[1:]
+    if not args or len(args) > (1 if stdin is not None else 2):
+        return "Usage: grep [-i] <pattern> [path]"
+    if stdin is not None: # в конвейере - фильтр строк ввода
+        try:
+            return grep_stream(stdin, re.compile(args[0], re.IGNORECASE if ignore_case else 0))
+        except re.error as e:
+            return f"Ошибка grep: {e}"
+    ok, err = need_vfs()
+    if not ok:
+        return f"Ошибка: {err}"
+    try:
+        matches = vfs.grep(args[0], args[1] if len(args) > 1 else ".", ignore_case=ignore_case)
+    except Exception as e:
+        return f"Ошибка grep: {e}"
+    return (f"{path}:{lineno}:{line}" for path, lineno, line in matches if not cancelled())
+
 @command("save") # комманда разработчика для сохранения json для радактирования
 def cmd_save(name=None):
     ok, err = need_vfs()
@@ -141,8 +564,51 @@ def cmd_save(name=None):
         name = vfs.filename
     if name != vfs.filename and not debug_mode:
         return "Создание нового файла в реальной OC запрещено"
+    if vfs.readonly:
+        return "Ошибка save: vfs открыта только для чтения"
     try:
         vfs.save(name)
         return f"vfs {name} сохранена"
     except Exception:
-        return "Usage: <file_name>.json"
\ No newline at end of file
+        return "Usage: <file_name>.json"
+
+@command("compact") # свернуть журнал изменений в образ
+def cmd_compact():
+    ok, err = need_vfs()
+    if not ok:
+        return f"Ошибка: {err}"
+    try:
+        vfs.compact()
+        return f"vfs {vfs.filename} свернута"
+    except Exception as e:
+        return f"Ошибка compact: {e}"
+
+@command("snapshot") # снимок vfs: откатить к нему можно командой rollback
+def cmd_snapshot(*args):
+    ok, err = need_vfs()
+    if not ok:
+        return f"Ошибка: {err}"
+    usage = "Usage: snapshot [name] | snapshot -l | snapshot -d [name]"
+    try:
+        if args[:1] == ("-l",) and len(args) == 1: # список снимков
+            return [f"{name}: скопировано директорий {copies}" for name, copies in vfs.snapshots()] or "Снимков нет"
+        if args[:1] == ("-d",) and len(args) <= 2: # удалить снимок (изменения остаются)
+            vfs.drop_snapshot(args[1] if len(args) > 1 else None)
+            return "Снимок удален"
+        if len(args) > 1 or args[:1] and args[0].startswith("-"):
+            return usage
+        return f"Снимок {vfs.snapshot(args[0] if args else None)} создан"
+    except Exception as e:
+        return f"Ошибка snapshot: {e}"
+
+@command("rollback") # откат vfs к снимку (по умолчанию к последнему)
+def cmd_rollback(*args):
+    ok, err = need_vfs()
+    if not ok:
+        return f"Ошибка: {err}"
+    if len(args) > 1:
+        return "Usage: rollback [name]"
+    try:
+        return f"Откат к снимку {vfs.rollback(args[0] if args else None)}"
+    except Exception as e:
+        return f"Ошибка rollback: {e}"
@@ -0,0 +1,172 @@
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+# история команд: кольцевой буфер на cap последних строк с индексом для поиска
+# и дописыванием в файл истории (файл не перезаписывается при каждой команде)
+# у каждой строки есть номер seq (растет с каждой добавленной строкой), строка seq лежит в ячейке seq % cap
+# индекс поиска - блоки по BLOCK_LINES строк, склеенные в один текст ("\n" перед каждой строкой) с таблицей начал строк:
+# подстрока и начало строки ищутся в тексте блока на C (str.find/rfind), номер строки - двоичным поиском по таблице
+
+# сколько строк хранится по умолчанию (время поиска без совпадений растет с числом строк)
+HISTORY_SIZE = 10000
+# строк в блоке индекса
+BLOCK_LINES = 512
+
+class History:
+    def __init__(self, cap=HISTORY_SIZE, path=None):
+        self.cap = max(1, cap)
+        self.path = path
+        self._block = min(BLOCK_LINES, self.cap) # блок целиком помещается в буфер, пока он собирается
+        self._ring = [None] * self.cap
+        self._next = 0 # номер следующей строки
+        self._blocks = {} # номер блока -> (текст, начала строк в тексте)
+        self._file = None # файл истории, открытый на дописывание
+        self._lock = threading.Lock() # строки добавляют и главный поток (ввод), и рабочий (скрипт)
+        if path:
+            complete = self._load(path)
+            self._file = open(path, "a", encoding="utf-8")
+            if not complete: # последняя строка файла оборвана (аварийное завершение) - не склеиваем с ней новую
+                self._file.write("\n")
+
+    # номер самой старой строки в буфере
+    @property
+    def first(self):
+        return max(0, self._next - self.cap)
+
+    def __len__(self):
+        return self._next - self.first
+
+    # строки от старых к новым
+    def __iter__(self):
+        ring, cap = self._ring, self.cap
+        return (ring[seq % cap] for seq in range(self.first, self._next))
+
+    # i-я строка буфера (отрицательные - с конца, как у списка)
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("history index out of range")
+        return self._ring[(self.first + i) % self.cap]
+
+    # строка по номеру (None, если уже вытеснена)
+    def get(self, seq):
+        if self.first <= seq < self._next:
+            return self._ring[seq % self.cap]
+        return None
+
+    # добавить строку (и дописать ее в файл истории)
+    def append(self, line):
+        line = line.replace("\n", " ")
+        with self._lock:
+            self._push(line)
+            if self._file is not None:
+                self._file.write(line + "\n")
+
+    # строка в буфер; собранный блок склеивается в индекс, вытесненные блоки выбрасываются
+    def _push(self, line):
+        self._ring[self._next % self.cap] = line
+        self._next += 1
+        if self._next % self._block == 0:
+            k = self._next // self._block - 1
+            lines = [self._ring[seq % self.cap] for seq in range(k * self._block, self._next)]
+            starts = array("q", accumulate((len(line) + 1 for line in lines), initial=1))
+            self._blocks[k] = ("\n" + "\n".join(lines), starts)
+            self._blocks.pop(self.first // self._block - 1, None)
+
+    # последние n строк (все, если n не задано)
+    def last(self, n=None):
+        start = self.first if n is None else max(self.first, self._next - n)
+        ring, cap = self._ring, self.cap
+        return [ring[seq % cap] for seq in range(start, self._next)]
+
+    # самая новая строка, содержащая query, с номером меньше before: (номер, строка) или None
+    def search(self, query, before=None):
+        if "\n" in query:
+            return None
+        return self._find(query, before, lambda line: query in line, 0)
+
+    # самая новая строка, начинающаяся с prefix, с номером меньше before: (номер, строка) или None
+    def prefix(self, prefix, before=None):
+        if "\n" in prefix:
+            return None
+        return self._find("\n" + prefix, before, lambda line: line.startswith(prefix), 1)
+
+    # поиск от новых строк к старым: сначала несобранный хвост (по строкам), потом блоки индекса (по тексту);
+    # skip - сколько символов needle стоит перед началом строки
+    def _find(self, needle, before, match, skip):
+        first = self.first
+        before = self._next if before is None else max(first, min(before, self._next))
+        sealed = self._next - self._next % self._block # начало несобранного хвоста
+        for seq in range(before - 1, max(sealed, first) - 1, -1):
+            line = self._ring[seq % self.cap]
+            if match(line):
+                return seq, line
+        for k in range((min(before, sealed) - 1) // self._block, first // self._block - 1, -1):
+            text, starts = self._blocks[k]
+            base = k * self._block
+            end = starts[before - base] - 1 if before - base < self._block else len(text) # только строки до before
+            if needle not in text: # прямой поиск быстрее обратного - сначала проверяем, есть ли совпадение вообще
+                continue
+            pos = text.rfind(needle, 0, end)
+            if pos == -1:
+                continue
+            seq = base + bisect_right(starts, pos + skip) - 1
+            if seq < first: # совпадение в уже вытесненной части блока
+                return None
+            return seq, self._ring[seq % self.cap]
+        return None
+
+    # очистить историю в памяти (файл не трогается)
+    def clear(self):
+        with self._lock:
+            self._ring = [None] * self.cap
+            self._next = 0
+            self._blocks = {}
+
+    # загрузка последних cap строк файла истории: файл читается с конца, пока не наберется cap строк;
+    # возвращает False, если файл не заканчивается переводом строки
+    def _load(self, path):
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return True
+        with f:
+            f.seek(0, os.SEEK_END)
+            size = pos = f.tell()
+            chunks, newlines = [], 0
+            while pos > 0 and newlines <= self.cap:
+                step = min(pos, 1024 * 1024)
+                pos -= step
+                f.seek(pos)
+                chunk = f.read(step)
+                newlines += chunk.count(b"\n")
+                chunks.append(chunk)
+        data = b"".join(reversed(chunks))
+        lines = [line for line in data.decode("utf-8", errors="replace").split("\n") if line]
+        total = len(lines)
+        lines = lines[-self.cap:]
+        for line in lines:
+            self._push(line)
+        # в файле намного больше строк, чем хранится - один раз при запуске оставляем только хвост
+        if pos > 0 and size > 2 * len(data) or total > 2 * self.cap:
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as out:
+                out.writelines(line + "\n" for line in lines)
+            os.replace(tmp, path)
+            return True
+        return not data or data.endswith(b"\n")
+
+    # сбросить дописанные строки на диск
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -1,25 +1,70 @@
+import metrics # первым: от его импорта считаются этапы запуска
 import os
-import shlex
-import socket
+import sys
 import importlib
-import traceback
-import argparse
-from tkinter import *
-from tkinter.scrolledtext import ScrolledText
+import codecs
+import bisect
+import queue
+import threading
+from collections.abc import Iterator
+import script_cache
+from history import History, HISTORY_SIZE
 from vfs_json import open_vfs_from_json
+# тяжелые модули (tkinter, argparse, socket, traceback, concurrent.futures) импортируются там, где нужны
 
 COMMANDS = {}
 COMMANDS_MODULE_NAME = "commands"
 LOADED_COMMANDS_MODULE = None
+COMMANDS_SOURCE = None # исходник модуля комманд: перезагружается, только если он изменился
+PLUGINS = None # реестр плагинов команд (модули импортируются при первом вызове их команд)
+RELOAD_PENDING = False # наблюдатель уже поставил перезагрузку в очередь
+HISTORY_FILE = ".vfs_console_history" # файл истории в домашней директории (для GUI)
 
 # интерфейс коммандой строки
-def parse_cli():
+def parse_cli(argv=None):
+    import argparse
     p = argparse.ArgumentParser(description="Emulator GUI")
     p.add_argument("--vfs", dest="vfs_path", help="Путь к JSON VFS (источник)", default=None)
     p.add_argument("--script", dest="startup_script", help="Путь к стартовому скрипту (файл с командами эмулятора)", default=None)
-    return p.parse_args()
-
-ARGS = parse_cli()
+    p.add_argument("--journal", action="store_true", help="Вести журнал изменений VFS вместо полной перезаписи при save")
+    p.add_argument("--transaction", action="store_true", help="Выполнить --script как транзакцию: при ошибке изменения VFS откатываются")
+    p.add_argument("--headless", action="store_true", help="Выполнить --script без GUI (tkinter не импортируется), код выхода - результат скрипта")
+    p.add_argument("--output", dest="output_path", help="Файл для вывода в режиме --headless (по умолчанию stdout)", default=None)
+    p.add_argument("--scrollback", type=int, default=10000, help="Сколько последних строк хранить в окне консоли")
+    p.add_argument("--compress", action="store_true", help="Сжимать содержимое файлов VFS (zlib/lzma по размеру), в том числе при save")
+    p.add_argument("--cache-mb", dest="cache_mb", type=int, default=32, help="Бюджет памяти кэша декодированного содержимого файлов, МБ")
+    p.add_argument("--profile", dest="profile_path", help="Профилировать сеанс (cProfile + tracemalloc) и сохранить отчет в файл", default=None)
+    p.add_argument("--history", dest="history_path", default=None,
+                   help="Файл истории команд (по умолчанию ~/" + HISTORY_FILE + " в GUI, без файла в --headless)")
+    p.add_argument("--history-size", dest="history_size", type=int, default=HISTORY_SIZE, help="Сколько последних команд хранить в истории")
+    p.add_argument("--plugins", dest="plugin_dir", default=None, help="Директория плагинов команд (по умолчанию plugins рядом с main.py)")
+    p.add_argument("--watch", action="store_true", help="Следить за файлами команд и плагинов и перезагружать измененные")
+    return p.parse_args(argv)
+
+# аргументы разбираются в main(); при импорте модуля (bench, batch) - None
+ARGS = None
+
+root = None # окно tkinter (в режиме --headless не создается)
+OUT = None # поток вывода вместо окна консоли в режиме --headless
+EXIT_REQUESTED = False # была выполнена команда exit
+
+# буфер вывода: строки копятся и выводятся в окно пачкой раз в кадр
+FLUSH_DELAY_MS = 16 # период сброса буфера (~60 кадров в секунду)
+PENDING = [] # строки, ожидающие вывода
+PENDING_LINES = 0 # сколько в них строк текста
+FLUSH_SCHEDULED = False # сброс уже запланирован через root.after
+DROPPED_LINES = 0 # сколько старых строк выброшено из-за ограничения прокрутки
+
+# выполнение команд в фоновом потоке
+MAIN_THREAD = threading.main_thread()
+RESULTS = queue.Queue() # вывод и события от рабочего потока, разбирается в главном потоке
+POLL_MS = 15 # период опроса очереди результатов
+RESULT_LINES = 256 # на сколько сообщений вывода рабочий поток может обогнать главный (дальше ждет разбора очереди)
+LINE_SLOTS = threading.Semaphore(RESULT_LINES) # свободные места для вывода в очереди результатов
+CANCEL = threading.Event() # запрос на прерывание текущей команды (Ctrl+C)
+VFS_LOCK = threading.RLock() # с vfs одновременно работает только одна команда
+EXECUTOR = None # исполнитель команд (создается вместе с окном)
+RUNNING = 0 # сколько команд отправлено в исполнитель и еще не завершилось
 
 # GUI имя
 def setGUITitle():
@@ -30,58 +75,128 @@ def setGUITitle():
         user = os.environ.get("USER") or os.environ.get("USERNAME") or "unknown"
     # попытка установки хоста
     try:
+        import socket
         host = socket.gethostname()
     except Exception:
         host = os.environ.get("HOSTNAME", "unknown")
     return f"Эмулятор - [{user.strip()}@{host.strip()}]"
 
+# вывод потока, выполняющего команду сеанса сервера (vfs_server): SESSION_OUT.write(строка)
+SESSION_OUT = threading.local()
+
 # запись в консоль
 def write_console(msg):
+    global PENDING_LINES, FLUSH_SCHEDULED
+    session_write = getattr(SESSION_OUT, "write", None)
+    if session_write is not None: # команда сеанса сервера - вывод клиенту этого сеанса
+        session_write(str(msg))
+        return
+    if OUT is not None: # без GUI - пишем в поток
+        OUT.write(str(msg) + '\n')
+        return
+    if threading.current_thread() is not MAIN_THREAD: # из рабочего потока - через очередь
+        # ждем, пока главный поток разберет вывод: память не растет с размером вывода команды
+        while not LINE_SLOTS.acquire(timeout=POLL_MS / 1000):
+            if CANCEL.is_set(): # команду прервали (или окно закрыто) - вывод уже не нужен
+                return
+        RESULTS.put(("line", msg))
+        return
+    msg = str(msg)
+    PENDING.append(msg) # копим строку до следующего кадра
+    PENDING_LINES += msg.count('\n') + 1
+    if PENDING_LINES > 2 * ARGS.scrollback: # в окно все равно попадут только последние строки
+        trim_pending()
+    if not FLUSH_SCHEDULED:
+        FLUSH_SCHEDULED = True
+        root.after(FLUSH_DELAY_MS, flush_console)
+
+# выбросить из буфера самые старые строки сверх лимита прокрутки
+def trim_pending():
+    global PENDING_LINES, DROPPED_LINES
+    while PENDING and PENDING_LINES > ARGS.scrollback:
+        n = PENDING[0].count('\n') + 1
+        if PENDING_LINES - n < ARGS.scrollback: # отрезаем часть многострочного сообщения
+            cut = PENDING_LINES - ARGS.scrollback
+            PENDING[0] = PENDING[0].split('\n', cut)[cut]
+            PENDING_LINES -= cut
+            DROPPED_LINES += cut
+            break
+        PENDING.pop(0)
+        PENDING_LINES -= n
+        DROPPED_LINES += n
+
+# вывод накопленных строк в окно одной вставкой
+def flush_console():
+    global PENDING_LINES, FLUSH_SCHEDULED, DROPPED_LINES
+    FLUSH_SCHEDULED = False
+    if not PENDING:
+        return
+    trim_pending()
+    text = '\n'.join(PENDING) + '\n'
+    PENDING.clear()
+    PENDING_LINES = 0
+
     console.configure(state='normal') # включаем редактирование
-    console.insert(END, str(msg) + '\n') # записываем в конец
+    console.insert(tk.END, text) # записываем в конец
+    # обрезаем самые старые строки сверх лимита прокрутки
+    lines = int(console.index('end-1c').split('.')[0]) - 1
+    if lines > ARGS.scrollback:
+        excess = lines - ARGS.scrollback
+        console.delete('1.0', f'{excess + 1}.0')
+        DROPPED_LINES += excess
     console.configure(state='disabled') # выключаем редактирование
-    console.see(END) # проматываем вниз
+    console.see(tk.END) # проматываем вниз
+    if DROPPED_LINES:
+        status.configure(text=f"Скрыто старых строк: {DROPPED_LINES}")
 
-# загрузка VFS
+# VFS (загружается в main())
 vfs = None
-if ARGS.vfs_path:
-    vfs = open_vfs_from_json(ARGS.vfs_path)
 
 
 # парсер комманд
 def parser(line):
-    try: # пытаемся с помощью модуля шлекс разобрать строку на токены
-        raw_tokens = shlex.split(line, posix=True)
+    try: # разбираем строку на токены (shlex - только если есть кавычки или экранирование)
+        raw_tokens = script_cache.split_line(line)
     except ValueError as e: # если не получилось - ошибка
         write_console(f"Ошибка разбора строки: {e}")
         return []
-    expanded = []
-    for token in raw_tokens:
-        # раскрытие окружения реальной OC
-        token = os.path.expanduser(token) #раскрывает ~d
-        token = os.path.expandvars(token) #раскрыавает %d%, $HOME, ${HOME}
-        if "$HOME" in token or "${HOME}" in token or "%HOME%" in token: # если методы сверху не сработали
-            home = os.path.expanduser("~")
-            token = token.replace("$HOME", home).replace("${HOME}", home).replace("%HOME%", home)
-        # добавляем токен в конечный список
-        expanded.append(token)
-    return expanded
-
-# загрузчик команд
+    # раскрытие окружения реальной OC (только для токенов с ~, $ или %)
+    return script_cache.expand_tokens(raw_tokens)
+
+# загрузчик команд: модуль commands и плагины; перезагружаются только модули, исходник которых изменился
+# возвращает число измененных модулей
 def commands_loader():
-    global LOADED_COMMANDS_MODULE, COMMANDS
+    global LOADED_COMMANDS_MODULE, COMMANDS, COMMANDS_SOURCE, PLUGINS
+    import command_plugins
+    if PLUGINS is None:
+        plugin_dir = ARGS.plugin_dir if ARGS is not None and ARGS.plugin_dir else command_plugins.PLUGIN_DIR
+        PLUGINS = command_plugins.PluginRegistry(plugin_dir)
+    changed = 0
     try:
         if LOADED_COMMANDS_MODULE is None: # если не загружен модуль комманд - загружаем
             LOADED_COMMANDS_MODULE = importlib.import_module(COMMANDS_MODULE_NAME)
-        else: # иначе перезагружаем
+            COMMANDS_SOURCE = command_plugins.Source(LOADED_COMMANDS_MODULE.__file__)
+            COMMANDS_SOURCE.refresh()
+            changed += 1
+        elif COMMANDS_SOURCE.refresh() is not None: # иначе перезагружаем, если исходник изменился
+            changed += 1
             LOADED_COMMANDS_MODULE = importlib.reload(LOADED_COMMANDS_MODULE)
     except Exception as e: # в случае ошибки
+        if COMMANDS_SOURCE is not None: # следующая перезагрузка попробует снова
+            COMMANDS_SOURCE.stamp = COMMANDS_SOURCE.digest = None
         # выводим сообщение о модуле
         write_console(f"Не удалось загрузить модуль {COMMANDS_MODULE_NAME}: {e}")
         # выводим ошибку python
+        import traceback
         write_console(traceback.format_exc())
         COMMANDS = {}
-        return
+        return changed
+    # плагины: новые, удаленные и измененные файлы
+    changed += PLUGINS.scan()
+    for path, err in PLUGINS.errors:
+        write_console(f"Не удалось загрузить плагин {path}: {err}")
+    if not changed and COMMANDS: # ничего не изменилось - словарь комманд остается прежним
+        return 0
     # добавляем комманды
     new_commands = {}
     # проверяем, что существует объект COMMANDS и что он словарь
@@ -89,81 +204,203 @@ def commands_loader():
         for k, v in getattr(LOADED_COMMANDS_MODULE, "COMMANDS").items(): # проходимя по словарю и добавляем команды
             if callable(v):
                 new_commands[str(k)] = v
+    # комманды плагинов (не загруженные еще модули - ленивые заглушки); при совпадении имен приоритет у модуля комманд
+    for k, v in PLUGINS.commands().items():
+        new_commands.setdefault(k, v)
     # встроенные комманды
     new_commands.setdefault("reload", builtin_reload)
     new_commands.setdefault("help", builtin_help)
 
     COMMANDS = new_commands
     write_console(f"Команды загружены: {', '.join(sorted(COMMANDS.keys()))}")
+    return changed
 
-# пробуем импортировать commands и присвоить vfs/HISTORY
-try:
-    import commands
-    # присвоим vfs в модуле commands
-    commands.vfs = vfs
-except Exception:
-    pass
-
-# перезагрузка
-def builtin_reload():
-    # снова загружаем комманды
-    commands_loader()
-    # снова установим файловую систему и историю в модуль комманд
+# установка vfs, истории и флага прерывания в модуль комманд
+def bind_commands_module():
     try:
         import commands
         commands.vfs = vfs
         commands.HISTORY = HISTORY
+        commands.CANCEL = CANCEL
+        commands.VFS_READY = VFS_READY
     except Exception:
         pass
-    return "Перезагрузка комманд выполнена."
+
+# перезагрузка (только измененных модулей)
+def builtin_reload():
+    # снова загружаем комманды
+    changed = commands_loader()
+    # снова установим файловую систему и историю в модуль комманд
+    bind_commands_module()
+    if not changed:
+        return "Перезагрузка комманд выполнена: изменений нет."
+    return f"Перезагрузка комманд выполнена: изменено модулей: {changed}."
+
+# изменились ли файлы модуля комманд или плагинов (для наблюдателя, только stat)
+def commands_touched():
+    return COMMANDS_SOURCE is not None and COMMANDS_SOURCE.touched() or PLUGINS.touched()
+
+# перезагрузка по сигналу наблюдателя (в рабочем потоке, между командами)
+def auto_reload():
+    global RELOAD_PENDING
+    RELOAD_PENDING = False
+    write_console(builtin_reload())
 
 # выводит список команд
 def builtin_help():
     names = sorted(COMMANDS.keys())
     return "Доступные команды: " + (", ".join(names) if names else "(нет команд)")
 
-# использование комманды
+# завершение эмулятора (окно закрывается только из главного потока)
+def request_quit():
+    if threading.current_thread() is not MAIN_THREAD:
+        RESULTS.put(("quit", None))
+        return
+    try:
+        root.quit()
+    except Exception:
+        pass
+
+# использование комманды (с vfs одновременно работает только одна команда)
 def use_command(tokens, source=""):
+    with VFS_LOCK:
+        finish = metrics.start_command()
+        ok = run_command(tokens, source)
+        if tokens and tokens[0] in COMMANDS: # учитываем время только известных команд
+            finish(tokens[0], ok)
+        return ok
+
+# выполнение комманды (или конвейера команд) и вывод результата
+def run_command(tokens, source=""):
     if not tokens:
         return True
-    # разбиваем список на название команды и аргументы и вызываем команду
-    name = tokens[0]
-    args = tokens[1:]
+    stages, redirect = [tokens], None
+    if script_cache.has_ops(tokens): # конвейер "a | b" и/или перенаправление "> path", ">> path"
+        try:
+            stages, redirect = script_cache.split_pipeline(tokens)
+        except ValueError as e:
+            write_console(f"Ошибка разбора строки: {e}")
+            return False
+    res = None
+    for i, stage in enumerate(stages):
+        # вывод предыдущей стадии подается на вход следующей ленивым потоком кусков байт
+        ok, res = call_command(stage[0], stage[1:], stdin=result_chunks(res) if i else None)
+        if not ok:
+            return False
+        # если строка и exit токен - прекращаем работу
+        if isinstance(res, str) and res == "__EXIT__":
+            global EXIT_REQUESTED
+            EXIT_REQUESTED = True
+            write_console("Команда exit: завершение эмулятора.")
+            request_quit()
+            return False
+        if (i < len(stages) - 1 or redirect) and is_error(res): # ошибка стадии дальше не передается
+            write_console(res)
+            return False
+    if redirect is not None:
+        return write_redirect(res, *redirect)
+    # если содержимое результата список или кортеж - выводим на экран поэлементно
+    if isinstance(res, (list, tuple)):
+        for line in res:
+            if CANCEL.is_set(): # нажали Ctrl+C - остальное не выводим
+                write_console("Команда прервана.")
+                return False
+            write_console(line)
+    elif res is None: # если нет результата - пропускаем
+        pass
+    elif isinstance(res, Iterator): # поток (генератор) - выводим по мере поступления
+        return write_stream(res)
+    else: # если один элемент - выводим его
+        write_console(res)
+    if is_error(res): # если вернулась ошибка
+        return False
+    return True
+
+# вызов одной команды: (успех, результат); stdin - поток кусков байт от предыдущей стадии конвейера
+def call_command(name, args, stdin=None):
     fn = COMMANDS.get(name)
     if fn is None:
         write_console(f"Неизвестная команда: {name}")
-        return False
+        return False, None
+    if stdin is not None and not getattr(fn, "reads_stdin", False):
+        write_console(f"Команда '{name}' не читает ввод из конвейера")
+        return False, None
     try:
-        res = fn(*args) # выполняем команду и получаем результат
+        # выполняем команду и получаем результат
+        res = fn(*args) if stdin is None else fn(*args, stdin=stdin)
     except TypeError as e: # в случае ошибки ввода
         write_console(f"Ошибка вызова команды '{name}': {e}")
-        return False
+        return False, None
     except Exception as e: # при иных ошибках
         write_console(f"Исключение при выполнении команды '{name}': {e}")
+        import traceback
         write_console(traceback.format_exc())
+        return False, None
+    return True, res
+
+# результат команды - сообщение об ошибке
+def is_error(res):
+    return isinstance(res, str) and ("Ошибка" in res or "ошибка" in res or "error" in res.lower())
+
+# результат команды как поток кусков байт (как он был бы выведен в консоль: строки - с переводом строки)
+def result_chunks(res):
+    if res is None:
+        return
+    if isinstance(res, (str, bytes, bytearray, memoryview)):
+        res = (res,)
+    for item in res:
+        if CANCEL.is_set(): # нажали Ctrl+C - поток обрывается
+            raise InterruptedError("команда прервана")
+        if isinstance(item, (bytes, bytearray, memoryview)):
+            yield item
+        else:
+            yield (str(item) + "\n").encode("utf-8")
+
+# перенаправление результата в файл vfs (">" - перезаписать, ">>" - дописать)
+def write_redirect(res, mode, path):
+    wait_vfs()
+    if vfs is None:
+        write_console("Ошибка: VFS не подключён")
         return False
-    # если строка и exit токен - прекращаем работу
-    if isinstance(res, str) and res == "__EXIT__":
-        write_console("Команда exit: завершение эмулятора.")
-        try:
-            root.quit()
-        except Exception:
-            pass
+    try: # поток читается до конца до записи: при ошибке или Ctrl+C файл не меняется
+        vfs.write_chunks(path, result_chunks(res), append=mode == ">>")
+    except InterruptedError:
+        write_console("Команда прервана.")
         return False
-    # если содержимое результата список или кортеж - выводим на экран поэлементно
-    if isinstance(res, (list, tuple)):
-        for line in res:
-            write_console(line)
-    elif res is None: # если нет результата - пропускаем
-        pass
-    else: # если один элемент - выводим его
-        write_console(res)
-    if isinstance(res, str) and ("Ошибка" in res or "ошибка" in res or "error" in res.lower()): # если вернулась ошибка
+    except Exception as e:
+        write_console(f"Ошибка записи в {path}: {e}")
         return False
     return True
 
+# вывод потокового результата: строки выводятся как есть, байты декодируются и режутся на строки
+def write_stream(stream):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    tail = None # недописанная строка из байтовых кусков
+    try:
+        for item in stream:
+            if CANCEL.is_set(): # нажали Ctrl+C - дальше не читаем
+                raise InterruptedError
+            if isinstance(item, (bytes, bytearray, memoryview)):
+                text = (tail or "") + decoder.decode(item)
+                head, sep, tail = text.rpartition("\n")
+                if sep: # выводим только законченные строки
+                    write_console(head)
+            else:
+                write_console(item)
+    except InterruptedError: # Ctrl+C (в том числе замеченный стадией конвейера)
+        write_console("Команда прервана.")
+        return False
+    except Exception as e: # ошибка внутри ленивого результата (команда выполняется по мере чтения)
+        write_console(f"Ошибка выполнения команды: {type(e).__name__}: {e}")
+        return False
+    rest = (tail or "") + decoder.decode(b"", final=True)
+    if rest: # остаток байтового потока (недописанная последняя строка)
+        write_console(rest)
+    return True
+
 # стартовый скрипт
-def run_startup_script(path):
+# transaction: True - при ошибке vfs откатывается к состоянию до скрипта (None - по флагу --transaction)
+def run_startup_script(path, transaction=None):
     # в случае ошибок загрузки скрипта
     if not path:
         return False
@@ -173,62 +410,128 @@ def run_startup_script(path):
 
     # выполнение скрипта
     write_console(f"Выполнение стартового скрипта: {path}")
-    with open(path, "r", encoding="utf-8") as f: # открываем для чтения
-        lines = f.readlines() # считываем строки
-    for idx, raw in enumerate(lines): # переделываем в словарь и проходимся по всем строкам
-        # очищаем строку от лишнего
-        line = raw.rstrip("\n")
-        stripped = line.strip()
-        if stripped == "" or stripped.startswith("#"):
-            continue
-
+    if transaction is None:
+        transaction = ARGS is not None and ARGS.transaction
+    if transaction:
+        wait_vfs() # снимок можно сделать только у загруженной vfs
+    if not transaction or vfs is None:
+        return run_script_lines(path)
+
+    with VFS_LOCK: # снимок перед скриптом - O(1), дерево не копируется
+        snap = vfs.snapshot()
+    ok = run_script_lines(path)
+    with VFS_LOCK:
+        try:
+            if not ok: # откатываем все изменения скрипта
+                vfs.rollback(snap)
+                write_console(f"Изменения скрипта отменены (откат к снимку {snap}).")
+            vfs.drop_snapshot(snap)
+        except LookupError: # скрипт сохранил vfs или сам удалил снимок - откатывать не к чему
+            if not ok:
+                write_console("Откат невозможен: снимок скрипта уже удален (vfs сохранена).")
+    return ok
+
+# выполнение строк скрипта до первой ошибки
+def run_script_lines(path):
+    # скрипт разбирается на токены один раз (повторные запуски берут его из кэша)
+    for lineno, line, tokens, expand_needed, error in script_cache.compile_script(path):
         # пишем строку в консоль
         write_console(f"> {line}")
         # сохраняем в историю
         HISTORY.append(line)
-        # токенизируем команду
-        tokens = parser(line)
+        if error is not None:
+            write_console(f"Ошибка разбора строки: {error}")
+        elif expand_needed: # раскрываем окружение при каждом запуске
+            tokens = script_cache.expand_tokens(tokens)
         if not tokens: # если не разобрали комманду - стопаем
-            write_console(f"Ошибка разбора на строке {idx+1}: {line}")
+            write_console(f"Ошибка разбора на строке {lineno}: {line}")
             return False
 
         # выполняем комманду
         ok = use_command(tokens, source="script")
 
+        if EXIT_REQUESTED: # команда exit - дальше не выполняем, это не ошибка
+            return True
         if not ok: # если комманда выдала ошибку - стопаем
-            write_console(f"Скрипт остановлен из-за ошибки на строке {idx+1}: {line}")
+            write_console(f"Скрипт остановлен из-за ошибки на строке {lineno}: {line}")
             return False
 
     write_console("Стартовый скрипт выполнен успешно.")
     return True
 
+# история комманд (модуль комманд получает ее в bind_commands_module); в main() заменяется на историю с файлом
+HISTORY = History()
+
+# история по параметрам запуска
+def open_history(gui):
+    path = ARGS.history_path
+    if path is None and gui:
+        path = os.path.join(os.path.expanduser("~"), HISTORY_FILE)
+    try:
+        return History(ARGS.history_size, path)
+    except OSError as e: # файл недоступен - история только в памяти
+        write_console(f"Не удалось открыть файл истории {path}: {e}")
+        return History(ARGS.history_size)
+
+# загрузка VFS (в GUI - в фоновом потоке, окно в это время уже отвечает)
+VFS_READY = threading.Event() # vfs загружена (или загружать нечего)
+VFS_READY.set()
+
+def load_vfs():
+    global vfs
+    try:
+        v = open_vfs_from_json(ARGS.vfs_path, journal=True if ARGS.journal else None)
+        v.compress = ARGS.compress
+        v.set_decoded_limit(ARGS.cache_mb * 1024 * 1024)
+        vfs = v
+        bind_commands_module()
+        metrics.phase("vfs")
+    except Exception as e:
+        write_console(f"Не удалось загрузить VFS {ARGS.vfs_path}: {e}")
+    finally:
+        VFS_READY.set()
+
+# дождаться загрузки vfs (Ctrl+C прерывает ожидание)
+def wait_vfs():
+    while not VFS_READY.wait(0.05):
+        if CANCEL.is_set():
+            return False
+    return True
+
+# запуск без GUI: скрипт выполняется через те же parser/use_command, вывод - в stdout или файл
+def run_headless():
+    global OUT, HISTORY
+    if not ARGS.startup_script:
+        sys.stderr.write("--headless требует --script\n")
+        return 2
+    OUT = open(ARGS.output_path, "w", encoding="utf-8") if ARGS.output_path else sys.stdout
+    try:
+        # загрузка команд, VFS и истории команд в модуль комманд
+        commands_loader()
+        metrics.phase("commands")
+        if ARGS.vfs_path:
+            load_vfs()
+        HISTORY = open_history(gui=False)
+        bind_commands_module()
+        if metrics.PROFILER is not None:
+            metrics.PROFILER.enable()
+        try:
+            ok = run_startup_script(ARGS.startup_script)
+        finally:
+            if metrics.PROFILER is not None:
+                metrics.PROFILER.disable()
+    finally:
+        HISTORY.close()
+        OUT.flush()
+        if OUT is not sys.stdout:
+            OUT.close()
+    return 0 if ok else 1
+
 # TKINTER
-# основное окно
-root = Tk()
-root.title(setGUITitle())
-root.geometry("750x520")
-
-# окно консоли с историем комманд и их выводом
-console = ScrolledText(root, wrap=WORD, background="black", foreground="white", font=("Consolas", 11))
-console.pack(fill="both", expand=True, padx=6, pady=(6,3))
-console.configure(state='disabled')
-
-# окошко для размещения строки ввода
-bottom = Frame(root)
-bottom.pack(fill="x", side="bottom", padx=6, pady=6)
-
-# строка ввода
-entry = Entry(bottom, font=("Consolas", 11))
-entry.pack(fill="x", side="left", expand=True)
-
-# история комманд
-HISTORY = []
-# установка истории комманд из модуля комманд
-try:
-    import commands
-    HISTORY = commands.HISTORY
-except Exception:
-    pass
+tk = None # модуль tkinter (импортируется только для GUI)
+console = None # окно консоли
+entry = None # строка ввода
+status = None # строка состояния
 
 # при нажатии Enter после ввода текста в строку ввода
 def on_enter(event=None):
@@ -237,10 +540,12 @@ def on_enter(event=None):
     if not line:
         return "break"
 
+    end_history_search()
     # выводим комманду в консоль
     write_console(f"> {line}")
-    # сохраняем в историю
+    # сохраняем в историю (и сразу на диск - сеанс может быть прерван)
     HISTORY.append(line)
+    HISTORY.flush()
     # если модуль commands импортирован, обновим его глобальную историю
     try:
         import commands
@@ -250,36 +555,321 @@ def on_enter(event=None):
 
     # токенизируем ввод
     tokens = parser(line)
-    # вызываем комманду
-    use_command(tokens, source="interactive")
     # очищаем строку ввода
-    entry.delete(0, END)
+    entry.delete(0, tk.END)
+    # вызываем комманду в рабочем потоке
+    submit(use_command, tokens, source="interactive")
+    return "break"
+
+# навигация по истории в строке ввода: Up/Down - по командам, начинающимся с набранного текста,
+# Ctrl+R - поиск подстроки от новых команд к старым (поиск идет по индексу истории)
+NAV = None # {"prefix": набранный текст, "seen": номера показанных строк}
+SEARCH = None # {"query": строка поиска, "seq": номер найденной строки, "draft": текст до поиска}
+# клавиши, которые не прерывают поиск
+MODIFIER_KEYS = {"Shift_L", "Shift_R", "Control_L", "Control_R", "Alt_L", "Alt_R", "Caps_Lock"}
+
+# заменить текст строки ввода
+def set_entry(text):
+    entry.delete(0, tk.END)
+    entry.insert(0, text)
+    entry.icursor(tk.END)
+
+# Up - более старая команда с тем же началом
+def on_history_up(event=None):
+    global NAV
+    end_history_search()
+    if NAV is None:
+        NAV = {"prefix": entry.get(), "seen": []}
+    found = HISTORY.prefix(NAV["prefix"], before=NAV["seen"][-1] if NAV["seen"] else None)
+    if found is not None:
+        NAV["seen"].append(found[0])
+        set_entry(found[1])
     return "break"
 
-# биндим ввод на Enter
-entry.bind("<Return>", on_enter)
-# ставим фокус на дисплее на приложение консоли
-entry.focus_set()
-
-# загрузка VFS и истории команд в модуль комманд
-commands_loader()
-try:
-    import commands
-    commands.vfs = vfs
-    commands.HISTORY = HISTORY
-except Exception:
-    pass
-
-# вывод дебаг параметров
-write_console("=== Параметры запуска ===")
-write_console(f"VFS path   : {ARGS.vfs_path}")
-write_console(f"Startup scr: {ARGS.startup_script}")
-write_console(f"Working dir: {os.getcwd()}")
-write_console(f"Environment: HOME={os.environ.get('HOME')}; USER={os.environ.get('USER') or os.environ.get('USERNAME')}")
-
-# запуск стартового скрипта
-if ARGS.startup_script:
-    run_startup_script(ARGS.startup_script)
-
-write_console("Эмулятор готов. Введите 'help' для списка команд.")
-root.mainloop()
+# Down - обратно к более новой команде (в конце - к набранному тексту)
+def on_history_down(event=None):
+    global NAV
+    if NAV is None or not NAV["seen"]:
+        return "break"
+    NAV["seen"].pop()
+    text = HISTORY.get(NAV["seen"][-1]) if NAV["seen"] else None
+    set_entry(text if text is not None else NAV["prefix"])
+    if not NAV["seen"]:
+        NAV = None
+    return "break"
+
+# Ctrl+R - начать поиск или найти следующее (более старое) совпадение
+def on_history_search(event=None):
+    global SEARCH, NAV
+    NAV = None
+    if SEARCH is None:
+        SEARCH = {"query": "", "seq": None, "draft": entry.get()}
+    else:
+        history_search(before=SEARCH["seq"])
+    show_history_search()
+    return "break"
+
+# поиск строки запроса начиная с номера before (не включая)
+def history_search(before=None):
+    found = HISTORY.search(SEARCH["query"], before=before) if SEARCH["query"] else None
+    SEARCH["found"] = found is not None
+    if found is not None:
+        SEARCH["seq"] = found[0]
+        set_entry(found[1])
+
+# строка состояния во время поиска
+def show_history_search():
+    missing = " - не найдено" if SEARCH["query"] and not SEARCH.get("found") else ""
+    status.configure(text=f"(reverse-i-search)`{SEARCH['query']}'{missing}")
+
+# закончить поиск, оставив найденную строку в строке ввода
+def end_history_search():
+    global SEARCH
+    if SEARCH is not None:
+        SEARCH = None
+        status.configure(text="")
+
+# остальные клавиши: во время поиска - редактирование строки поиска, иначе - конец навигации по истории
+def on_key(event):
+    global NAV
+    if SEARCH is None:
+        NAV = None
+        return None
+    if event.keysym == "Escape" or event.keysym == "g" and event.state & 0x4: # отмена поиска (Esc, Ctrl+G)
+        set_entry(SEARCH["draft"])
+        end_history_search()
+        return "break"
+    if event.keysym == "BackSpace":
+        SEARCH["query"] = SEARCH["query"][:-1]
+        history_search()
+    elif event.char and event.char.isprintable() and not event.state & 0x4:
+        SEARCH["query"] += event.char
+        # текущее совпадение проверяется первым: запрос только уточнился
+        history_search(before=SEARCH["seq"] + 1 if SEARCH["seq"] is not None else None)
+    elif event.keysym in MODIFIER_KEYS:
+        return "break"
+    else: # стрелки, Home, End и т.п. - поиск закончен, клавиша работает как обычно
+        end_history_search()
+        return None
+    show_history_search()
+    return "break"
+
+# Tab - дополнение: первое слово (и слово после "|") - имя команды, остальные - путь vfs относительно текущей директории
+COMPLETE_SHOW = 50 # сколько вариантов показать в консоли, если дополнить однозначно нельзя
+
+def on_tab(event=None):
+    global NAV
+    NAV = None
+    end_history_search()
+    text = entry.get()
+    cursor = entry.index(tk.INSERT)
+    before = text[:cursor]
+    start = max(before.rfind(" "), before.rfind("\t"), before.rfind("|"), before.rfind(">")) + 1
+    word = before[start:]
+    quote = word[:1] if word[:1] in ("'", '"') else "" # слово в открытой кавычке - дополняем без нее
+    word = word[len(quote):]
+    head = before[:start].rstrip()
+    if not head or head.endswith("|"): # имя команды
+        names = sorted(COMMANDS)
+        matches = names[bisect.bisect_left(names, word):bisect.bisect_left(names, word + "\U0010ffff")]
+        total, common = len(matches), os.path.commonprefix(matches)
+    else:
+        found = complete_path(word)
+        if found is None: # vfs занята командой или еще грузится - не ждем
+            return "break"
+        matches, total, common = found
+    if not total:
+        return "break"
+    if total == 1 and not common.endswith("/"): # единственный вариант - дописываем целиком и пробел
+        common += quote + " "
+    if len(common) > len(word):
+        entry.delete(start, cursor)
+        entry.insert(start, quote + common)
+        entry.icursor(start + len(quote) + len(common))
+    elif total > 1: # дополнять нечего - показываем варианты
+        shown = [m.rstrip("/").rpartition("/")[2] + ("/" if m.endswith("/") else "") for m in matches[:COMPLETE_SHOW]]
+        more = f" ... (еще {total - len(shown)})" if total > len(shown) else ""
+        write_console("  ".join(shown) + more)
+    return "break"
+
+# пути vfs для дополнения (None - vfs сейчас недоступна)
+def complete_path(word):
+    if vfs is None or not VFS_READY.is_set() or not VFS_LOCK.acquire(blocking=False):
+        return None
+    try:
+        return vfs.complete(word, limit=COMPLETE_SHOW)
+    finally:
+        VFS_LOCK.release()
+
+# отправить задачу в рабочий поток
+def submit(fn, *args, **kwargs):
+    global RUNNING
+    RUNNING += 1
+    EXECUTOR.submit(run_in_worker, fn, *args, **kwargs)
+
+# обертка задачи рабочего потока: сообщает главному потоку о завершении
+def run_in_worker(fn, *args, **kwargs):
+    CANCEL.clear() # Ctrl+C относится только к уже выполнявшейся команде
+    if metrics.PROFILER is not None: # cProfile работает в том потоке, где включен
+        metrics.PROFILER.enable()
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        import traceback
+        write_console(traceback.format_exc())
+    finally:
+        if metrics.PROFILER is not None:
+            metrics.PROFILER.disable()
+        RESULTS.put(("done", None))
+
+# разбор очереди результатов рабочего потока (в главном потоке)
+def poll_results():
+    global RUNNING, RELOAD_PENDING
+    for _ in range(RESULT_LINES): # за один опрос - не больше, чем рабочий поток может выложить, чтобы окно успевало отрисоваться
+        try:
+            kind, payload = RESULTS.get_nowait()
+        except queue.Empty:
+            break
+        if kind == "line":
+            LINE_SLOTS.release()
+            write_console(payload)
+        elif kind == "done":
+            RUNNING -= 1
+        elif kind == "quit":
+            request_quit()
+        elif kind == "reload": # наблюдатель заметил изменения в файлах команд
+            if not RELOAD_PENDING:
+                RELOAD_PENDING = True
+                submit(auto_reload)
+        elif kind == "loaded": # фоновая загрузка vfs закончилась
+            status.configure(text="")
+            report_startup()
+    root.after(POLL_MS, poll_results)
+
+# окно готово к вводу (первый простой цикла событий)
+def on_first_prompt():
+    metrics.phase("prompt")
+    report_startup()
+
+# этапы запуска выводятся один раз, когда и окно готово, и vfs загружена
+STARTUP_REPORTED = False
+def report_startup():
+    global STARTUP_REPORTED
+    if STARTUP_REPORTED or not VFS_READY.is_set() or metrics.phase_ms("prompt") is None:
+        return
+    STARTUP_REPORTED = True
+    write_console(metrics.startup_report())
+
+# Ctrl+C - прервать выполняющуюся команду (без команды - обычное копирование)
+def on_cancel(event=None):
+    if not RUNNING:
+        return None
+    CANCEL.set()
+    write_console("^C")
+    return "break"
+
+# запуск с окном
+def run_gui():
+    global tk, root, console, entry, status, EXECUTOR, HISTORY
+    import tkinter as tk
+    from tkinter.scrolledtext import ScrolledText
+    from concurrent.futures import ThreadPoolExecutor
+
+    # основное окно
+    root = tk.Tk()
+    root.title(setGUITitle())
+    root.geometry("750x520")
+
+    # окно консоли с историем комманд и их выводом
+    console = ScrolledText(root, wrap=tk.WORD, background="black", foreground="white", font=("Consolas", 11))
+    console.pack(fill="both", expand=True, padx=6, pady=(6,3))
+    console.configure(state='disabled')
+
+    # окошко для размещения строки ввода
+    bottom = tk.Frame(root)
+    bottom.pack(fill="x", side="bottom", padx=6, pady=6)
+
+    # строка ввода
+    entry = tk.Entry(bottom, font=("Consolas", 11))
+    entry.pack(fill="x", side="left", expand=True)
+
+    # сколько строк выброшено из окна консоли
+    status = tk.Label(bottom, text="", font=("Consolas", 9))
+    status.pack(side="right", padx=(6, 0))
+
+    # биндим ввод на Enter
+    entry.bind("<Return>", on_enter)
+    # биндим прерывание команды на Ctrl+C
+    entry.bind("<Control-c>", on_cancel)
+    root.bind("<Control-c>", on_cancel)
+    # история: Up/Down - по началу строки, Ctrl+R - поиск подстроки
+    entry.bind("<Up>", on_history_up)
+    entry.bind("<Down>", on_history_down)
+    entry.bind("<Control-r>", on_history_search)
+    entry.bind("<Tab>", on_tab)
+    entry.bind("<Key>", on_key)
+    # ставим фокус на дисплее на приложение консоли
+    entry.focus_set()
+
+    metrics.phase("window")
+
+    # загрузка команд и истории команд в модуль комманд; vfs грузится в фоне, команды vfs ее дождутся
+    commands_loader()
+    metrics.phase("commands")
+    HISTORY = open_history(gui=True)
+    bind_commands_module()
+    if ARGS.vfs_path:
+        VFS_READY.clear()
+        status.configure(text="Загрузка VFS...")
+        threading.Thread(target=lambda: (load_vfs(), RESULTS.put(("loaded", None))), name="vfs-load", daemon=True).start()
+
+    # команды выполняются в одном рабочем потоке, окно в это время продолжает отвечать
+    EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="command")
+    # наблюдатель за файлами команд: перезагрузка ставится в очередь рабочего потока
+    watcher = None
+    if ARGS.watch:
+        import command_plugins
+        watcher = command_plugins.watch(commands_touched, lambda: RESULTS.put(("reload", None)))
+    root.after(POLL_MS, poll_results)
+
+    # вывод дебаг параметров
+    write_console("=== Параметры запуска ===")
+    write_console(f"VFS path   : {ARGS.vfs_path}")
+    write_console(f"Startup scr: {ARGS.startup_script}")
+    write_console(f"Working dir: {os.getcwd()}")
+    write_console(f"Environment: HOME={os.environ.get('HOME')}; USER={os.environ.get('USER') or os.environ.get('USERNAME')}")
+
+    # запуск стартового скрипта и сообщение о готовности (в рабочем потоке, по порядку)
+    if ARGS.startup_script:
+        submit(run_startup_script, ARGS.startup_script)
+    submit(write_console, "Эмулятор готов. Введите 'help' для списка команд.")
+    root.after_idle(on_first_prompt)
+    root.mainloop()
+
+    # окно закрыто - прерываем текущую команду и не запускаем оставшиеся
+    if watcher is not None:
+        watcher.set()
+    CANCEL.set()
+    EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    HISTORY.close()
+    return 0
+
+# точка входа
+def main(argv=None):
+    global ARGS
+    ARGS = parse_cli(argv)
+    metrics.phase("cli")
+    if ARGS.profile_path:
+        metrics.start_profile()
+    try:
+        if ARGS.headless:
+            return run_headless()
+        return run_gui()
+    finally:
+        if ARGS.profile_path:
+            metrics.dump_profile(ARGS.profile_path)
+
+metrics.phase("imports")
+
+if __name__ == "__main__":
+    sys.exit(main())
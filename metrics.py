@@ -0,0 +1,114 @@
+import io
+import time
+
+# статистика выполнения команд, этапы запуска и профилирование (--profile)
+# модули профилирования (cProfile, pstats, tracemalloc) импортируются только при --profile
+
+START = time.perf_counter() # начало запуска (импорт этого модуля - одно из первых действий main.py)
+PHASES = [] # этапы запуска: (имя, мс от START)
+
+# границы корзин гистограммы задержек, мс (последняя корзина - все, что больше)
+BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+
+COMMAND_STATS = {} # имя команды -> счетчики
+PROFILER = None # cProfile.Profile, если включено профилирование
+tracemalloc = None # модуль tracemalloc (импортируется при включении профилирования)
+
+# пустые счетчики команды
+def _new_stats():
+    return {"calls": 0, "errors": 0, "total": 0.0, "max": 0.0,
+            "buckets": [0] * (len(BUCKETS_MS) + 1), "alloc": 0, "alloc_max": 0}
+
+# учесть один вызов команды
+def record_command(name, seconds, ok, allocated=None):
+    st = COMMAND_STATS.get(name)
+    if st is None:
+        st = COMMAND_STATS[name] = _new_stats()
+    st["calls"] += 1
+    if not ok:
+        st["errors"] += 1
+    st["total"] += seconds
+    st["max"] = max(st["max"], seconds)
+    ms = seconds * 1000
+    i = 0
+    while i < len(BUCKETS_MS) and ms > BUCKETS_MS[i]: # ищем корзину
+        i += 1
+    st["buckets"][i] += 1
+    if allocated is not None:
+        st["alloc"] += allocated
+        st["alloc_max"] = max(st["alloc_max"], allocated)
+
+# замер выполнения команды: возвращает функцию, которую надо вызвать по окончании
+def start_command():
+    tracing = tracemalloc is not None and tracemalloc.is_tracing()
+    if tracing: # память меряем только при включенном профилировании
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+
+    def finish(name, ok):
+        seconds = time.perf_counter() - start
+        allocated = tracemalloc.get_traced_memory()[1] - base if tracing else None
+        record_command(name, seconds, ok, allocated)
+    return finish
+
+# подпись корзины гистограммы
+def _bucket_label(i):
+    return f"<={BUCKETS_MS[i]:g}мс" if i < len(BUCKETS_MS) else f">{BUCKETS_MS[-1]:g}мс"
+
+# отчет по командам (по строке на команду)
+def command_report():
+    lines = []
+    for name in sorted(COMMAND_STATS, key=lambda n: -COMMAND_STATS[n]["total"]):
+        st = COMMAND_STATS[name]
+        avg = st["total"] / st["calls"] * 1000
+        hist = " ".join(f"{_bucket_label(i)}:{n}" for i, n in enumerate(st["buckets"]) if n)
+        line = f"{name}: вызовов {st['calls']}, ошибок {st['errors']}, среднее {avg:.3f} мс, макс {st['max'] * 1000:.3f} мс [{hist}]"
+        if st["alloc_max"]:
+            line += f", память до {st['alloc_max']} байт"
+        lines.append(line)
+    return lines
+
+# отметить завершение этапа запуска
+def phase(name):
+    PHASES.append((name, (time.perf_counter() - START) * 1000))
+
+# время этапа запуска в мс (None - этап еще не пройден)
+def phase_ms(name):
+    for phase_name, ms in PHASES:
+        if phase_name == name:
+            return ms
+    return None
+
+# строка с этапами запуска
+def startup_report():
+    return "Запуск: " + ", ".join(f"{name} {ms:.0f} мс" for name, ms in PHASES)
+
+# включить профилирование (cProfile включается в потоке, выполняющем команды)
+def start_profile():
+    global PROFILER, tracemalloc
+    import cProfile
+    import tracemalloc
+    PROFILER = cProfile.Profile()
+    tracemalloc.start()
+
+# сохранить результаты профилирования: текстовый отчет в path, данные cProfile в path + ".prof"
+def dump_profile(path):
+    if PROFILER is None:
+        return
+    import pstats
+    PROFILER.dump_stats(path + ".prof")
+    out = io.StringIO()
+    out.write(startup_report() + "\n\n")
+    out.write("=== Команды ===\n")
+    out.write("\n".join(command_report()) + "\n\n")
+    out.write("=== cProfile (по суммарному времени) ===\n")
+    pstats.Stats(PROFILER, stream=out).sort_stats("cumulative").print_stats(50)
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        out.write(f"=== tracemalloc: сейчас {current} байт, пик {peak} байт ===\n")
+        for stat in tracemalloc.take_snapshot().statistics("lineno")[:30]:
+            out.write(f"{stat}\n")
+        tracemalloc.stop()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(out.getvalue())
@@ -0,0 +1,38 @@
+import commands
+
+# плагин команд: импорт и экспорт между vfs и реальной OC (vfs_transfer импортируется только при вызове)
+
+COMMANDS = {}
+command = commands.registrar(COMMANDS)
+
+# строки прогресса импорта/экспорта
+def transfer_lines(name, steps):
+    import vfs_transfer
+    for progress in steps:
+        yield f"{name}: {vfs_transfer.format_progress(progress)}"
+
+@command("import") # импорт директории или архива (tar, zip) реальной OC в vfs
+def cmd_import(src=None, dst="."):
+    ok, err = commands.need_vfs()
+    if not ok:
+        return f"Ошибка: {err}"
+    if not src:
+        return "Usage: import <host dir|.tar|.zip> [vfs dir]"
+    import vfs_transfer
+    try:
+        return transfer_lines("import", vfs_transfer.iter_import(commands.vfs, src, dst))
+    except Exception as e:
+        return f"Ошибка import: {e}"
+
+@command("export") # экспорт директории vfs в директорию или архив (tar, zip) реальной OC
+def cmd_export(dst=None, src="."):
+    ok, err = commands.need_vfs()
+    if not ok:
+        return f"Ошибка: {err}"
+    if not dst:
+        return "Usage: export <host dir|.tar|.zip> [vfs dir]"
+    import vfs_transfer
+    try:
+        return transfer_lines("export", vfs_transfer.iter_export(commands.vfs, dst, src))
+    except Exception as e:
+        return f"Ошибка export: {e}"
@@ -0,0 +1,214 @@
+import os
+import re
+import gc
+import json
+import shlex
+
+# разбор строк команд и компиляция стартовых скриптов
+# скрипт разбирается на токены один раз; результат кэшируется в памяти и в __pycache__ рядом со скриптом
+# и считается действительным, пока не изменились время изменения и размер файла скрипта
+# запуск скрипта создает в его директории __pycache__/<имя скрипта>.tokens (если туда нельзя писать - кэш только в памяти)
+# кэш на диске - json только с данными (строки, числа, списки): при загрузке ничего не выполняется,
+# а файл с неожиданной структурой просто компилируется заново
+
+# версия формата скомпилированного скрипта (при изменении разбора старые кэши не используются)
+CACHE_VERSION = 3
+CACHE_DIR = "__pycache__"
+CACHE_EXT = ".tokens"
+
+# символы, при которых строку нельзя просто резать по пробелам (кавычки и экранирование)
+_QUOTE_CHARS = re.compile(r"['\"\\]")
+# пробельные символы shlex (posix)
+_WS_SPLIT = re.compile(r"[ \t\r\n]+")
+# строка из слов с закрытыми кавычками без экранирования и само такое слово
+_QUOTED_LINE = re.compile(r"""[ \t\r\n]*(?:(?:[^ \t\r\n'"]|"[^"]*"|'[^']*')+(?:[ \t\r\n]+|$))*""")
+_QUOTED_WORD = re.compile(r"""(?:[^ \t\r\n'"]|"[^"]*"|'[^']*')+""")
+# часть слова: в кавычках или без
+_WORD_PART = re.compile(r""""([^"]*)"|'([^']*)'|[^'"]+""")
+# символы, при которых токенам строки может понадобиться раскрытие окружения
+_EXPAND_CHARS = re.compile(r"[~$%]")
+# символы операторов конвейера и перенаправления
+_OP_CHARS = re.compile(r"[|>]")
+
+# оператор конвейера ("|") или перенаправления (">", ">>") - токен, не взятый в кавычки
+# (строка в кавычках "|" остается обычным аргументом)
+class Op(str):
+    __slots__ = ()
+
+    def __repr__(self):
+        return f"Op({str(self)!r})"
+
+_compiled = {} # путь скрипта -> (mtime_ns, размер, скомпилированные строки)
+
+# разбор строки на токены (ValueError - незакрытая кавычка и т.п.); операторы |, >, >> вне кавычек - токены Op
+def split_line(line):
+    if _OP_CHARS.search(line) is None: # без операторов - обычный разбор
+        return _split_words(line)
+    tokens, start, i, quote = [], 0, 0, None
+    while i < len(line): # ищем операторы вне кавычек, куски между ними разбираются как обычно
+        ch = line[i]
+        if quote is not None:
+            if ch == quote:
+                quote = None
+            elif ch == "\\" and quote == '"': # экранирование внутри двойных кавычек
+                i += 1
+        elif ch in "'\"":
+            quote = ch
+        elif ch == "\\": # экранированный символ - не оператор
+            i += 1
+        elif ch in "|>":
+            tokens += _split_words(line[start:i])
+            op = ">>" if line.startswith(">>", i) else ch
+            tokens.append(Op(op))
+            i += len(op)
+            start = i
+            continue
+        i += 1
+    return tokens + _split_words(line[start:]) # незакрытая кавычка - ValueError здесь
+
+# разбор куска строки без операторов на слова
+def _split_words(line):
+    if _QUOTE_CHARS.search(line) is None: # без кавычек и экранирования shlex дает то же, что split
+        return [t for t in _WS_SPLIT.split(line) if t]
+    if "\\" not in line and _QUOTED_LINE.fullmatch(line): # только закрытые кавычки - снимаем их сами
+        return [_WORD_PART.sub(_unquote, word) for word in _QUOTED_WORD.findall(line)]
+    return shlex.split(line, posix=True)
+
+# часть слова без кавычек
+def _unquote(m):
+    part = m.group(0)
+    return part[1:-1] if part[0] in "'\"" else part
+
+# есть ли в токенах конвейер или перенаправление
+def has_ops(tokens):
+    return any(isinstance(t, Op) for t in tokens)
+
+# токены -> стадии конвейера (списки токенов) и перенаправление (">" или ">>", путь) или None
+def split_pipeline(tokens):
+    redirect = None
+    for i, t in enumerate(tokens):
+        if isinstance(t, Op) and t != "|": # перенаправление - только в конце строки и с одним путем
+            rest = tokens[i + 1:]
+            if len(rest) != 1 or isinstance(rest[0], Op):
+                raise ValueError(f"после '{t}' нужен один путь файла")
+            redirect = (str(t), rest[0])
+            tokens = tokens[:i]
+            break
+    stages = [[]]
+    for t in tokens:
+        if isinstance(t, Op):
+            stages.append([])
+        else:
+            stages[-1].append(t)
+    if any(not stage for stage in stages):
+        raise ValueError("пустая команда в конвейере")
+    return stages, redirect
+
+# может ли токен измениться при раскрытии окружения (~ в начале, $VAR, %VAR%)
+def needs_expand(token):
+    return token.startswith("~") or "$" in token or "%" in token
+
+# раскрытие окружения реальной OC в токене
+def expand(token):
+    token = os.path.expanduser(token) #раскрывает ~d
+    token = os.path.expandvars(token) #раскрыавает %d%, $HOME, ${HOME}
+    if "$HOME" in token or "${HOME}" in token or "%HOME%" in token: # если методы сверху не сработали
+        home = os.path.expanduser("~")
+        token = token.replace("$HOME", home).replace("${HOME}", home).replace("%HOME%", home)
+    return token
+
+# раскрытие списка токенов: раскрываются только токены, которым это может быть нужно
+def expand_tokens(tokens):
+    return [expand(t) if needs_expand(t) else t for t in tokens]
+
+# компиляция текста скрипта: список (номер строки, строка, токены, ошибка разбора)
+# у строк без ~, $ и % токены уже окончательные, иначе раскрываются при выполнении (окружение может меняться)
+def compile_lines(lines):
+    compiled = []
+    for idx, raw in enumerate(lines):
+        line = raw.rstrip("\n")
+        stripped = line.strip()
+        if stripped == "" or stripped.startswith("#"): # пустые строки и комментарии выбрасываем сразу
+            continue
+        try:
+            tokens = split_line(line)
+            if has_ops(tokens): # ошибки конвейера видны сразу при компиляции
+                split_pipeline(tokens)
+            error = None
+        except ValueError as e:
+            tokens, error = [], str(e)
+        expand_needed = _EXPAND_CHARS.search(line) is not None and any(needs_expand(t) for t in tokens)
+        compiled.append((idx + 1, line, tokens, expand_needed, error))
+    return compiled
+
+# путь файла кэша скрипта
+def _cache_path(path):
+    head, name = os.path.split(os.path.abspath(path))
+    return os.path.join(head, CACHE_DIR, name + CACHE_EXT)
+
+# скомпилированный скрипт из кэша (в памяти или на диске) или после компиляции
+def compile_script(path):
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    hit = _compiled.get(path)
+    if hit is not None and hit[0] == key: # скрипт не менялся с прошлого запуска
+        return hit[1]
+
+    # при разборе создаются сотни тысяч мелких объектов - сборщик мусора на это время отключаем
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        compiled = _load_or_compile(path, key)
+    finally:
+        if enabled:
+            gc.enable()
+    _compiled[path] = (key, compiled)
+    return compiled
+
+# строки скрипта для json: [номер, строка, токены-строки, позиции операторов Op среди токенов, раскрытие, ошибка]
+def _dump_lines(compiled):
+    return [[lineno, line, tokens, [i for i, t in enumerate(tokens) if isinstance(t, Op)], expand_needed, error]
+            for lineno, line, tokens, expand_needed, error in compiled]
+
+# строки скрипта из json с проверкой структуры (ValueError - кэш не такой, какой пишет _dump_lines)
+def _load_lines(data):
+    if not isinstance(data, list):
+        raise ValueError("lines")
+    compiled = []
+    for lineno, line, tokens, ops, expand_needed, error in data:
+        if not (type(lineno) is int and type(line) is str and type(tokens) is list and type(ops) is list
+                and type(expand_needed) is bool and (error is None or type(error) is str)
+                and all(type(t) is str for t in tokens)):
+            raise ValueError("line")
+        for i in ops:
+            if not (type(i) is int and 0 <= i < len(tokens)) or tokens[i] not in ("|", ">", ">>"):
+                raise ValueError("op")
+            tokens[i] = Op(tokens[i])
+        compiled.append((lineno, line, tokens, expand_needed, error))
+    return compiled
+
+# скомпилированный скрипт из кэша на диске (если он соответствует key) или компиляция с записью кэша
+def _load_or_compile(path, key):
+    cache = _cache_path(path)
+    compiled = None
+    try:
+        with open(cache, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved.get("version") == CACHE_VERSION and saved.get("key") == list(key):
+            compiled = _load_lines(saved["lines"])
+    except (OSError, AttributeError, ValueError, LookupError, TypeError):
+        pass # нет кэша или он поврежден - компилируем заново
+
+    if compiled is None:
+        with open(path, "r", encoding="utf-8") as f:
+            compiled = compile_lines(f)
+        try: # кэш на диске - только ускорение, ошибки записи не важны
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+            tmp = cache + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": CACHE_VERSION, "key": list(key), "lines": _dump_lines(compiled)}, f,
+                          separators=(",", ":"), ensure_ascii=False)
+            os.replace(tmp, cache)
+        except OSError:
+            pass
+    return compiled
@@ -0,0 +1,26 @@
+import batch
+from bench import generate_image
+from vfs_json import open_vfs_from_json, JOURNAL_EXT
+
+# пакетный прогон не меняет ни образ, ни его журнал: изменения скрипта живут только в памяти прогона
+
+def test_runs_do_not_touch_image_or_journal(tmp_path):
+    image = str(tmp_path / "image.json")
+    generate_image(image, 1, 2, 2, 16)
+    v = open_vfs_from_json(image, journal=True) # несвернутое изменение в журнале
+    v.write_bytes("/journaled.txt", b"j")
+    v.close()
+    save = tmp_path / "save.txt"
+    save.write_text("cat /journaled.txt\nfind / -name new.txt\nwrite /new.txt x\nsave\n", encoding="utf-8")
+    compact = tmp_path / "compact.txt"
+    compact.write_text("write /new.txt x\ncompact\n", encoding="utf-8")
+    before = {p: open(p, "rb").read() for p in (image, image + JOURNAL_EXT)}
+    batch.init_worker()
+    runs = [batch.run_one((image, str(script))) for script in (save, save, compact)]
+    assert {p: open(p, "rb").read() for p in before} == before
+    for run in runs[:2]: # журнал образа виден, запись прошлого прогона - нет
+        lines = run["output"].splitlines()
+        assert lines[1:4] == ["> cat /journaled.txt", "j", "> find / -name new.txt"]
+        assert lines[4].startswith("> write")
+        assert "Ошибка save: vfs открыта только для чтения" in lines
+    assert "Ошибка compact: VFS is read-only" in runs[2]["output"].splitlines()
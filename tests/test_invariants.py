@@ -0,0 +1,178 @@
+import os
+import re
+import shutil
+import random
+
+import pytest
+
+from bench import generate_image
+from vfs_json import open_vfs_from_json, JOURNAL_EXT
+
+# инварианты состояния, которое vfs поддерживает при изменениях, на случайных операциях:
+# итоги директорий, числа ссылок таблицы блобов, индекс имен, индексы find/grep,
+# снимки и откат, журнал и его повтор при загрузке (в том числе после падения посреди compact)
+
+# операций в одном прогоне и зерна прогонов
+OPS = 400
+SEEDS = range(10)
+
+# имена, из которых собираются случайные пути: маленький набор, чтобы операции попадали в одни и те же элементы
+DIR_NAMES = ["d0", "d1", "d2", "n"]
+SUB_NAMES = ["", "/d0", "/d1", "/q/r"]
+FILE_NAMES = ["f0.txt", "f1.txt", "x", "y"]
+GREP_PATTERNS = ["z", "zq", "^q", "a+b"]
+
+# дерево vfs: путь -> содержимое файла (bytes) или None для директории
+def walk(v, node=None, path=""):
+    node = node if node is not None else v.root
+    out = {}
+    for name, child in v._entries(node).items():
+        p = path + "/" + name
+        if child.is_dir:
+            out[p] = None
+            out.update(walk(v, child, p))
+        else:
+            out[p] = bytes(v._raw_bytes(child))
+    return out
+
+# числа ссылок таблицы блобов (блобы без ссылок, которые ждут сброса снимков, не считаются)
+def blob_refs(v):
+    return {h: entry[0] for h, entry in v._blob_table().items() if entry[0] > 0}
+
+# итоги поддерева, посчитанные заново: (байт, файлов, директорий)
+def recount(v, node):
+    size = files = dirs = 0
+    for child in v._entries(node).values():
+        if child.is_dir:
+            b, f, d = recount(v, child)
+            size, files, dirs = size + b, files + f, dirs + d + 1
+        else:
+            size, files = size + v._node_size(child), files + 1
+    return size, files, dirs
+
+# итоги и индекс имен каждой директории, где они уже есть; ссылки живого дерева на блобы
+def check_dirs(v, node, path, refs):
+    if node.totals is not None:
+        assert node.totals == recount(v, node), f"итоги {path or '/'}"
+    if node.names is not None:
+        assert node.names == sorted(v._entries(node)), f"индекс имен {path or '/'}"
+    for name, child in v._entries(node).items():
+        if child.is_dir:
+            check_dirs(v, child, path + "/" + name, refs)
+        elif child.hash is not None:
+            refs[child.hash] = refs.get(child.hash, 0) + 1
+
+# все инварианты одной vfs
+def check_invariants(v):
+    refs = {}
+    check_dirs(v, v.root, "", refs)
+    assert blob_refs(v) == refs, "числа ссылок таблицы блобов не совпадают со ссылками дерева"
+    if not v._snapshots: # блоб без ссылок живет только ради снимков
+        assert all(entry[0] > 0 for entry in v._blob_table().values()), "блоб без ссылок без снимков"
+    if v._index is not None:
+        tree = walk(v)
+        files = sorted(p for p, data in tree.items() if data is not None)
+        assert v.find("/", kind="f") == files, "find -type f"
+        for pattern in GREP_PATTERNS:
+            rx = re.compile(pattern)
+            expected = sorted((p, i) for p in files
+                              for i, line in enumerate(tree[p].decode("utf-8", "replace").splitlines(), 1) if rx.search(line))
+            assert sorted((p, lineno) for p, lineno, _ in v.grep(pattern, "/")) == expected, f"grep {pattern!r}"
+
+# одна случайная операция над vfs; ожидаемые ошибки (нет файла, не директория и т.п.) - не нарушения
+def random_op(v, rnd):
+    d = "/" + rnd.choice(DIR_NAMES) + rnd.choice(SUB_NAMES)
+    f = d + "/" + rnd.choice(FILE_NAMES)
+    op = rnd.choice(["write", "write", "append", "copy", "rm", "rmdir", "mkdir", "listdir", "totals"])
+    try:
+        if op == "write":
+            v.write_bytes(f, rnd.choice([b"", b"q", b"zq\n", b"ab\nz"]) * rnd.randint(0, 40))
+        elif op == "append":
+            v.write_chunks(f, iter([b"a", b"b\n"]), append=True)
+        elif op == "copy":
+            v.copy(f, d + "/c" + str(rnd.randint(0, 2)))
+        elif op == "rm":
+            v.remove(f if rnd.random() < 0.7 else d)
+        elif op == "rmdir":
+            v.rmdir(d)
+        elif op == "mkdir":
+            v.mkdir(d + "/m" + str(rnd.randint(0, 3)))
+        elif op == "listdir":
+            v.listdir(d)
+        else:
+            v.totals(d)
+    except (OSError, TypeError, ValueError):
+        pass
+    return op
+
+# падение между заменой образа и очисткой журнала в compact: журнал до compact возвращается на место,
+# образ загружается заново (как после перезапуска) и должен совпасть с деревом до падения
+def crash_during_compact(v, image, lazy):
+    journal_path = image + JOURNAL_EXT
+    expected = walk(v)
+    stale = journal_path + ".stale"
+    shutil.copyfile(journal_path, stale)
+    v.compact()
+    v._journal_file.close() # процесс "упал": журнал больше не пишется
+    v._journal_file = None
+    os.replace(stale, journal_path)
+    reopened = open_vfs_from_json(image, lazy=lazy, journal=True)
+    assert walk(reopened) == expected, "после падения во время compact журнал применился повторно"
+    reopened.index()
+    return reopened
+
+# синтетический образ (файлы в старом формате - base64 в узлах)
+@pytest.fixture(scope="module")
+def base_image(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("image") / "base.json")
+    generate_image(path, 2, 3, 4, 64)
+    return path
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("journal", [False, True], ids=["plain", "journal"])
+@pytest.mark.parametrize("lazy", [False, True], ids=["eager", "lazy"])
+def test_random_operations_keep_invariants(base_image, tmp_path, lazy, journal, seed):
+    image = str(tmp_path / "image.json")
+    shutil.copyfile(base_image, image)
+    rnd = random.Random(seed)
+    v = open_vfs_from_json(image, lazy=lazy, journal=True if journal else None)
+    v.index() # индексы find/grep дальше поддерживаются при изменениях
+    saved = [] # снимки: (имя, дерево, числа ссылок)
+    for step in range(OPS):
+        r = rnd.random()
+        if r < 0.05:
+            saved.append((v.snapshot(), walk(v), blob_refs(v)))
+            what = "snapshot"
+        elif r < 0.08 and saved:
+            i = rnd.randrange(len(saved))
+            name, tree, refs = saved[i]
+            v.rollback(name)
+            del saved[i + 1:]
+            assert walk(v) == tree, f"шаг {step}: откат к снимку {name} не вернул дерево"
+            assert blob_refs(v) == refs, f"шаг {step}: откат к снимку {name} не вернул числа ссылок"
+            what = "rollback"
+        elif r < 0.10 and saved:
+            i = rnd.randrange(len(saved))
+            v.drop_snapshot(saved[i][0])
+            del saved[i:]
+            what = "drop_snapshot"
+        elif journal and r < 0.13:
+            v.save() if rnd.random() < 0.5 else v.compact()
+            saved = [] # save и compact удаляют снимки
+            what = "save/compact"
+        elif journal and r < 0.15:
+            expected = walk(v)
+            other = open_vfs_from_json(image, lazy=lazy, journal=False)
+            assert walk(other) == expected, f"шаг {step}: образ с повтором журнала не совпадает с деревом"
+            other.close()
+            what = "reopen"
+        elif journal and r < 0.16:
+            v = crash_during_compact(v, image, lazy)
+            saved = []
+            what = "crash_compact"
+        else:
+            what = random_op(v, rnd)
+        try:
+            check_invariants(v)
+        except AssertionError as e:
+            raise AssertionError(f"шаг {step} ({what}): {e}") from None
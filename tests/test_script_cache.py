@@ -0,0 +1,24 @@
+import json
+
+import pytest
+
+import script_cache
+from script_cache import Op
+
+# поврежденный кэш токенов на диске не роняет скрипт: он компилируется заново
+
+@pytest.mark.parametrize("ops", [[9], [-1], [True], ["1"], [None]], ids=["range", "negative", "bool", "str", "none"])
+def test_bad_op_index_recompiles(tmp_path, ops):
+    script = tmp_path / "script.txt"
+    script.write_text("echo a | wc -c\n", encoding="utf-8")
+    expected = script_cache.compile_script(str(script))
+    script_cache._compiled.clear()
+    cache = script_cache._cache_path(str(script))
+    with open(cache, "r", encoding="utf-8") as f:
+        saved = json.load(f)
+    saved["lines"][0][3] = ops
+    with open(cache, "w", encoding="utf-8") as f:
+        json.dump(saved, f)
+    compiled = script_cache.compile_script(str(script))
+    assert compiled == expected
+    assert isinstance(compiled[0][2][2], Op)
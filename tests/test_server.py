@@ -0,0 +1,85 @@
+import os
+import sys
+import socket
+import random
+import threading
+import subprocess
+
+import pytest
+
+from bench import generate_image, random_path
+from vfs_client import VFSClient
+
+# нагрузка на сервер VFS: клиенты читают и пишут одновременно,
+# чтение не должно видеть недописанных файлов, а команды - падать с исключениями;
+# итоги корня после всех изменений совпадают с полным пересчетом find
+
+# клиентов, команд каждого клиента и форма синтетического образа (глубина, ветвление, файлов)
+CLIENTS = 8
+OPS = 150
+SHAPE = (3, 3, 4)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="нужен Unix-сокет")
+
+# сервер на синтетическом образе; останавливается после теста
+@pytest.fixture
+def server(tmp_path):
+    image = str(tmp_path / "image.json")
+    sock = str(tmp_path / "vfs.sock")
+    generate_image(image, *SHAPE, 256)
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "vfs_server.py"), "--vfs", image, "--unix", sock],
+                            stdout=subprocess.PIPE, text=True, encoding="utf-8")
+    try:
+        for line in proc.stdout:
+            if line.startswith("Сервер VFS"):
+                break
+        else:
+            pytest.fail("сервер не запустился")
+        yield sock
+    finally:
+        proc.terminate()
+        proc.wait()
+
+# один клиент: ops случайных команд; нарушения дописываются в problems
+def client(sock, i, seed, problems):
+    rnd = random.Random(seed * 1000 + i)
+    try:
+        with VFSClient(sock) as c:
+            for k in range(OPS):
+                r = rnd.random()
+                if r < 0.15: # запись целиком: читатель видит либо старое, либо новое содержимое
+                    ok, out = c.run(f"write /shared{i % 3}.txt v{i}-{k}-end")
+                elif r < 0.2:
+                    ok, out = c.run(f"mkdir /m{i}_{k}")
+                elif r < 0.55:
+                    ok, out = c.run(f"cat /shared{rnd.randrange(3)}.txt")
+                    if ok and not (len(out) == 1 and out[0].startswith("v") and out[0].endswith("-end")):
+                        problems.append(f"клиент {i}: недописанное содержимое {out[:2]}")
+                    continue
+                elif r < 0.75:
+                    ok, out = c.run(f"cat {random_path(rnd, *SHAPE)} | wc -c")
+                elif r < 0.9:
+                    ok, out = c.run(f"cd {random_path(rnd, *SHAPE, want_dir=True)}")
+                else:
+                    ok, out = c.run("du -s /")
+                if not ok or any("Исключение" in line or "Traceback" in line for line in out):
+                    problems.append(f"клиент {i}: {out[:3]}")
+    except Exception as e:
+        problems.append(f"клиент {i}: {type(e).__name__}: {e}")
+
+@pytest.mark.parametrize("seed", range(2))
+def test_concurrent_clients(server, seed):
+    problems = []
+    threads = [threading.Thread(target=client, args=(server, i, seed, problems)) for i in range(CLIENTS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not problems, "\n".join(problems[:10])
+    with VFSClient(server) as c:
+        _, stat = c.run("stat /")
+        _, files = c.run("find / -type f")
+    counted = next((line for line in stat if line.startswith("Элементов")), "")
+    assert f"файлов в поддереве: {len(files)}," in counted, f"stat / ({counted}) не совпадает с find ({len(files)} файлов)"
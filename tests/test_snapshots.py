@@ -0,0 +1,60 @@
+import base64
+
+from vfs_json import JSONVFS
+from vfs_nodes import DirNode, FileNode
+
+def new_vfs():
+    return JSONVFS(DirNode({}))
+
+# откат через несколько снимков: блоб, который после отката к новому снимку остался без ссылок,
+# нужен более старому снимку и не должен удаляться
+def test_nested_rollback_keeps_blobs_of_older_snapshots():
+    v = new_vfs()
+    v.write_bytes("/a", b"hello")
+    s0 = v.snapshot()
+    v.remove("/a")
+    s1 = v.snapshot()
+    v.write_bytes("/a", b"hello")
+    v.rollback(s1)
+    assert not v.exists("/a")
+    v.rollback(s0)
+    assert v.read_bytes("/a") == b"hello"
+
+# блобы без ссылок удаляются, когда снимков не осталось
+def test_orphan_blobs_purged_when_last_snapshot_dropped():
+    v = new_vfs()
+    s0 = v.snapshot()
+    v.write_bytes("/a", b"one")
+    s1 = v.snapshot()
+    v.write_bytes("/a", b"two")
+    v.rollback(s1)
+    v.remove("/a")
+    assert len(v._blob_table()) == 2 # "one" нужен снимку s1, "two" - уже никому, но удалится вместе со снимками
+    v.drop_snapshot(s0)
+    assert v._blob_table() == {}
+
+# откат к самому старому снимку сразу удаляет блобы, которые больше никому не нужны
+def test_rollback_to_oldest_purges_unreferenced_blobs():
+    v = new_vfs()
+    v.write_bytes("/keep", b"keep")
+    s0 = v.snapshot()
+    v.write_bytes("/a", b"one")
+    s1 = v.snapshot()
+    v.write_bytes("/a", b"two")
+    v.rollback(s1)
+    v.rollback(s0)
+    assert [entry[0] for entry in v._blob_table().values()] == [1]
+    assert v.read_bytes("/keep") == b"keep"
+
+# копирование файла старого формата (base64 в узле) при снимке не меняет узел, общий со снимком
+def test_copy_of_inline_file_does_not_touch_snapshot():
+    v = JSONVFS(DirNode({"a": FileNode(data=base64.b64encode(b"old").decode("ascii"))}))
+    shared = v.root.entries["a"]
+    s0 = v.snapshot()
+    v.copy("/a", "/b")
+    assert shared.hash is None and shared.data is not None
+    assert v.read_bytes("/a") == v.read_bytes("/b") == b"old"
+    v.rollback(s0)
+    assert v.root.entries["a"] is shared
+    assert v._blob_table() == {}
+    assert v.read_bytes("/a") == b"old" and not v.exists("/b")
@@ -0,0 +1,107 @@
+import sys
+import socket
+import argparse
+
+# тонкий клиент сервера VFS (vfs_server.py): строка команды - в сокет, вывод - из сокета
+# без аргументов - интерактивный ввод, -c "команда" - одна команда, --script "file" - команды из файла
+
+DEFAULT_PORT = 8765
+
+class VFSClient:
+    def __init__(self, unix=None, host="127.0.0.1", port=DEFAULT_PORT):
+        if unix:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(unix)
+        else:
+            self.sock = socket.create_connection((host, port))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # короткие команды не ждут склейки пакетов
+        self._file = self.sock.makefile("rwb")
+
+    # выполнить строку команды: строки вывода отдаются по мере поступления, в конце - успех (True/False)
+    # пример: for line in client.stream("ls"): ...; ok = client.ok
+    def stream(self, line):
+        self._file.write(line.replace("\n", " ").encode("utf-8") + b"\n")
+        self._file.flush()
+        self.ok = None
+        for raw in self._file:
+            text = raw.decode("utf-8", errors="replace").rstrip("\n")
+            if text.startswith("="):
+                self.ok = text == "=0"
+                return
+            yield text[1:]
+        raise ConnectionError("сервер закрыл соединение")
+
+    # выполнить строку команды: (успех, строки вывода)
+    def run(self, line):
+        lines = list(self.stream(line))
+        return self.ok, lines
+
+    def close(self):
+        try:
+            self._file.close()
+        finally:
+            self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# выполнить команды по очереди с выводом в stdout; возвращает код выхода (1 - была ошибка)
+def run_lines(client, lines, stop_on_error=False):
+    code = 0
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        for out in client.stream(line):
+            print(out)
+        if not client.ok:
+            code = 1
+            if stop_on_error:
+                break
+        if line == "exit":
+            break
+    return code
+
+# интерактивный ввод
+def repl(client):
+    while True:
+        try:
+            line = input("> ")
+        except (EOFError, KeyboardInterrupt):
+            print()
+            return 0
+        if not line.strip():
+            continue
+        for out in client.stream(line):
+            print(out)
+        if line.strip() == "exit":
+            return 0
+
+def parse_cli(argv=None):
+    p = argparse.ArgumentParser(description="Клиент сервера VFS")
+    p.add_argument("--unix", help="Путь Unix-сокета сервера (вместо TCP)", default=None)
+    p.add_argument("--host", default="127.0.0.1", help="Адрес сервера")
+    p.add_argument("--port", type=int, default=DEFAULT_PORT, help="Порт сервера")
+    p.add_argument("-c", dest="command", help="Выполнить одну команду", default=None)
+    p.add_argument("--script", help="Выполнить команды из файла (до первой ошибки)", default=None)
+    return p.parse_args(argv)
+
+if __name__ == "__main__":
+    a = parse_cli()
+    try:
+        client = VFSClient(a.unix, a.host, a.port)
+    except OSError as e:
+        sys.stderr.write(f"Не удалось подключиться к серверу: {e}\n")
+        sys.exit(2)
+    with client:
+        if a.command is not None:
+            code = run_lines(client, [a.command])
+        elif a.script:
+            with open(a.script, "r", encoding="utf-8") as f:
+                code = run_lines(client, f, stop_on_error=True)
+        else:
+            code = repl(client)
+    sys.exit(code)
@@ -0,0 +1,179 @@
+import fnmatch
+from vfs_json import _content_hash
+
+# индексы VFS для find и grep: по именам и по содержимому (триграммы)
+# строятся один раз при первом поиске, дальше поддерживаются методами JSONVFS при изменениях
+
+# файлы больше этого размера в триграммы не раскладываются (для grep они всегда кандидаты)
+INDEX_MAX_FILE = 1024 * 1024
+
+# квантификаторы, после которых предыдущий символ необязателен
+_OPTIONAL = set("?*{")
+# специальные символы регулярных выражений
+_META = set(".^$*+?{}[]\\|()")
+
+# множество триграмм содержимого (без учета регистра ascii)
+def trigrams(data):
+    data = bytes(data).lower()
+    return {data[i:i + 3] for i in range(len(data) - 2)}
+
+# самая длинная литеральная часть, которая обязана быть в любой строке,
+# подходящей под регулярное выражение (или "", если такой нет)
+def required_literal(pattern):
+    if "|" in pattern or "(?" in pattern: # альтернативы и спец. группы не разбираем
+        return ""
+    best, cur = "", ""
+    depth = 0 # глубина скобок: содержимое групп не учитываем
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\" and i + 1 < len(pattern) and not pattern[i + 1].isalnum(): # экранированный символ - литерал
+            ch = pattern[i + 1]
+            i += 2
+        elif ch in _META:
+            if ch in _OPTIONAL and cur: # предыдущий символ необязателен
+                cur = cur[:-1]
+            best, cur = max(best, cur, key=len), ""
+            if ch == "\\": # класс символов (\d, \w, ...)
+                i += 2
+            elif ch == "[": # набор символов - пропускаем до ]
+                i = pattern.find("]", i + 2) + 1 or len(pattern)
+            elif ch == "{": # {m,n} - пропускаем до }
+                i = pattern.find("}", i) + 1 or len(pattern)
+            else:
+                depth += 1 if ch == "(" else -1 if ch == ")" else 0
+                i += 1
+            continue
+        else:
+            i += 1
+        if depth == 0:
+            cur += ch
+    return max(best, cur, key=len)
+
+class VFSIndex:
+    def __init__(self, vfs):
+        self.vfs = vfs
+        self.paths = {} # абсолютный путь -> узел
+        self.names = {} # имя -> множество абсолютных путей
+        self.path_hash = {} # путь файла -> хэш содержимого
+        self.hash_paths = {} # хэш содержимого -> пути файлов с ним
+        self.postings = {} # триграмма -> хэши содержимого, в котором она есть
+        self.big = set() # хэши слишком больших файлов (без триграмм)
+        self.files_decoded = 0 # сколько файлов прочитал grep (для проверки работы индекса)
+
+    # построение индексов обходом всего дерева (один раз)
+    def build(self):
+        stack = [("/", self.vfs.root)]
+        while stack:
+            path, node = stack.pop()
+            for name, child in self.vfs._entries(node).items():
+                child_path = path.rstrip("/") + "/" + name
+                if child.is_dir:
+                    self.add_dir(child_path, child)
+                    stack.append((child_path, child))
+                else:
+                    self.add_file(child_path, child)
+
+    # добавить имя пути в индекс имен
+    def _add_name(self, path, node):
+        self.paths[path] = node
+        self.names.setdefault(path.rpartition("/")[2], set()).add(path)
+
+    # новая директория
+    def add_dir(self, path, node):
+        self._add_name(path, node)
+
+    # новый (или перезаписанный) файл
+    def add_file(self, path, node):
+        if path in self.path_hash: # перезапись - сначала убираем старое содержимое
+            self.discard(path)
+        self._add_name(path, node)
+        h = node.hash
+        data = None
+        if h is None: # содержимое не в таблице блобов - считаем хэш сами
+            data = self.vfs._raw_bytes(node)
+            h = _content_hash(data)
+        self.path_hash[path] = h
+        holders = self.hash_paths.get(h)
+        if holders: # такое содержимое уже проиндексировано
+            holders.add(path)
+            return
+        self.hash_paths[h] = {path}
+        if self.vfs._node_size(node) > INDEX_MAX_FILE:
+            self.big.add(h)
+            return
+        if data is None:
+            data = self.vfs._raw_bytes(node)
+        for t in trigrams(data):
+            self.postings.setdefault(t, set()).add(h)
+
+    # удаление пути (вызывается до удаления узла, пока содержимое еще доступно)
+    def discard(self, path):
+        node = self.paths.pop(path, None)
+        if node is None:
+            return
+        name = path.rpartition("/")[2]
+        holders = self.names.get(name)
+        if holders:
+            holders.discard(path)
+            if not holders:
+                del self.names[name]
+        h = self.path_hash.pop(path, None)
+        if h is None: # директория
+            return
+        holders = self.hash_paths.get(h)
+        holders.discard(path)
+        if holders: # содержимое есть еще у других файлов
+            return
+        del self.hash_paths[h]
+        if h in self.big:
+            self.big.discard(h)
+            return
+        for t in trigrams(self.vfs._raw_bytes(node)): # последняя ссылка - чистим триграммы
+            posting = self.postings.get(t)
+            if posting is not None:
+                posting.discard(h)
+                if not posting:
+                    del self.postings[t]
+
+    # поиск по имени (glob), типу ("f"/"d") и размеру (функция от размера) внутри scope
+    def find(self, scope="/", name=None, kind=None, size=None):
+        if name is not None: # по индексу имен - без обхода дерева
+            found = set()
+            for matched in fnmatch.filter(self.names.keys(), name):
+                found |= self.names[matched]
+        else:
+            found = self.paths.keys()
+        prefix = scope.rstrip("/") + "/"
+        result = []
+        for path in found:
+            if path != scope and not path.startswith(prefix):
+                continue
+            node = self.paths[path]
+            is_dir = node.is_dir
+            if kind == "f" and is_dir or kind == "d" and not is_dir:
+                continue
+            if size is not None and (is_dir or not size(self.vfs._node_size(node))):
+                continue
+            result.append(path)
+        return sorted(result)
+
+    # пути файлов внутри scope, которые могут содержать literal (по триграммам)
+    def candidates(self, literal, scope="/"):
+        if len(literal) >= 3:
+            hashes = None
+            for t in trigrams(literal.encode("utf-8")): # пересечение списков триграмм
+                posting = self.postings.get(t, set())
+                hashes = set(posting) if hashes is None else hashes & posting
+                if not hashes:
+                    break
+            hashes = (hashes or set()) | self.big
+        else: # короткий шаблон - проверять придется все файлы
+            hashes = self.hash_paths.keys()
+        prefix = scope.rstrip("/") + "/"
+        result = []
+        for h in hashes:
+            for path in self.hash_paths.get(h, ()):
+                if path == scope or path.startswith(prefix):
+                    result.append(path)
+        return sorted(result)
@@ -1,6 +1,48 @@
 import os
+import re
+import sys
 import json
+import lzma
+import mmap
+import zlib
 import base64
+import struct
+import hashlib
+import functools
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from vfs_nodes import DirNode, FileNode, NO_ENTRIES, node_from_json, node_to_json
+
+# с какого размера образ открывается лениво (по умолчанию)
+LAZY_MIN_SIZE = 16 * 1024 * 1024
+
+# размер куска при потоковом чтении файла (кратен 3, чтобы резать base64 по целым блокам)
+CHUNK_SIZE = 3 * 21846
+
+# предел размера кэшей путей (при переполнении кэш очищается)
+PATH_CACHE_SIZE = 65536
+
+# сжатие содержимого файлов (при включенном compress): zlib с COMPRESS_MIN_SIZE, lzma с LZMA_MIN_SIZE байт
+COMPRESS_MIN_SIZE = 4096
+LZMA_MIN_SIZE = 1024 * 1024
+
+# бюджет памяти кэша декодированного содержимого файлов (по умолчанию)
+DECODED_CACHE_SIZE = 32 * 1024 * 1024
+
+# журнал изменений: файл рядом с образом, одна json-запись на строку
+JOURNAL_EXT = ".journal"
+
+# бинарный формат образа: заголовок (магия + смещение индекса), блоб с содержимым файлов, индекс
+PACK_EXT = ".vfspack" # расширение, по которому save выбирает бинарный формат
+PACK_MAGIC = b"VFSPACK1"
+_PACK_HEADER = struct.Struct("<8sQ")
+
+# регулярки для потокового разбора json без полной загрузки
+_STR_RE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"') # строка json
+_TOKEN_RE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]') # строка или скобка
+_WS_RE = re.compile(rb'[ \t\r\n]*') # пробельные символы
+_ATOM_RE = re.compile(rb'[^,}\]\s]*') # число, true, false, null
 
 # нормирование пути
 def _norm_path(p):
@@ -23,14 +65,581 @@ def _split_path(p):
     # преобразуем в список и возвращаем
     return p.strip("/").split("/")
 
+# пропуск пробелов в буфере
+def _skip_ws(buf, pos):
+    return _WS_RE.match(buf, pos).end()
+
+# границы значения json, начинающегося с pos (без разбора содержимого)
+def _scan_span(buf, pos):
+    ch = buf[pos:pos + 1]
+    if ch == b'"': # строка - ищем закрывающую кавычку
+        end = _STR_RE.match(buf, pos).end()
+    elif ch in (b"{", b"["): # объект или массив - считаем глубину скобок
+        depth = 0
+        end = None
+        for m in _TOKEN_RE.finditer(buf, pos):
+            c = buf[m.start()]
+            if c == 0x22: # строки пропускаем целиком
+                continue
+            depth += 1 if c in (0x7b, 0x5b) else -1
+            if depth == 0:
+                end = m.end()
+                break
+        if end is None: # скобка так и не закрылась
+            raise ValueError(f"Незакрытое значение json в позиции {pos}")
+    else: # число, true, false, null
+        end = _ATOM_RE.match(buf, pos).end()
+    return (pos, end), end
+
+# разбор одного уровня объекта json: список (ключ, значение) и позиция конца
+def _scan_members(buf, pos, value_scan=_scan_span):
+    pos = _skip_ws(buf, pos)
+    if buf[pos:pos + 1] != b"{":
+        raise ValueError(f"Ожидался объект json в позиции {pos}")
+    members = []
+    pos = _skip_ws(buf, pos + 1)
+    if buf[pos:pos + 1] == b"}": # пустой объект
+        return members, pos + 1
+    while True:
+        m = _STR_RE.match(buf, pos) # ключ
+        if not m:
+            raise ValueError(f"Ожидался ключ json в позиции {pos}")
+        key = json.loads(m.group())
+        pos = _skip_ws(buf, m.end())
+        if buf[pos:pos + 1] != b":":
+            raise ValueError(f"Ожидалось ':' в позиции {pos}")
+        value, pos = value_scan(buf, _skip_ws(buf, pos + 1)) # значение (как решит value_scan)
+        members.append((key, value))
+        pos = _skip_ws(buf, pos)
+        ch = buf[pos:pos + 1]
+        if ch == b"}": # конец объекта
+            return members, pos + 1
+        if ch != b",":
+            raise ValueError(f"Ожидалось ',' или '}}' в позиции {pos}")
+        pos = _skip_ws(buf, pos + 1)
+
+# узел из полей объекта: entries/data не разбираются, а запоминаются как границы в буфере
+def _lazy_node(buf, members):
+    spans = dict(members)
+    kind = json.loads(buf[slice(*spans["type"])]) if "type" in spans else None
+    if kind == "dir" or kind is None and "entries" in spans:
+        if "entries" not in spans:
+            return DirNode({})
+        return DirNode(lazy=spans["entries"]) # тяжелое поле - откладываем
+    # остальные мелкие поля файла разбираем сразу
+    node = FileNode(**{key: json.loads(buf[slice(*span)]) for key, span in spans.items() if key in ("hash", "codec", "size")})
+    if "data" in spans: # base64 остается в буфере, размер - по длине строки
+        start, end = node.lazy = spans["data"]
+        node.size = _b64_size(end - start - 2, buf[max(start + 1, end - 3):end - 1])
+    if "blob" in spans: # файл из бинарного образа: смещение и длина в блобе
+        node.blob = tuple(json.loads(buf[slice(*spans["blob"])]))
+        if node.size is None:
+            node.size = node.blob[1]
+    return node
+
+# размер содержимого по длине base64 и ее последним символам (паддингу)
+def _b64_size(length, tail):
+    return length // 4 * 3 - tail.count(b"=" if isinstance(tail, bytes) else "=")
+
+# хэш содержимого файла для таблицы блобов
+def _content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+# кодеки сжатия: имя -> (сжать, распаковать)
+_CODECS = {"zlib": (zlib.compress, zlib.decompress), "lzma": (lzma.compress, lzma.decompress)}
+
+# сжатие содержимого: кодек выбирается по размеру; возвращает (данные, кодек или None, если сжатие не выгодно)
+def _compress(data):
+    if len(data) < COMPRESS_MIN_SIZE:
+        return data, None
+    codec = "lzma" if len(data) >= LZMA_MIN_SIZE else "zlib"
+    packed = _CODECS[codec][0](data)
+    if len(packed) >= len(data): # не сжимается (уже сжатые или случайные данные)
+        return data, None
+    return packed, codec
+
+# распаковка содержимого
+def _decompress(codec, data):
+    return _CODECS[codec][1](data)
+
+# подсчет вызовов метода VFS (для команды stats)
+def _counted(fn):
+    name = fn.__name__
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        self.op_counts[name] = self.op_counts.get(name, 0) + 1
+        return fn(self, *args, **kwargs)
+    return wrapper
+
 # класс VFS файлов
 class JSONVFS:
     def __init__(self, root_node = None, filename = None):
         if root_node is None: # если коревая нода не задана - задаем пустую
-            root_node = {"type": "dir", "entries": {}}
+            root_node = DirNode({})
         self.root = root_node # корневая нода
-        self.cwd = "/" # текущая рабочая папка
+        self._cwd = "/" # текущая рабочая папка
+        self._local = threading.local() # рабочая папка потока, привязанного к сеансу (bind_cwd)
+        self._bound = 0 # сколько потоков сейчас привязано к сеансам (0 - рабочая папка одна)
+        # ленивая подгрузка и кэши меняются и при чтении: читающие потоки сервера берут эту блокировку
+        # (запись в дерево сервер выполняет одним потоком - сами изменения блокировкой не защищаются)
+        self._lock = threading.RLock()
+        self._index_lock = threading.Lock() # построение индексов (отдельно: долгий обход не держит кэши)
         self.filename = filename # имя файла
+        self._buf = None # буфер (mmap) образа для ленивой подгрузки
+        self._file = None # открытый файл образа
+        self._dir_cache = {} # кэш: абсолютный путь директории -> узел
+        self._abs_cache = {} # кэш: (cwd, путь) или абсолютный путь -> нормированный абсолютный путь
+        self.cache_hits = 0 # попадания в кэш директорий
+        self.cache_misses = 0 # промахи кэша директорий
+        self.journal = None # путь журнала изменений (None - журнал выключен)
+        self._journal_file = None # открытый на дозапись журнал
+        self.readonly = False # изменения только в памяти: save и compact запрещены, образ и журнал не трогаются
+        self.generation = 0 # поколение образа: растет при каждом compact, журнал помечен поколением своего образа
+        # таблица блобов: хэш -> [число ссылок, содержимое, размер, кодек]
+        # содержимое - bytes (сырые), str (base64) или (start, end) - строка base64 в буфере образа
+        # кодек - None или имя кодека, которым сжато содержимое (размер - всегда несжатый)
+        self._blobs = {}
+        self._blobs_span = None # границы еще не разобранной таблицы блобов в буфере образа
+        self.op_counts = {} # имя метода -> число вызовов
+        self.node_visits = 0 # сколько узлов пройдено при поиске путей
+        self._index = None # индексы имен и содержимого (строятся при первом find/grep)
+        self.compress = False # сжимать содержимое новых файлов и блобы при сохранении
+        self.decoded_limit = DECODED_CACHE_SIZE # бюджет памяти кэша декодированного содержимого, байт
+        self._decoded = OrderedDict() # LRU: ключ содержимого -> декодированные байты
+        self._decoded_size = 0 # байт в кэше декодированного содержимого
+        self.decoded_hits = 0 # попадания в кэш декодированного содержимого
+        self.decoded_misses = 0 # промахи кэша декодированного содержимого
+        # снимки (copy-on-write): пока есть хоть один снимок, директории не меняются на месте,
+        # а копируются вместе с путем до корня; неизмененные поддеревья общие у снимка и живого дерева
+        self._snapshots = [] # снимки от старого к новому
+        self._snapshot_seq = 0 # счетчик для имен снимков
+        self._owned = set() # id директорий, созданных или скопированных после последнего снимка
+        self._ref_log = [] # (хэш, изменение числа ссылок) после самого старого снимка - для отката таблицы блобов
+        self._orphans = set() # хэши блобов, оставшихся без ссылок после отката, но, может быть, нужных более старым снимкам
+        self.cow_copies = 0 # сколько директорий скопировано при записи со снимками
+
+    # текущая рабочая папка (у потока, привязанного к сеансу, - своя)
+    @property
+    def cwd(self):
+        if self._bound:
+            return getattr(self._local, "cwd", None) or self._cwd
+        return self._cwd
+
+    @cwd.setter
+    def cwd(self, value):
+        if self._bound and getattr(self._local, "cwd", None) is not None:
+            self._local.cwd = value
+        else:
+            self._cwd = value
+
+    # привязать текущий поток к рабочей папке сеанса (cd в нем меняет только ее); None - отвязать
+    def bind_cwd(self, cwd):
+        with self._lock:
+            was = getattr(self._local, "cwd", None) is not None
+            self._bound += (cwd is not None) - was
+            self._local.cwd = cwd
+
+    # включить журнал: изменения дописываются в файл вместо перезаписи всего образа
+    def enable_journal(self, path=None):
+        path = path or (self.filename + JOURNAL_EXT if self.filename else None)
+        if not path:
+            raise ValueError("filename required to journal VFS")
+        self.journal = path
+        self._journal_file = open(path, "a", encoding="utf-8")
+        if not self._journal_file.tell(): # новый журнал начинается с поколения образа
+            self._log_base()
+
+    # первая запись журнала: поколение образа, к которому относятся изменения
+    def _log_base(self):
+        self._journal_file.write(json.dumps({"op": "base", "generation": self.generation}, separators=(",", ":")) + "\n")
+        self._journal_file.flush()
+
+    # дописать запись в журнал (если он включен)
+    def _log(self, op, path, **extra):
+        if self._journal_file is None:
+            return
+        rec = {"op": op, "path": path}
+        rec.update(extra)
+        self._journal_file.write(json.dumps(rec, separators=(",", ":"), ensure_ascii=False) + "\n")
+        self._journal_file.flush() # запись уходит в ОС сразу, fsync - при save
+
+    # применить записи журнала к дереву; возвращает False, если журнал от прошлого поколения образа
+    # (падение между заменой образа и очисткой журнала в compact - его изменения уже в образе)
+    # журнал без записи base (старый формат) относится к поколению 0
+    def _replay_journal(self, path):
+        journal_file, self._journal_file = self._journal_file, None # при повторе ничего не пишем
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                first = True
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError: # оборванная последняя запись (падение во время записи)
+                        break
+                    op, target = rec.get("op"), rec.get("path")
+                    if first:
+                        first = False
+                        base = rec.get("generation", 0) if op == "base" else 0
+                        if base != self.generation:
+                            return False
+                    try:
+                        if op == "write":
+                            self.write_bytes(target, base64.b64decode(rec.get("data", "")))
+                        elif op == "mkdir":
+                            self.mkdir(target, exist_ok=True)
+                        elif op == "rm":
+                            self.remove(target)
+                        elif op == "rmdir":
+                            self.rmdir(target)
+                        elif op == "copy":
+                            self.copy(rec.get("src"), target)
+                        elif op == "cwd":
+                            self.cwd = target
+                    except (OSError, TypeError): # запись не ложится на дерево (уже удалено, тип узла другой и т.п.) -
+                        pass # пропускаем ее, а не весь образ
+        finally:
+            self._journal_file = journal_file
+        return True
+
+    # свернуть журнал в базовый образ (атомарная замена файла) и очистить журнал
+    @_counted
+    def compact(self):
+        if not self.filename:
+            raise ValueError("filename required to compact VFS")
+        if self.readonly:
+            raise ValueError("VFS is read-only")
+        self.generation += 1 # новый образ - новое поколение: старые записи журнала к нему уже не применяются
+        try:
+            self._dump(self.filename)
+        except BaseException:
+            self.generation -= 1
+            raise
+        if self._journal_file is not None:
+            self._journal_file.seek(0)
+            self._journal_file.truncate()
+            self._log_base()
+            os.fsync(self._journal_file.fileno())
+        return True
+
+    # таблица блобов (разбирается из буфера образа при первом обращении)
+    def _blob_table(self):
+        if self._blobs_span is not None:
+            with self._lock:
+                if self._blobs_span is not None: # другой поток мог разобрать таблицу, пока ждали
+                    self._parse_blobs()
+        return self._blobs
+
+    # разбор таблицы блобов из буфера образа (span сбрасывается, когда таблица заполнена)
+    def _parse_blobs(self):
+        start, _ = self._blobs_span
+        members, _ = _scan_members(self._buf, start, _scan_members)
+        for h, fields in members:
+            spans = dict(fields)
+            refs = json.loads(self._buf[slice(*spans["refs"])]) if "refs" in spans else 1
+            codec = json.loads(self._buf[slice(*spans["codec"])]) if "codec" in spans else None
+            b_start, b_end = spans["data"]
+            if "size" in spans: # у сжатого блоба несжатый размер записан отдельно
+                size = json.loads(self._buf[slice(*spans["size"])])
+            else:
+                size = _b64_size(b_end - b_start - 2, self._buf[max(b_start + 1, b_end - 3):b_end - 1])
+            self._blobs[h] = [refs, (b_start, b_end), size, codec]
+        self._blobs_span = None
+
+    # положить содержимое в таблицу блобов (или добавить ссылку на уже лежащее), вернуть хэш
+    # h - уже посчитанный хэш data
+    def _intern(self, data, h=None):
+        if h is None:
+            h = _content_hash(data)
+        table = self._blob_table()
+        entry = table.get(h)
+        if entry is None:
+            stored, codec = _compress(bytes(data)) if self.compress else (bytes(data), None)
+            table[h] = [1, stored, len(data), codec]
+        else:
+            entry[0] += 1
+        if self._snapshots:
+            self._ref_log.append((h, 1))
+        return h
+
+    # добавить ссылку на блоб, который уже есть в таблице
+    def _add_ref(self, h):
+        self._blob_table()[h][0] += 1
+        if self._snapshots:
+            self._ref_log.append((h, 1))
+
+    # отпустить ссылку узла на блоб (блоб без ссылок удаляется)
+    def _release_node(self, node):
+        if node.is_dir: # у директории нет содержимого
+            return
+        h = node.hash
+        if h is None:
+            self._uncache(self._cache_key(node))
+            return
+        table = self._blob_table()
+        entry = table.get(h)
+        if entry is None:
+            return
+        entry[0] -= 1
+        if self._snapshots: # блоб может понадобиться при откате - удалим при сбросе снимков
+            self._ref_log.append((h, -1))
+        elif entry[0] <= 0:
+            del table[h]
+            self._uncache(h)
+
+    # base64 строки из буфера образа (view - без копирования, если это возможно)
+    def _span_b64(self, span, view=False):
+        start, end = span
+        if self._buf.find(b"\\", start + 1, end - 1) != -1: # есть экранирование - разбираем как строку json
+            return json.loads(self._buf[start:end])
+        if view:
+            return memoryview(self._buf)[start + 1:end - 1]
+        return self._buf[start + 1:end - 1] # без кавычек
+
+    # хранимые (возможно, сжатые) байты блоба
+    def _stored_bytes(self, h):
+        data = self._blob_table()[h][1]
+        if isinstance(data, tuple):
+            return base64.b64decode(self._span_b64(data))
+        if isinstance(data, bytes):
+            return data
+        return base64.b64decode(data)
+
+    # сколько байт занимает хранимое содержимое блоба (без base64)
+    def _stored_size(self, entry):
+        data = entry[1]
+        if entry[3] is None:
+            return entry[2]
+        if isinstance(data, bytes):
+            return len(data)
+        if isinstance(data, tuple):
+            start, end = data
+            return _b64_size(end - start - 2, self._buf[max(start + 1, end - 3):end - 1])
+        return _b64_size(len(data), data[-2:])
+
+    # сжать блобы, которые хранятся несжатыми (перед сохранением с включенным compress)
+    def _compress_blobs(self):
+        for h, entry in self._blob_table().items():
+            if entry[3] is None and entry[2] >= COMPRESS_MIN_SIZE:
+                packed, codec = _compress(self._stored_bytes(h))
+                if codec is not None:
+                    entry[1], entry[3] = packed, codec
+
+    # ключ содержимого узла в кэше декодированного содержимого
+    def _cache_key(self, node):
+        if node.hash is not None: # содержимое неизменно для хэша
+            return node.hash
+        if node.blob is not None:
+            return ("pack", node.blob[0])
+        if node.lazy is not None:
+            return ("span", node.lazy[0])
+        return ("node", id(node))
+
+    # декодированное содержимое из кэша (или decode() с сохранением в кэш, вытесняя давно не использованное)
+    # декодирование идет вне блокировки: параллельные читатели декодируют разное содержимое одновременно
+    def _cached_decode(self, key, decode):
+        with self._lock:
+            data = self._decoded.get(key)
+            if data is not None:
+                self._decoded.move_to_end(key)
+                self.decoded_hits += 1
+                return data
+            self.decoded_misses += 1
+        data = decode()
+        if len(data) <= self.decoded_limit: # больше бюджета - не кэшируем
+            with self._lock:
+                if key not in self._decoded: # другой поток мог декодировать то же самое
+                    self._decoded[key] = data
+                    self._decoded_size += len(data)
+                while self._decoded_size > self.decoded_limit:
+                    _, old = self._decoded.popitem(last=False)
+                    self._decoded_size -= len(old)
+        return data
+
+    # убрать содержимое из кэша декодированного содержимого
+    def _uncache(self, key):
+        with self._lock:
+            data = self._decoded.pop(key, None)
+            if data is not None:
+                self._decoded_size -= len(data)
+
+    # задать бюджет памяти кэша декодированного содержимого (лишнее вытесняется сразу)
+    def set_decoded_limit(self, limit):
+        with self._lock:
+            self.decoded_limit = limit
+            while self._decoded and self._decoded_size > limit:
+                _, old = self._decoded.popitem(last=False)
+                self._decoded_size -= len(old)
+
+    # статистика кэша декодированного содержимого
+    def decoded_cache_info(self):
+        total = self.decoded_hits + self.decoded_misses
+        return {"hits": self.decoded_hits, "misses": self.decoded_misses, "items": len(self._decoded),
+                "size": self._decoded_size, "limit": self.decoded_limit,
+                "hit_rate": self.decoded_hits / total if total else 0.0}
+
+    # статистика таблицы блобов: сколько содержимого хранится и на сколько файлов оно приходится
+    def blob_stats(self):
+        table = self._blob_table()
+        physical = sum(entry[2] for entry in table.values()) # байт хранится
+        logical = sum(entry[0] * entry[2] for entry in table.values()) # байт видят файлы
+        return {
+            "blobs": len(table),
+            "refs": sum(entry[0] for entry in table.values()),
+            "physical": physical,
+            "stored": sum(self._stored_size(entry) for entry in table.values()), # байт после сжатия
+            "compressed": sum(1 for entry in table.values() if entry[3] is not None),
+            "logical": logical,
+            "ratio": logical / physical if physical else 1.0,
+        }
+
+    # индексы для find/grep (при первом обращении строятся обходом дерева)
+    def index(self):
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    from vfs_index import VFSIndex
+                    index = VFSIndex(self)
+                    index.build()
+                    self._index = index
+        return self._index
+
+    # размер файла по узлу (без декодирования содержимого)
+    def _node_size(self, node):
+        if node.size is not None: # размер хранится в узле
+            return node.size
+        if node.hash is not None:
+            return self._blob_table()[node.hash][2]
+        data = node.data or ""
+        node.size = _b64_size(len(data), data[-2:]) # запоминаем в узле, чтобы не считать снова
+        return node.size
+
+    # поиск по индексу имен: glob по имени, тип ("f"/"d"), условие на размер
+    @_counted
+    def find(self, path=".", name=None, kind=None, size=None):
+        scope = self.abspath(path)
+        if not self.is_dir(scope):
+            raise NotADirectoryError(path)
+        return self.index().find(scope, name, kind, size)
+
+    # поиск по содержимому: читаются только файлы, подходящие по триграммам
+    # возвращает генератор (путь, номер строки, строка)
+    @_counted
+    def grep(self, pattern, path=".", ignore_case=False):
+        from vfs_index import required_literal
+        rx = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+        literal = required_literal(pattern)
+        if ignore_case and not literal.isascii(): # триграммы без учета регистра только для ascii
+            literal = ""
+        scope = self.abspath(path)
+        if not self.exists(scope):
+            raise FileNotFoundError(path)
+        index = self.index()
+        return self._grep(rx, index, index.candidates(literal, scope))
+
+    # проверка файлов-кандидатов (одинаковое содержимое читается один раз)
+    def _grep(self, rx, index, paths):
+        by_hash = {} # хэш -> найденные строки
+        for path in paths:
+            h = index.path_hash[path]
+            if h not in by_hash:
+                index.files_decoded += 1
+                text = str(self._raw_bytes(index.paths[path]), "utf-8", errors="replace")
+                by_hash[h] = [(i, line) for i, line in enumerate(text.splitlines(), 1) if rx.search(line)]
+            for i, line in by_hash[h]:
+                yield path, i, line
+
+    # статистика работы vfs: вызовы методов, пройденные узлы, кэш путей
+    def vfs_stats(self):
+        return {"ops": dict(self.op_counts), "node_visits": self.node_visits, "cache": self.cache_info(),
+                "decoded": self.decoded_cache_info(), "snapshots": len(self._snapshots), "cow_copies": self.cow_copies}
+
+    # статистика кэша путей
+    def cache_info(self):
+        return {"hits": self.cache_hits, "misses": self.cache_misses, "size": len(self._dir_cache)}
+
+    # сброс кэша путей (после массовых изменений дерева)
+    def _invalidate(self, path=None):
+        if path is None:
+            self._dir_cache.clear()
+        else:
+            self._dir_cache.pop(path, None)
+
+    # закрыть образ (после полной подгрузки всех ленивых узлов)
+    def close(self):
+        if self._snapshots: # закрытый образ нельзя откатить
+            self.drop_snapshot(self._snapshots[0]["name"])
+        if self._buf is not None:
+            self._materialize_all(self.root)
+            for entry in self._blob_table().values(): # блобы из буфера переносим в память
+                if isinstance(entry[1], tuple):
+                    data = self._span_b64(entry[1])
+                    entry[1] = data.decode("ascii") if isinstance(data, bytes) else data
+            self._release()
+
+    # отпустить буфер и файл образа
+    def _release(self):
+        try:
+            self._buf.close()
+        except BufferError: # на буфер еще ссылаются memoryview из read_bytes - закроет сборщик мусора
+            pass
+        self._file.close()
+        self._buf = None
+        self._file = None
+        self._decoded.clear() # ключи по смещениям в буфере больше не действительны
+        self._decoded_size = 0
+
+    # подгрузка дочерних элементов ленивой директории
+    def _materialize(self, node):
+        start, _ = node.lazy
+        # разбираем entries на один уровень: имя -> поля дочернего объекта
+        members, _ = _scan_members(self._buf, start, _scan_members)
+        node.entries = {sys.intern(name): _lazy_node(self._buf, fields) for name, fields in members}
+        node.lazy = None # только после entries: читающий без блокировки не увидит пустую директорию
+
+    # подгрузка всего поддерева (нужна перед сохранением); содержимое файлов переносится в таблицу блобов
+    def _materialize_all(self, node):
+        if not node.is_dir:
+            if node.hash is None:
+                node.set_hash(self._intern(self._raw_bytes(node)))
+            return
+        for child in self._entries(node).values():
+            self._materialize_all(child)
+
+    # дочерние элементы директории (подгружаются при первом заходе)
+    def _entries(self, node):
+        if not node.is_dir: # у файла нет дочерних элементов
+            return NO_ENTRIES
+        if node.lazy is not None:
+            with self._lock:
+                if node.lazy is not None: # другой поток мог подгрузить директорию, пока ждали
+                    self._materialize(node)
+        return node.entries
+
+    # base64 данные файла вне таблицы блобов (из буфера, если узел ленивый)
+    def _file_data(self, node):
+        if node.lazy is not None:
+            return self._span_b64(node.lazy)
+        return node.data or ""
+
+    # содержимое файла: срез mmap без копирования для несжатого бинарного образа, сырые байты блоба,
+    # иначе декодированный base64 / распакованные данные (через LRU кэш)
+    def _raw_bytes(self, node):
+        if node.blob is not None:
+            off, length = node.blob
+            view = memoryview(self._buf)[off:off + length]
+            codec = node.codec
+            if codec is None:
+                return view
+            return self._cached_decode(("pack", off), lambda: _decompress(codec, view))
+        if node.hash is not None:
+            h = node.hash
+            _, data, _, codec = self._blob_table()[h]
+            if isinstance(data, bytes) and codec is None: # сырые байты лежат в памяти
+                return data
+            if codec is None:
+                return self._cached_decode(h, lambda: self._stored_bytes(h))
+            return self._cached_decode(h, lambda: _decompress(codec, self._stored_bytes(h)))
+        return self._cached_decode(self._cache_key(node), lambda: base64.b64decode(self._file_data(node)))
 
     # возвращает родит. узел и имя конечного элемента
     def _walk_parent(self, path, create = False):
@@ -38,31 +647,177 @@ class JSONVFS:
         if path == "/": # если корневая - возвращаем корневую
             return self.root, "/"
 
+        head, _, name = path.rpartition("/") # путь родителя и имя конечного элемента
+        head = head or "/"
+        node = self._dir_cache.get(head) # родитель уже находили - берем из кэша
+        if node is not None:
+            self.cache_hits += 1
+            self.node_visits += 1
+            return node, name
+        self.cache_misses += 1
+
         parts = _split_path(path) # делим путь на части
+        self.node_visits += len(parts)
 
         node = self.root # создаем переменную-ноду
-        for part in parts[:-1]: # проходимся от корня до последнего элемента
-            entries = node.setdefault("entries", {}) # берем по ключу entries или задаем пустой словарь
+        for i, part in enumerate(parts[:-1]): # проходимся от корня до последнего элемента
+            entries = self._entries(node) # берем дочерние элементы (подгружаем при необходимости)
             if part not in entries: # если ноды нету в дочерних нодах
                 if create: # если создание директорий включено - создаем
-                    entries[part] = {"type": "dir", "entries": {}}
+                    entries[part] = self._new_dir()
+                    self._name_added(node, part)
+                    self._grow(node, parts[:i], 0, 0, 1)
+                    if self._index is not None:
+                        self._index.add_dir("/" + "/".join(parts[:i + 1]), entries[part])
                 else: # иначе - возвращаем ненахождение
                     return None, None
             node = entries[part] # переходим дальше по пути
-            if node.get("type") != "dir": # если нода не директория - вовзращаем ненахождение
+            if not node.is_dir: # если нода не директория - вовзращаем ненахождение
                 return None, None
+        self._entries(node) # подгружаем родителя
+        if len(self._dir_cache) >= PATH_CACHE_SIZE:
+            self._dir_cache.clear()
+        self._dir_cache[head] = node # запоминаем родителя
         return node, parts[-1] # возвращаем родителя и конечный элемент
 
+    # родитель для изменения: без снимков - как _walk_parent, со снимками - путь копируется (copy-on-write)
+    def _parent_for_write(self, path, create=False):
+        if not self._snapshots:
+            return self._walk_parent(path, create)
+        path = self.abspath(path)
+        if path == "/":
+            return self._own_root(), "/"
+        parts = _split_path(path)
+        node = self._own_root()
+        for i, part in enumerate(parts[:-1]):
+            entries = self._entries(node)
+            child = entries.get(part)
+            if child is None:
+                if not create:
+                    return None, None
+                child = entries[part] = self._new_dir()
+                self._name_added(node, part)
+                self._grow(node, parts[:i], 0, 0, 1)
+                self._owned.add(id(child))
+                if self._index is not None:
+                    self._index.add_dir("/" + "/".join(parts[:i + 1]), child)
+            elif not child.is_dir:
+                return None, None
+            elif id(child) not in self._owned: # директория общая со снимком - копируем
+                child = entries[part] = self._cow_copy(child, "/" + "/".join(parts[:i + 1]))
+            node = child
+        self._entries(node)
+        self._dir_cache[path.rpartition("/")[0] or "/"] = node # в кэше - уже своя копия родителя
+        return node, parts[-1]
+
+    # корень живого дерева, который можно менять (копируется при первом изменении после снимка)
+    def _own_root(self):
+        if id(self.root) not in self._owned:
+            self.root = self._cow_copy(self.root, "/")
+        return self.root
+
+    # копия директории для записи: копируется только словарь entries, дочерние узлы остаются общими
+    def _cow_copy(self, node, path):
+        copy = DirNode(dict(self._entries(node)))
+        if node.names is not None: # индекс имен копии меняется отдельно от снимка
+            copy.names = list(node.names)
+        copy.totals = node.totals
+        self._owned.add(id(copy))
+        self.cow_copies += 1
+        self._invalidate(path) # в кэше была старая (общая со снимком) директория
+        return copy
+
+    # создать снимок: O(1), дерево не копируется; возвращает имя снимка
+    def snapshot(self, name=None):
+        self._snapshot_seq += 1
+        name = name or f"#{self._snapshot_seq}"
+        if any(snap["name"] == name for snap in self._snapshots):
+            raise FileExistsError(name)
+        self._snapshots.append({
+            "name": name,
+            "root": self.root,
+            "cwd": self.cwd,
+            "ref_log": len(self._ref_log), # с какой записи журнала ссылок отменять
+            "journal": self._journal_file.tell() if self._journal_file is not None else None,
+            "cow_copies": self.cow_copies,
+        })
+        self._owned = set() # все текущие директории теперь общие со снимком
+        return name
+
+    # номер снимка по имени (None - последний)
+    def _snapshot_pos(self, name):
+        if not self._snapshots:
+            raise LookupError("no snapshots")
+        if name is None:
+            return len(self._snapshots) - 1
+        for i, snap in enumerate(self._snapshots):
+            if snap["name"] == name:
+                return i
+        raise LookupError(name)
+
+    # откат к снимку (None - к последнему); снимок остается, более новые удаляются
+    def rollback(self, name=None):
+        pos = self._snapshot_pos(name)
+        snap = self._snapshots[pos]
+        del self._snapshots[pos + 1:]
+        table = self._blob_table()
+        for h, delta in reversed(self._ref_log[snap["ref_log"]:]): # возвращаем числа ссылок
+            entry = table.get(h)
+            if entry is not None:
+                entry[0] -= delta
+        undone = {h for h, _ in self._ref_log[snap["ref_log"]:]}
+        del self._ref_log[snap["ref_log"]:]
+        if pos == 0: # старше снимков нет, а сам снимок совпадает с живым деревом - блобы без ссылок не нужны никому
+            self._purge(undone | self._orphans)
+            self._orphans = set()
+        else: # более старые снимки могут ссылаться на эти блобы - удалим, когда снимков не останется
+            self._orphans |= undone
+        self.root = snap["root"]
+        self.cwd = snap["cwd"]
+        snap["cow_copies"] = self.cow_copies
+        self._owned = set()
+        self._dir_cache.clear()
+        self._index = None # индексы перестроятся при следующем поиске
+        if self._journal_file is not None and snap["journal"] is not None: # отмененные изменения убираем из журнала
+            self._journal_file.seek(snap["journal"])
+            self._journal_file.truncate()
+        return snap["name"]
+
+    # удалить снимок (None - последний) и все более новые: изменения остаются в дереве
+    def drop_snapshot(self, name=None):
+        pos = self._snapshot_pos(name)
+        del self._snapshots[pos:]
+        if not self._snapshots: # снимков больше нет - удаляем блобы без ссылок
+            self._purge({h for h, _ in self._ref_log} | self._orphans)
+            self._ref_log = []
+            self._orphans = set()
+            self._owned = set()
+
+    # удалить из таблицы блобов те из hashes, на которые не осталось ссылок
+    def _purge(self, hashes):
+        table = self._blob_table()
+        for h in hashes:
+            entry = table.get(h)
+            if entry is not None and entry[0] <= 0:
+                del table[h]
+                self._uncache(h)
+
+    # список снимков: имя и сколько директорий скопировано после него
+    def snapshots(self):
+        return [(snap["name"], self.cow_copies - snap["cow_copies"]) for snap in self._snapshots]
+
     # проверка на существование
+    @_counted
     def exists(self, path):
         parent, name = self._walk_parent(path) # находим родит. узел и конечный элемент
         if parent is None: # если нет родителя - не существует - не нашли
             return False
         if name == "/": # если корневая - всегда существует
             return True
-        return name in parent.get("entries", {}) # возвращаем флаг поиска элемента в родителе
+        return name in self._entries(parent) # возвращаем флаг поиска элемента в родителе
 
     # проверка, что директория
+    @_counted
     def is_dir(self, path):
         if _norm_path(path) == "/": # если корневая - всегда директория
             return True
@@ -70,21 +825,23 @@ class JSONVFS:
         if not parent: # нет родителя - не нашли
             return False
 
-        node = parent.get("entries", {}).get(name) # ищем конечный элемент в родителе
+        node = self._entries(parent).get(name) # ищем конечный элемент в родителе
 
-        return bool(node and node.get("type") == "dir") # если элемент есть и его тип - директория = истина
+        return node is not None and node.is_dir # если элемент есть и его тип - директория = истина
 
     # проверка, что файл
+    @_counted
     def is_file(self, path):
         parent, name = self._walk_parent(path) # находим родит. узел и конечный элемент
         if not parent: # нет родителя - не нашли
             return False
 
-        node = parent.get("entries", {}).get(name) # ищем конечный элемент в родителе
+        node = self._entries(parent).get(name) # ищем конечный элемент в родителе
 
-        return bool(node and node.get("type") == "file") # если элемент есть и его тип - файл = истина
+        return node is not None and not node.is_dir # если элемент есть и его тип - файл = истина
 
     # (ls) возвращает открытый каталог
+    @_counted
     def listdir(self, path = "/"):
         abs_path = self.abspath(path) # получаем абсолютный путь
         if abs_path == "/": # если корень - берем корневой узел
@@ -94,111 +851,507 @@ class JSONVFS:
             if not parent: # если нет родителя - поднимаем ошибку
                 raise FileNotFoundError(path)
 
-            node = parent.get("entries", {}).get(name) # находим нужный элемент в родителе
+            node = self._entries(parent).get(name) # находим нужный элемент в родителе
 
-        if not node or node.get("type") != "dir": # если не директория - поднимаем ошибку
+        if node is None or not node.is_dir: # если не директория - поднимаем ошибку
             raise NotADirectoryError(path)
-        return sorted(list(node.get("entries", {}).keys())) # выводим отсортированный список элементов узла
+        return list(self._sorted_names(node)) # копия отсортированного индекса имен (без сортировки на каждый вызов)
+
+    # отсортированные имена директории: индекс строится при первом обращении, дальше поддерживается при изменениях
+    def _sorted_names(self, node):
+        if node.names is None:
+            node.names = sorted(self._entries(node))
+        return node.names
+
+    # новое имя в директории - в индекс имен (если он уже построен)
+    def _name_added(self, node, name):
+        if node.names is not None:
+            insort(node.names, name)
+
+    # имя удалено из директории - убираем из индекса имен
+    def _name_removed(self, node, name):
+        names = node.names
+        if names is not None:
+            i = bisect_left(names, name)
+            if i < len(names) and names[i] == name:
+                del names[i]
+
+    # новая (пустая) директория: итоги известны сразу
+    def _new_dir(self):
+        node = DirNode({})
+        node.totals = (0, 0, 0)
+        return node
+
+    # итоги поддерева директории: (байт, файлов, директорий); при первом обращении считаются обходом
+    # (размеры файлов - из узлов и таблицы блобов, без декодирования), дальше их поддерживает _grow
+    # у директории с итогами итоги есть и у всех поддиректорий
+    def _totals(self, node):
+        if node.totals is None:
+            size = files = dirs = 0
+            for child in self._entries(node).values():
+                if child.is_dir:
+                    b, f, d = self._totals(child)
+                    size += b
+                    files += f
+                    dirs += d + 1
+                else:
+                    size += self._node_size(child)
+                    files += 1
+            node.totals = (size, files, dirs)
+        return node.totals
+
+    # изменение содержимого директории parent (путь parts от корня): итоги меняются у всех посчитанных
+    # директорий на пути от корня; у parent итогов нет - значит, нет и выше, обходить нечего
+    def _grow(self, parent, parts, size, files, dirs):
+        if parent.totals is None or not (size or files or dirs):
+            return
+        node = self.root
+        for part in (*parts, None):
+            if node.totals is not None:
+                b, f, d = node.totals
+                node.totals = (b + size, f + files, d + dirs)
+            if part is not None:
+                node = node.entries[part]
+
+    # итоги по пути: (байт, файлов, директорий); для файла - (размер, 1, 0)
+    @_counted
+    def totals(self, path="."):
+        node = self._node(path)
+        if node is None:
+            raise FileNotFoundError(path)
+        if not node.is_dir:
+            return self._node_size(node), 1, 0
+        return self._totals(node)
+
+    # сведения об элементе: тип, размер, для директории - элементов и итоги поддерева,
+    # для файла - хэш содержимого, число ссылок на него, кодек и размер в образе
+    @_counted
+    def stat(self, path="."):
+        abs_path = self.abspath(path)
+        node = self._node(abs_path)
+        if node is None:
+            raise FileNotFoundError(path)
+        if node.is_dir:
+            size, files, dirs = self._totals(node)
+            return {"path": abs_path, "type": "dir", "size": size, "entries": len(self._entries(node)),
+                    "files": files, "dirs": dirs}
+        info = {"path": abs_path, "type": "file", "size": self._node_size(node), "hash": node.hash,
+                "refs": 1, "codec": node.codec, "stored": None}
+        entry = self._blob_table().get(node.hash) if node.hash is not None else None
+        if entry is not None:
+            info.update(refs=entry[0], codec=entry[3], stored=self._stored_size(entry))
+        elif node.blob is not None:
+            info["stored"] = node.blob[1]
+        return info
+
+    # du: (путь, байт, файлов) директорий поддерева до глубины depth (None - все), вложенные раньше родителя
+    @_counted
+    def du(self, path=".", depth=None):
+        abs_path = self.abspath(path)
+        node = self._node(abs_path)
+        if node is None:
+            raise FileNotFoundError(path)
+        if not node.is_dir:
+            return iter([(abs_path, self._node_size(node), 1)])
+        return self._du(node, abs_path, depth)
+
+    def _du(self, node, path, depth):
+        if depth is None or depth > 0:
+            entries = self._entries(node)
+            for name in self._sorted_names(node):
+                child = entries[name]
+                if child.is_dir:
+                    yield from self._du(child, path.rstrip("/") + "/" + name, None if depth is None else depth - 1)
+        size, files, _ = self._totals(node)
+        yield path, size, files
+
+    # строки дерева директории: (отступ, имя, директория ли, байт, файлов) по порядку имен;
+    # depth - сколько уровней показывать (None - все), skip - сколько первых строк пропустить:
+    # поддеревья, целиком попадающие в пропуск, не обходятся - число их строк берется из итогов
+    @_counted
+    def tree(self, path=".", depth=None, skip=0):
+        node = self._node(path)
+        if node is None:
+            raise FileNotFoundError(path)
+        if not node.is_dir:
+            raise NotADirectoryError(path)
+        return self._tree(node, "", depth, [skip])
+
+    def _tree(self, node, indent, depth, skip):
+        entries = self._entries(node)
+        names = self._sorted_names(node)
+        last = len(names) - 1
+        below = None if depth is None else depth - 1 # уровней под дочерним элементом
+        start = 0
+        if skip[0] and not self._totals(node)[2]: # поддиректорий нет - строка на элемент, пропуск сразу
+            start = min(skip[0], len(names))
+            skip[0] -= start
+        for i in range(start, len(names)):
+            name = names[i]
+            child = entries[name]
+            if skip[0]: # строка и ее поддерево целиком в пропуске - не спускаемся
+                lines = 1 + (self._tree_lines(child, below) if child.is_dir else 0)
+                if skip[0] >= lines:
+                    skip[0] -= lines
+                    continue
+            if skip[0]:
+                skip[0] -= 1
+            elif child.is_dir:
+                size, files, _ = self._totals(child)
+                yield indent + ("└── " if i == last else "├── "), name, True, size, files
+            else:
+                yield indent + ("└── " if i == last else "├── "), name, False, self._node_size(child), 1
+            if child.is_dir and (below is None or below > 0):
+                yield from self._tree(child, indent + ("    " if i == last else "│   "), below, skip)
+
+    # сколько строк дерева под директорией при depth уровнях (None - все: по итогам, за O(1))
+    def _tree_lines(self, node, depth):
+        if depth is None:
+            _, files, dirs = self._totals(node)
+            return files + dirs
+        if depth <= 0:
+            return 0
+        entries = self._entries(node)
+        if depth == 1:
+            return len(entries)
+        return len(entries) + sum(self._tree_lines(child, depth - 1) for child in entries.values() if child.is_dir)
+
+    # дополнение пути: (варианты, сколько их всего, общее начало всех вариантов) для prefix - пути
+    # относительно текущей директории, как он набран; у директорий в конце "/"; limit - сколько вариантов вернуть
+    # имена берутся из отсортированного индекса директории: варианты идут подряд, их границы - двоичным поиском
+    @_counted
+    def complete(self, prefix, limit=None):
+        head, sep, base = prefix.rpartition("/")
+        dir_path = (head or "/") if sep else "."
+        abs_dir = self.abspath(dir_path)
+        if abs_dir == "/":
+            node = self.root
+        else:
+            parent, name = self._walk_parent(abs_dir)
+            node = self._entries(parent).get(name) if parent else None
+        if node is None or not node.is_dir:
+            return [], 0, prefix
+        names = self._sorted_names(node)
+        entries = self._entries(node)
+        lo = bisect_left(names, base)
+        hi = bisect_left(names, base + "\U0010ffff") # все имена с началом base идут подряд
+        if lo == hi:
+            return [], 0, prefix
+        start = head + sep
+        shown = names[lo:hi if limit is None else min(hi, lo + limit)]
+        matches = [start + name + ("/" if entries[name].is_dir else "") for name in shown]
+        # у отсортированных имен общее начало всех - это общее начало первого и последнего
+        common = matches[0] if hi - lo == 1 else start + os.path.commonprefix([names[lo], names[hi - 1]])
+        return matches, hi - lo, common
 
     # чтение из base64
+    @_counted
     def read_bytes(self, path):
         parent, name = self._walk_parent(path) # находим родит. узел и конечный элемент
         if not parent: # если нет родителя - поднимаем ошибку
             raise FileNotFoundError(path)
 
-        node = parent.get("entries", {}).get(name) # находим нужный элемент в родителе
+        node = self._entries(parent).get(name) # находим нужный элемент в родителе
+
+        if node is None or node.is_dir: # если не файл - поднимаем оишбку
+            raise FileNotFoundError(path)
+
+        # возвращаем содержимое файла (bytes или memoryview для бинарного образа)
+        return self._raw_bytes(node)
+
+    # узел по пути (None - нет такого элемента)
+    def _node(self, path):
+        abs_path = self.abspath(path)
+        if abs_path == "/":
+            return self.root
+        parent, name = self._walk_parent(abs_path)
+        return self._entries(parent).get(name) if parent else None
+
+    # узел файла по пути (FileNotFoundError, если это не файл)
+    def _file_node(self, path):
+        parent, name = self._walk_parent(path) # находим родит. узел и конечный элемент
+        node = self._entries(parent).get(name) if parent else None
+        if node is None or node.is_dir:
+            raise FileNotFoundError(path)
+        return node
+
+    # размер файла в байтах (хранится в узле или в таблице блобов, содержимое не декодируется)
+    @_counted
+    def file_size(self, path):
+        return self._node_size(self._file_node(path))
+
+    # чтение length байт файла с позиции offset (offset < 0 - от конца, length None - до конца);
+    # декодируется только нужный кусок, а не весь файл
+    @_counted
+    def read_range(self, path, offset=0, length=None):
+        return self._range_node(self._file_node(path), offset, length)
+
+    # кусок содержимого файла [offset, offset + length)
+    def _range_node(self, node, offset, length):
+        size = self._node_size(node)
+        if offset < 0:
+            offset = max(0, size + offset)
+        end = size if length is None else min(size, offset + max(0, length))
+        if offset >= end:
+            return b""
+        if node.blob is not None and node.codec is None: # бинарный образ - срез mmap без копирования
+            off = node.blob[0]
+            return memoryview(self._buf)[off + offset:off + end]
+        entry = self._blob_table()[node.hash] if node.hash is not None else None
+        # сжатое содержимое по кускам не читается - распаковываем целиком (через кэш), сырые байты режем сразу
+        if node.codec is not None or entry is not None and (entry[3] is not None or isinstance(entry[1], bytes)) \
+                or self._cache_key(node) in self._decoded:
+            return self._raw_bytes(node)[offset:end]
+        data = entry[1] if entry else node.lazy if node.lazy is not None else node.data or ""
+        if isinstance(data, tuple): # base64 в буфере образа
+            data = self._span_b64(data, view=True)
+        # base64 кодирует каждые 3 байта 4 символами независимо: декодируем только блоки, покрывающие кусок
+        first = offset // 3
+        chunk = base64.b64decode(data[first * 4:-(-end // 3) * 4])
+        return chunk[offset - first * 3:end - first * 3]
+
+    # потоковое чтение файла кусками по chunk_size байт (ошибки поднимаются сразу)
+    @_counted
+    def iter_bytes(self, path, chunk_size=CHUNK_SIZE):
+        parent, name = self._walk_parent(path) # находим родит. узел и конечный элемент
+        if not parent: # если нет родителя - поднимаем ошибку
+            raise FileNotFoundError(path)
+
+        node = self._entries(parent).get(name) # находим нужный элемент в родителе
 
-        if not node or node.get("type") != "file": # если не файл - поднимаем оишбку
+        if node is None or node.is_dir: # если не файл - поднимаем оишбку
             raise FileNotFoundError(path)
+        return self._iter_node(node, chunk_size - chunk_size % 3 or 3)
 
-        # возвращаем декодированные из base64 данные по ключу data или пустую строку
-        return base64.b64decode(node.get("data", ""))
+    # генератор кусков содержимого файла
+    def _iter_node(self, node, chunk_size):
+        if node.blob is not None and node.codec is None: # бинарный образ - срезы mmap без копирования
+            off, length = node.blob
+            view = memoryview(self._buf)
+            for pos in range(off, off + length, chunk_size):
+                yield view[pos:min(pos + chunk_size, off + length)]
+            return
+        entry = self._blob_table()[node.hash] if node.hash is not None else None
+        # сжатые и небольшие файлы декодируются целиком через кэш, большие base64 - по кускам
+        if self._cache_key(node) in self._decoded or node.codec is not None or (entry and entry[3] is not None) \
+                or self._node_size(node) <= self.decoded_limit // 8:
+            data = self._raw_bytes(node)
+        else:
+            data = entry[1] if entry else node.lazy if node.lazy is not None else node.data or ""
+        if isinstance(data, bytes): # сырые байты блоба - срезы без копирования
+            view = memoryview(data)
+            for pos in range(0, len(data), chunk_size):
+                yield view[pos:pos + chunk_size]
+            return
+        if isinstance(data, tuple): # base64 режем прямо в буфере образа
+            data = self._span_b64(data, view=True)
+        step = chunk_size // 3 * 4 # столько символов base64 дают chunk_size байт
+        for pos in range(0, len(data), step):
+            yield base64.b64decode(data[pos:pos + step])
 
     # чтение текстового файла в VFS
+    @_counted
     def read_text(self, path, encoding="utf-8"):
-        # читаем base64 данные, декодируем в UTF-8 и возвращаем флаг
-        return self.read_bytes(path).decode(encoding)
+        # читаем данные файла, декодируем в UTF-8 и возвращаем строку
+        return str(self.read_bytes(path), encoding)
 
     # запись в base64 данные
-    def write_bytes(self, path, data, overwrite=True):
+    # content_hash - хэш data, если он уже посчитан (массовый импорт считает хэши в пуле потоков)
+    @_counted
+    def write_bytes(self, path, data, overwrite=True, content_hash=None):
         # находим родит. узел и конечный элемент (создаем узлы при необходимости)
-        parent, name = self._walk_parent(path, create=True)
+        parent, name = self._parent_for_write(path, create=True)
         if not parent: # если нет родителя - поднимаем ошибку
             raise FileNotFoundError(path)
 
-        entries = parent.setdefault("entries", {}) # берем по ключу entries или задаем пустой словарь
+        entries = self._entries(parent) # берем дочерние элементы родителя
         # если элемент не файлого типа, есть в entries и перезапись не включена - ошибка
-        if name in entries and not overwrite and entries[name].get("type") == "file":
+        if name in entries and not overwrite and not entries[name].is_dir:
             raise FileExistsError(path)
-        if name in entries and entries[name].get("type") != "file": # если не файл - ошибка
+        if name in entries and entries[name].is_dir: # если не файл - ошибка
             raise TypeError(path)
-        # добавляем (меняем) элемент в entries с заданной data, закодированной в base64
-        entries[name] = {"type": "file", "data": base64.b64encode(data).decode("ascii")}
+        # добавляем (меняем) элемент в entries, содержимое кладется в таблицу блобов один раз
+        old = entries.get(name)
+        if parent.totals is not None: # итоги директорий на пути (пока старое содержимое еще в таблице блобов)
+            old_size = self._node_size(old) if old is not None else 0
+            self._grow(parent, _split_path(self.abspath(path))[:-1], len(data) - old_size, int(old is None), 0)
+        entries[name] = FileNode(hash=self._intern(data, h=content_hash), size=len(data))
+        if old is None:
+            self._name_added(parent, name)
+        if self._index is not None: # индекс обновляется, пока старое содержимое еще доступно
+            self._index.add_file(self.abspath(path), entries[name])
+        if old is not None:
+            self._release_node(old)
+        if self._journal_file is not None:
+            self._log("write", self.abspath(path), data=base64.b64encode(data).decode("ascii"))
         return True
 
+    # перенести содержимое файла старого формата (base64 в узле или в буфере образа) в таблицу блобов;
+    # узел может быть общим со снимком, поэтому он не меняется, а заменяется новым через копирование директорий
+    def _intern_node(self, path, node):
+        parent, name = self._parent_for_write(path)
+        data = self._raw_bytes(node)
+        new = FileNode(hash=self._intern(data), size=len(data))
+        self._entries(parent)[name] = new
+        if self._index is not None:
+            self._index.add_file(self.abspath(path), new)
+        self._release_node(node)
+        return new
+
+    # копирование файла: новый узел ссылается на то же содержимое, данные не копируются
+    @_counted
+    def copy(self, src, dst, overwrite=True):
+        parent, name = self._walk_parent(src) # находим исходный файл
+        node = self._entries(parent).get(name) if parent else None
+        if node is None or node.is_dir:
+            raise FileNotFoundError(src)
+        if self.is_dir(dst): # копирование в директорию - под тем же именем
+            dst = self.abspath(dst).rstrip("/") + "/" + name
+        if node.hash is None and node.blob is None: # содержимое еще не в таблице - кладем один раз
+            node = self._intern_node(src, node)
+
+        dparent, dname = self._parent_for_write(dst, create=True) # находим (создаем) родителя копии
+        if not dparent:
+            raise FileNotFoundError(dst)
+        entries = self._entries(dparent)
+        old = entries.get(dname)
+        if old is not None and old.is_dir: # если не файл - ошибка
+            raise TypeError(dst)
+        if old is not None and not overwrite:
+            raise FileExistsError(dst)
+        if old is node: # копия самого в себя
+            return True
+        if node.hash is not None:
+            self._add_ref(node.hash) # еще одна ссылка на то же содержимое
+        if dparent.totals is not None:
+            old_size = self._node_size(old) if old is not None else 0
+            self._grow(dparent, _split_path(self.abspath(dst))[:-1], self._node_size(node) - old_size, int(old is None), 0)
+        entries[dname] = node.clone()
+        if old is None:
+            self._name_added(dparent, dname)
+        if self._index is not None:
+            self._index.add_file(self.abspath(dst), entries[dname])
+        if old is not None:
+            self._release_node(old)
+        self._log("copy", self.abspath(dst), src=self.abspath(src))
+        return True
+
+    # запись файла из потока кусков байт (append - дописать к текущему содержимому);
+    # поток читается до конца до изменения дерева, поэтому можно писать в файл, который сам читается
+    @_counted
+    def write_chunks(self, path, chunks, append=False):
+        buf = bytearray()
+        if append and self.is_file(path):
+            buf += self.read_bytes(path)
+        for chunk in chunks:
+            buf += chunk
+        return self.write_bytes(path, bytes(buf))
+
     # запись в файл VFS
+    @_counted
     def write_text(self, path, text, encoding="utf-8", overwrite=True):
         # записываем текст в base64 (при необходимости перезаписываем) и возвращаем флаг
         return self.write_bytes(path, text.encode(encoding), overwrite=overwrite)
 
     # создание директории
+    @_counted
     def mkdir(self, path, exist_ok=False):
         # находим родит. узел и конечный элемент (создаем узлы при необходимости)
-        parent, name = self._walk_parent(path, create=True)
+        parent, name = self._parent_for_write(path, create=True)
         if not parent: # если нет родителя - поднимаем ошибку
             raise FileNotFoundError(path)
 
-        entries = parent.setdefault("entries", {}) # берем по ключу entries или задаем пустой словарь
+        entries = self._entries(parent) # берем дочерние элементы родителя
 
         if name in entries: # если уже существует такой элемент
-            if entries[name].get("type") == "dir": # если это директория
+            if entries[name].is_dir: # если это директория
                 if exist_ok: # если не считаем ошибкой (по умолчанию ошибка)
                     return # ничего
                 raise FileExistsError(path) # иначе ошибка
             raise FileExistsError(path)
 
-        entries[name] = {"type": "dir", "entries": {}} # создаем директорию
+        entries[name] = self._new_dir() # создаем директорию
+        self._name_added(parent, name)
+        if parent.totals is not None:
+            self._grow(parent, _split_path(self.abspath(path))[:-1], 0, 0, 1)
+        if self._snapshots:
+            self._owned.add(id(entries[name]))
+        if self._index is not None:
+            self._index.add_dir(self.abspath(path), entries[name])
+        self._log("mkdir", self.abspath(path))
 
     # удалить элемент VFS
+    @_counted
     def remove(self, path):
-        parent, name = self._walk_parent(path) # находим родит. узел и конечный элемент
+        parent, name = self._parent_for_write(path) # находим родит. узел и конечный элемент
         # если нет родителя или элемента - ошибка
-        if not parent or name not in parent.get("entries", {}):
+        if not parent or name not in self._entries(parent):
             raise FileNotFoundError(path)
 
-        node = parent["entries"][name] # берем найденный элемент по ключу
+        node = parent.entries[name] # берем найденный элемент по ключу
 
         # если это директория и содержит элементы - ошибка
-        if node.get("type") == "dir" and node.get("entries"):
+        if node.is_dir and self._entries(node):
             raise OSError("Directory not empty")
+        if self._index is not None:
+            self._index.discard(self.abspath(path))
+        if parent.totals is not None: # размер берем, пока содержимое еще в таблице блобов
+            parts = _split_path(self.abspath(path))[:-1]
+            if node.is_dir:
+                self._grow(parent, parts, 0, 0, -1)
+            else:
+                self._grow(parent, parts, -self._node_size(node), -1, 0)
+        self._release_node(node) # файл больше не ссылается на свое содержимое
 
-        del parent["entries"][name]  # удаляем элемент из словаря родителя
+        del parent.entries[name]  # удаляем элемент из словаря родителя
+        self._name_removed(parent, name)
+        # удаляемая директория пуста, значит в кэше может быть только она сама
+        self._invalidate(self.abspath(path))
+        self._log("rm", self.abspath(path))
 
     # удаление директории
+    @_counted
     def rmdir(self, path):
-        parent, name = self._walk_parent(path) # находим родит. узел и конечный элемент
+        parent, name = self._parent_for_write(path) # находим родит. узел и конечный элемент
         # если нет родителя или элемента - ошибка
-        if not parent or name not in parent.get("entries", {}):
+        if not parent or name not in self._entries(parent):
             raise FileNotFoundError(path)
 
-        node = parent["entries"][name] # берем найденный элемент по ключу
+        node = parent.entries[name] # берем найденный элемент по ключу
 
-        if node.get("type") != "dir": # если не директория - ошибка
+        if not node.is_dir: # если не директория - ошибка
             raise NotADirectoryError(path)
-        if node.get("entries"): # если не пустая директория - ошибка
+        if self._entries(node): # если не пустая директория - ошибка
             raise OSError("Directory not empty")
-        del parent["entries"][name] # удаляем элемент из словаря родителя
+        if self._index is not None:
+            self._index.discard(self.abspath(path))
+        if parent.totals is not None:
+            self._grow(parent, _split_path(self.abspath(path))[:-1], 0, 0, -1)
+        del parent.entries[name] # удаляем элемент из словаря родителя
+        self._name_removed(parent, name)
+        self._invalidate(self.abspath(path)) # убираем директорию из кэша
+        self._log("rmdir", self.abspath(path))
 
     # получить абсолютный путь
     def abspath(self, path):
         if not path: # если пусто - возвращаем текущую директорию
             return self.cwd
-        if path.startswith("/"): # если уже абсолютный путь - нормируем и возвращаем
-            return _norm_path(path)
-        #
-        return _norm_path(os.path.join(self.cwd.lstrip("/"), path))
+        absolute = path.startswith("/")
+        key = path if absolute else (self.cwd, path) # абсолютный путь от рабочей папки не зависит
+        res = self._abs_cache.get(key) # уже нормировали такой путь
+        if res is not None:
+            return res
+        if absolute: # если уже абсолютный путь - нормируем
+            res = _norm_path(path)
+        else: # иначе - относительно текущей директории
+            res = _norm_path(os.path.join(key[0].lstrip("/"), path))
+        if len(self._abs_cache) >= PATH_CACHE_SIZE:
+            self._abs_cache.clear()
+        self._abs_cache[key] = res
+        return res
 
     # (cd) смена текущей рабочей директории
+    @_counted
     def chdir(self, path):
         new = self.abspath(path) # получаем абсолютный путь до нового расположения
         if not self.is_dir(new): # если путь не до директории - ошибка
@@ -210,34 +1363,223 @@ class JSONVFS:
         return self.cwd
 
     # возможность сохранить json файл VFS в реальной OC
+    @_counted
     def save(self, filename = None):
         # берем название объекта VFS
         fn = filename or self.filename
         if not fn: # если имя было не задано - ошибка
             raise ValueError("filename required to save VFS")
+        if self.readonly:
+            raise ValueError("VFS is read-only")
+        if self._snapshots: # сохранение фиксирует изменения - снимки больше не нужны
+            self.drop_snapshot(self._snapshots[0]["name"])
 
-        # сохраняем данные vfs в словарь
-        payload = {"cwd": self.cwd, "root": self.root}
+        # с журналом сохранение в свой образ - это только запись cwd и сброс журнала на диск
+        if self._journal_file is not None and fn == self.filename:
+            self._log("cwd", self.cwd)
+            os.fsync(self._journal_file.fileno())
+            return True
 
-        # открываем файл на запись в папке vfs
-        with open("..\\vfs\\" + fn, "w", encoding="utf-8") as f:
-            # записываем данные в файл с расстоянием 2 между подэлементами
-            json.dump(payload, f, indent=2, ensure_ascii=False)
+        # пишем в папку vfs
+        self._dump("..\\vfs\\" + fn)
         return True
 
+    # запись образа по точному пути; формат выбирается по расширению
+    def _dump(self, path):
+        if self._snapshots: # сохраненное дерево откатить уже нельзя
+            self.drop_snapshot(self._snapshots[0]["name"])
+        if path.endswith(PACK_EXT):
+            self._dump_pack(path)
+            return
+
+        # переносим содержимое файлов в таблицу блобов, подгружаем ленивые узлы и отпускаем буфер образа
+        self._materialize_all(self.root)
+        self.close()
+
+        # сохраняем данные vfs в словарь: дерево и таблицу блобов (содержимое - один раз на хэш)
+        if self.compress:
+            self._compress_blobs()
+        blobs = {}
+        for h, (refs, data, size, codec) in self._blob_table().items():
+            blobs[h] = {"refs": refs, "data": base64.b64encode(data).decode("ascii") if isinstance(data, bytes) else data}
+            if codec is not None: # сжатое содержимое: кодек и несжатый размер
+                blobs[h]["codec"] = codec
+                blobs[h]["size"] = size
+        payload = {"cwd": self.cwd, "generation": self.generation, "root": self.root, "blobs": blobs}
+
+        # пишем во временный файл и атомарно подменяем образ
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            # записываем данные в файл с расстоянием 2 между подэлементами
+            json.dump(payload, f, indent=2, ensure_ascii=False, default=node_to_json)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    # запись бинарного образа: сначала блоб, потом компактный индекс
+    def _dump_pack(self, path):
+        tmp = path + ".tmp"
+        placed = [] # (узел, смещение, длина) - чтобы потом перепривязать узлы к новому файлу
+        with open(tmp, "wb") as out:
+            out.write(_PACK_HEADER.pack(PACK_MAGIC, 0)) # смещение индекса допишем в конце
+            index_root = self._pack_node(self.root, out, placed, {})
+            index_off = out.tell()
+            index = {"cwd": self.cwd, "generation": self.generation, "root": index_root}
+            out.write(json.dumps(index, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+            out.seek(0)
+            out.write(_PACK_HEADER.pack(PACK_MAGIC, index_off))
+            out.flush()
+            os.fsync(out.fileno())
+
+        # сохраняем в свой же файл - узлы переводим на новый файл, старый буфер отпускаем
+        same = bool(self.filename) and os.path.exists(path) and os.path.exists(self.filename) \
+            and os.path.samefile(path, self.filename)
+        if same and self._buf is not None:
+            self._materialize_lazy_dirs(self.root)
+            self._release()
+        os.replace(tmp, path)
+        if same:
+            self._file = open(path, "rb")
+            self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            for node, off, length, codec, size in placed:
+                node.set_blob(off, length, codec, size)
+            self._blobs = {} # все файлы теперь ссылаются на блоб образа
+            self._blobs_span = None
+
+    # узел индекса бинарного образа; содержимое файлов пишется в out (одинаковое - один раз)
+    # сжатое содержимое пишется как есть, несжатое сжимается, если включен compress
+    def _pack_node(self, node, out, placed, written):
+        if not node.is_dir:
+            if node.hash is not None:
+                h = node.hash
+                _, _, size, codec = self._blob_table()[h]
+            elif node.blob is not None:
+                h, size, codec = None, self._node_size(node), node.codec
+            else:
+                h, size, codec = None, None, None
+            if h is None or h not in written:
+                if codec is not None and h is not None: # уже сжато в таблице блобов
+                    data = self._stored_bytes(h)
+                elif codec is not None: # уже сжато в бинарном образе
+                    off, length = node.blob
+                    data = memoryview(self._buf)[off:off + length]
+                else:
+                    data = self._raw_bytes(node)
+                    size = len(data)
+                    if self.compress:
+                        data, codec = _compress(bytes(data))
+                h = h or _content_hash(data)
+                if h not in written: # такого содержимого в блобе еще нет
+                    written[h] = (out.tell(), len(data), codec, size)
+                    out.write(data)
+            off, length, codec, size = written[h]
+            placed.append((node, off, length, codec, size))
+            index_node = {"type": "file", "blob": [off, length]}
+            if codec is not None:
+                index_node["codec"] = codec
+                index_node["size"] = size
+            return index_node
+        entries = self._entries(node)
+        return {"type": "dir", "entries": {name: self._pack_node(child, out, placed, written) for name, child in entries.items()}}
+
+    # подгрузка всех ленивых директорий (без данных файлов)
+    def _materialize_lazy_dirs(self, node):
+        for child in self._entries(node).values():
+            if child.is_dir:
+                self._materialize_lazy_dirs(child)
+
+# открыть vfs из json файла лениво: разбирается только верхний уровень
+def _open_lazy(filename):
+    f = open(filename, "rb")
+    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) # файл не читается в память целиком
+    start = 0
+    if buf[:len(PACK_MAGIC)] == PACK_MAGIC: # бинарный образ - индекс лежит после блоба
+        _, start = _PACK_HEADER.unpack_from(buf, 0)
+    top, _ = _scan_members(buf, start) # поля верхнего уровня: cwd и root
+    spans = dict(top)
+
+    if "root" in spans: # корень - ленивый узел
+        root, _ = _scan_members(buf, spans["root"][0])
+        root = _lazy_node(buf, root)
+    else:
+        root = DirNode({})
+    v = JSONVFS(root, filename)
+    v._buf = buf
+    v._file = f
+    if "cwd" in spans:
+        v.cwd = json.loads(buf[slice(*spans["cwd"])])
+    if "generation" in spans:
+        v.generation = json.loads(buf[slice(*spans["generation"])])
+    v._blobs_span = spans.get("blobs") # таблица блобов разбирается при первом обращении
+    return v
+
 # открыть vfs из json файла
-def open_vfs_from_json(filename):
+# lazy: True - лениво, False - целиком, None - решить по размеру файла
+# journal: True - вести журнал, False - нет, None - только если журнал уже есть рядом с образом
+# readonly: изменения только в памяти - образ и журнал на диске не меняются (пакетные прогоны)
+def open_vfs_from_json(filename, lazy=None, journal=None, readonly=False):
+    v = _open_image(filename, lazy)
+    journal_path = filename + JOURNAL_EXT if filename else None
+    if readonly: # несвернутые изменения видны, но журнал не очищается и не ведется
+        if journal_path and os.path.isfile(journal_path):
+            v._replay_journal(journal_path)
+        v.readonly = True
+        return v
+    if journal_path and os.path.isfile(journal_path): # повторяем несвернутые изменения
+        if not v._replay_journal(journal_path): # журнал уже свернут в образ - очищаем
+            with open(journal_path, "w", encoding="utf-8"):
+                pass
+        if journal is None:
+            journal = True
+    if journal:
+        v.enable_journal(journal_path)
+    return v
+
+# открыть образ vfs (json или бинарный)
+def _open_image(filename, lazy):
     if filename and os.path.isfile(filename): # если есть имя и файл с таким именем
+        size = os.path.getsize(filename)
+        if lazy is None:
+            lazy = size >= LAZY_MIN_SIZE
+        if lazy and size > 0: # большой образ - открываем лениво
+            return _open_lazy(filename)
+        with open(filename, "rb") as f: # бинарный образ всегда открывается через mmap
+            if f.read(len(PACK_MAGIC)) == PACK_MAGIC:
+                return _open_lazy(filename)
+
         with open(filename, "r", encoding="utf-8") as f: # открываем на чтение
-            payload = json.load(f) # загружаем данные из json в словарь
+            payload = json.load(f, object_hook=node_from_json) # загружаем данные из json, узлы - сразу объектами
 
         # достаем корневую папку или создаем пустую
-        root = payload.get("root", {"type": "dir", "entries": {}})
+        root = payload.get("root") or DirNode({})
         # создаем объект типа класса JSONVFS с аргументами корневой папки и имени файла (vfs)
         v = JSONVFS(root, filename)
         # передаем объекту текущую рабочую директорию или корневую папку
         v.cwd = payload.get("cwd", "/")
+        v.generation = payload.get("generation", 0)
+        # таблица блобов: содержимое остается в base64 до первого чтения
+        for h, blob in payload.get("blobs", {}).items():
+            data = blob.get("data", "")
+            size = blob["size"] if "size" in blob else _b64_size(len(data), data[-2:])
+            v._blobs[h] = [blob.get("refs", 1), data, size, blob.get("codec")]
         return v # возвращаем объект vfs
 
     # если не получилось найти в файлах - создаем пустой fs
-    return JSONVFS({"type": "dir", "entries": {}}, filename)
+    return JSONVFS(DirNode({}), filename)
+
+# конвертация образа между json и бинарным форматом (формат - по расширению dst)
+def convert_vfs(src, dst, compress=False):
+    v = open_vfs_from_json(src)
+    v.compress = compress
+    v._dump(dst)
+    if v._buf is not None: # образ больше не нужен - просто отпускаем буфер
+        v._release()
+
+if __name__ == "__main__":
+    import argparse
+    p = argparse.ArgumentParser(description="Конвертер образов VFS (json <-> " + PACK_EXT + ")")
+    p.add_argument("src", help="Исходный образ")
+    p.add_argument("dst", help="Новый образ (формат по расширению)")
+    p.add_argument("--compress", action="store_true", help="Сжать содержимое файлов (zlib/lzma по размеру)")
+    a = p.parse_args()
+    convert_vfs(a.src, a.dst, a.compress)
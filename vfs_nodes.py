@@ -0,0 +1,83 @@
+import sys
+import types
+
+# узлы дерева VFS: компактные объекты со __slots__ вместо словарей
+# в json узлы превращаются только на границе загрузки/сохранения (node_from_json / node_to_json)
+
+# общий пустой (неизменяемый) список дочерних элементов для файлов
+NO_ENTRIES = types.MappingProxyType({})
+
+# директория
+class DirNode:
+    __slots__ = ("entries", "lazy", "names", "totals")
+    kind = "dir" # тег типа (как "type" в json)
+    is_dir = True
+
+    def __init__(self, entries=None, lazy=None):
+        self.entries = entries # имя -> узел (None, пока директория не подгружена из буфера)
+        self.lazy = lazy # (start, end) - границы entries в буфере образа для ленивой подгрузки
+        self.names = None # отсортированные имена entries (строятся при первом listdir/дополнении)
+        self.totals = None # (байт, файлов, директорий) во всем поддереве (None - еще не посчитаны)
+
+    def to_json(self):
+        return {"type": "dir", "entries": self.entries if self.entries is not None else {}}
+
+# файл: содержимое лежит в одном из мест - таблица блобов (hash), строка base64 (data),
+# строка base64 в буфере образа (lazy) или кусок блоба бинарного образа (blob)
+class FileNode:
+    __slots__ = ("hash", "data", "lazy", "blob", "codec", "size")
+    kind = "file"
+    is_dir = False
+
+    def __init__(self, hash=None, data=None, lazy=None, blob=None, codec=None, size=None):
+        self.hash = hash # хэш содержимого в таблице блобов
+        self.data = data # base64 (старый формат образа)
+        self.lazy = lazy # (start, end) строки base64 в буфере образа
+        self.blob = blob # (смещение, длина) в блобе бинарного образа
+        self.codec = codec # кодек сжатия содержимого blob (None - не сжато)
+        self.size = size # размер содержимого (None - взять из таблицы блобов)
+
+    # копия узла (для cp: содержимое общее)
+    def clone(self):
+        return FileNode(self.hash, self.data, self.lazy, self.blob, self.codec, self.size)
+
+    # содержимое переехало в таблицу блобов
+    def set_hash(self, h):
+        self.hash = h
+        self.data = self.lazy = self.blob = self.codec = None
+
+    # содержимое переехало в блоб бинарного образа
+    def set_blob(self, off, length, codec=None, size=None):
+        self.hash = self.data = self.lazy = None
+        self.blob = (off, length)
+        self.codec = codec
+        self.size = size if codec is not None else length
+
+    def to_json(self):
+        d = {"type": "file"}
+        if self.hash is not None:
+            d["hash"] = self.hash
+        elif self.data is not None:
+            d["data"] = self.data
+        return d
+
+# узел из объекта json (object_hook для json.load): остальные объекты возвращаются как есть
+def node_from_json(d):
+    kind = d.get("type")
+    if kind == "dir":
+        entries = d.get("entries") or {}
+        return DirNode({sys.intern(name): child for name, child in entries.items()})
+    if kind == "file":
+        blob, data, size = d.get("blob"), d.get("data"), d.get("size")
+        if size is None and blob: # несжатый кусок блоба
+            size = blob[1]
+        elif size is None and data is not None: # размер по длине base64 и паддингу
+            size = len(data) // 4 * 3 - data[-2:].count("=")
+        return FileNode(d.get("hash"), data, None, tuple(blob) if blob else None, d.get("codec"), size)
+    return d
+
+# узел -> объект json (default для json.dump)
+def node_to_json(node):
+    if isinstance(node, (DirNode, FileNode)):
+        return node.to_json()
+    raise TypeError(f"Object of type {type(node).__name__} is not JSON serializable")
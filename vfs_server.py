@@ -0,0 +1,268 @@
+import os
+import sys
+import asyncio
+import argparse
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+import metrics
+import commands
+import script_cache
+from history import History
+from vfs_json import open_vfs_from_json
+
+# сервер VFS: образ загружается один раз, команды эмулятора (COMMANDS) выполняются для многих клиентов
+# через Unix-сокет или TCP на localhost; у каждого сеанса своя текущая директория и история
+# команды только для чтения выполняются параллельно, изменяющие vfs - по одной (блокировка читатели-писатель)
+#
+# протокол - строки UTF-8: клиент шлет строку команды (как в консоли, с конвейерами и перенаправлением),
+# сервер отвечает строками вывода с префиксом " " и строкой статуса "=0" (успех) или "=1" (ошибка);
+# после exit сервер отвечает "=0" и закрывает соединение
+
+# порт TCP по умолчанию
+DEFAULT_PORT = 8765
+# потоков для выполнения команд (столько читающих команд может идти одновременно)
+DEFAULT_WORKERS = 8
+# сколько строк истории хранится у сеанса
+SESSION_HISTORY = 1000
+# вывод команды отправляется клиенту кусками не меньше этого (и в конце команды)
+FLUSH_BYTES = 64 * 1024
+# сколько секунд команда ждет, пока клиент примет кусок вывода; дольше - сеанс закрывается
+# (команда в это время держит блокировку vfs, и не читающий ответ клиент не должен останавливать остальных)
+SEND_TIMEOUT = 5.0
+# самая длинная строка команды
+LINE_LIMIT = 16 * 1024 * 1024
+
+# команды, которые не меняют vfs и состояние эмулятора (cd меняет только директорию сеанса)
+# остальные (в том числе команды плагинов, stats и reload) выполняются без других команд
+READ_COMMANDS = frozenset({"ls", "cd", "cat", "head", "tail", "wc", "find", "grep", "echo", "uname", "history", "help", "export",
+                           "du", "stat", "tree"})
+
+# блокировка читатели-писатель: читателей сколько угодно, писатель - один и без читателей;
+# ждущий писатель не пропускает новых читателей (писатели не голодают при постоянном чтении)
+class RWLock:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0 # сколько читателей внутри
+        self._writer = False # внутри писатель
+        self._waiting = 0 # сколько писателей ждет
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+# строка только читает vfs: каждая стадия конвейера - команда чтения и нет перенаправления в файл
+def is_read_only(tokens):
+    if not script_cache.has_ops(tokens):
+        return tokens[0] in READ_COMMANDS
+    try:
+        stages, redirect = script_cache.split_pipeline(tokens)
+    except ValueError: # ошибку разбора сообщит run_command
+        return True
+    return redirect is None and all(stage[0] in READ_COMMANDS for stage in stages)
+
+# сеанс клиента: своя текущая директория и история; вывод команд копится и отправляется кусками
+class Session:
+    def __init__(self, writer, loop, cwd, send_timeout=SEND_TIMEOUT):
+        self.writer = writer
+        self.loop = loop
+        self.cwd = cwd
+        self.history = History(SESSION_HISTORY)
+        self.send_timeout = send_timeout
+        self.dropped = False # клиент не принимал вывод - соединение оборвано
+        self._out = [] # еще не отправленный вывод
+        self._size = 0
+
+    # строка вывода (из рабочего потока); в оборванном сеансе - ConnectionAbortedError, команда прерывается
+    def write(self, text):
+        if self.dropped:
+            raise ConnectionAbortedError("сеанс закрыт: клиент не принимает вывод")
+        for line in text.split("\n"):
+            self._out.append(" " + line + "\n")
+            self._size += len(line) + 2
+        if self._size >= FLUSH_BYTES:
+            self.flush()
+
+    # забрать накопленный вывод
+    def take(self):
+        data = "".join(self._out).encode("utf-8")
+        self._out = []
+        self._size = 0
+        return data
+
+    # отправить накопленный вывод посреди команды; рабочий поток ждет, пока клиент его примет,
+    # но не дольше send_timeout: иначе соединение обрывается, а команда прерывается и отпускает блокировку
+    def flush(self):
+        future = asyncio.run_coroutine_threadsafe(self._send(self.take()), self.loop)
+        try:
+            future.result(self.send_timeout)
+        except (TimeoutError, ConnectionError):
+            future.cancel()
+            self.drop()
+            raise ConnectionAbortedError("сеанс закрыт: клиент не принимает вывод")
+
+    # оборвать соединение (из рабочего потока); недоотправленный вывод выбрасывается
+    def drop(self):
+        self.dropped = True
+        self._out = []
+        self._size = 0
+        self.loop.call_soon_threadsafe(self.writer.transport.abort)
+
+    async def _send(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+# сервер: одна vfs, команды - в пуле потоков
+class VFSServer:
+    def __init__(self, vfs, workers=DEFAULT_WORKERS, send_timeout=SEND_TIMEOUT):
+        self.vfs = vfs
+        self.send_timeout = send_timeout
+        self.lock = RWLock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="session")
+        self.sessions = 0 # открытых сеансов
+        self.served = 0 # выполнено команд
+
+    # выполнить строку команды сеанса (в рабочем потоке): (успех, еще не отправленный вывод); успех None - exit
+    # конец вывода отправляет уже цикл событий вместе со строкой статуса
+    def execute(self, session, line):
+        try:
+            ok = self._execute(session, line)
+        except BaseException:
+            session.take()
+            raise
+        return ok, session.take()
+
+    def _execute(self, session, line):
+        main.SESSION_OUT.write = session.write
+        commands.SESSION.history = session.history
+        self.vfs.bind_cwd(session.cwd)
+        try:
+            session.history.append(line)
+            try:
+                tokens = script_cache.expand_tokens(script_cache.split_line(line))
+            except ValueError as e:
+                main.write_console(f"Ошибка разбора строки: {e}")
+                return False
+            if not tokens:
+                return True
+            if tokens == ["exit"]: # exit закрывает только сеанс, не сервер
+                return None
+            with (self.lock.read() if is_read_only(tokens) else self.lock.write()):
+                finish = metrics.start_command()
+                ok = main.run_command(tokens, source="session")
+                if tokens[0] in main.COMMANDS:
+                    finish(tokens[0], ok)
+            session.cwd = self.vfs.cwd
+            self.served += 1
+            return ok
+        finally:
+            self.vfs.bind_cwd(None)
+            commands.SESSION.history = None
+            main.SESSION_OUT.write = None
+
+    # соединение клиента
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        session = Session(writer, loop, self.vfs.cwd, self.send_timeout)
+        self.sessions += 1
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                line = raw.decode("utf-8", errors="replace").strip()
+                ok, data = await loop.run_in_executor(self.executor, self.execute, session, line) if line else (True, b"")
+                writer.write(data + (b"=1\n" if ok is False else b"=0\n"))
+                await writer.drain()
+                if ok is None:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass # клиент отключился или прислал слишком длинную строку - закрываем только его сеанс
+        finally:
+            self.sessions -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    # слушать сокет: unix - путь Unix-сокета, иначе TCP host:port; ready() вызывается, когда сокет открыт
+    async def serve(self, unix=None, host="127.0.0.1", port=DEFAULT_PORT, ready=None):
+        if unix:
+            if os.path.exists(unix): # сокет от прошлого запуска
+                os.unlink(unix)
+            server = await asyncio.start_unix_server(self.handle, path=unix, limit=LINE_LIMIT)
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=LINE_LIMIT)
+        if ready is not None:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            if unix and os.path.exists(unix):
+                os.unlink(unix)
+
+# загрузка vfs и команд в процесс сервера
+def load(image, journal=False, compress=False, cache_mb=32):
+    v = open_vfs_from_json(image, journal=True if journal else None)
+    v.compress = compress
+    v.set_decoded_limit(cache_mb * 1024 * 1024)
+    main.vfs = v
+    main.commands_loader()
+    main.bind_commands_module()
+    return v
+
+def parse_cli(argv=None):
+    p = argparse.ArgumentParser(description="Сервер VFS: один загруженный образ для многих клиентов")
+    p.add_argument("--vfs", dest="vfs_path", required=True, help="Образ VFS")
+    p.add_argument("--unix", help="Путь Unix-сокета (вместо TCP)", default=None)
+    p.add_argument("--host", default="127.0.0.1", help="Адрес TCP (по умолчанию только localhost)")
+    p.add_argument("--port", type=int, default=DEFAULT_PORT, help="Порт TCP")
+    p.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Потоков для команд (одновременных читающих команд)")
+    p.add_argument("--send-timeout", dest="send_timeout", type=float, default=SEND_TIMEOUT,
+                   help="Сколько секунд ждать, пока клиент примет вывод команды, прежде чем закрыть его сеанс")
+    p.add_argument("--journal", action="store_true", help="Вести журнал изменений VFS вместо полной перезаписи при save")
+    p.add_argument("--compress", action="store_true", help="Сжимать содержимое файлов VFS")
+    p.add_argument("--cache-mb", dest="cache_mb", type=int, default=32, help="Бюджет памяти кэша декодированного содержимого, МБ")
+    return p.parse_args(argv)
+
+if __name__ == "__main__":
+    a = parse_cli()
+    main.OUT = sys.stdout # сообщения загрузки и вывод вне сеансов - в консоль сервера
+    server = VFSServer(load(a.vfs_path, a.journal, a.compress, a.cache_mb), a.workers, a.send_timeout)
+    where = a.unix or f"{a.host}:{a.port}"
+    try:
+        asyncio.run(server.serve(a.unix, a.host, a.port, ready=lambda s: print(f"Сервер VFS: {where}", flush=True)))
+    except KeyboardInterrupt:
+        pass
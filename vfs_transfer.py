@@ -0,0 +1,355 @@
+import os
+import io
+import sys
+import time
+import tarfile
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from vfs_json import JSONVFS, open_vfs_from_json, _content_hash
+from vfs_nodes import DirNode
+
+# массовый перенос файлов между реальной OC (директория, tar или zip архив) и VFS
+# файлы читаются и хэшируются (при экспорте - пишутся) в пуле потоков; дерево VFS меняется только в вызывающем потоке,
+# а в работе одновременно не больше окна файлов/байт, поэтому память ограничена независимо от числа файлов
+
+# сколько байт содержимого может быть в работе одновременно (прочитано, но еще не записано)
+WINDOW_BYTES = 64 * 1024 * 1024
+# как часто отдавать прогресс, секунд
+PROGRESS_SECONDS = 1.0
+
+TAR_EXTS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+ZIP_EXTS = (".zip",)
+# режим записи tarfile по расширению
+_TAR_WRITE_MODES = {".tar": "w", ".tar.gz": "w:gz", ".tgz": "w:gz", ".tar.bz2": "w:bz2", ".tbz2": "w:bz2",
+                    ".tar.xz": "w:xz", ".txz": "w:xz"}
+
+# тип источника/приемника по пути: "dir", "tar" или "zip"
+def host_kind(path):
+    low = path.lower()
+    if low.endswith(TAR_EXTS):
+        return "tar"
+    if low.endswith(ZIP_EXTS):
+        return "zip"
+    return "dir"
+
+# безопасный относительный путь элемента архива (None - путь выходит за пределы корня)
+def _member_path(name):
+    parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".")]
+    if ".." in parts:
+        return None
+    return "/".join(parts)
+
+# прогресс переноса: счетчики и время
+class Progress:
+    def __init__(self):
+        self.files = 0
+        self.dirs = 0
+        self.bytes = 0
+        self.skipped = 0 # элементы, которые нельзя перенести (ссылки, устройства, пути с ..)
+        self.done = False # перенос закончен (последний прогресс)
+        self.start = time.perf_counter()
+        self._last = self.start
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.start
+
+    # пора ли отдать прогресс
+    def due(self):
+        now = time.perf_counter()
+        if now - self._last >= PROGRESS_SECONDS:
+            self._last = now
+            return True
+        return False
+
+# ИМПОРТ (реальная OC -> VFS)
+
+# чтение файла реальной OC и хэш содержимого (в потоке пула)
+def _read_host(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return data, _content_hash(data)
+
+# чтение элемента zip и хэш (zipfile разрешает читать разные элементы из разных потоков)
+def _read_zip(zf, info):
+    data = zf.read(info)
+    return data, _content_hash(data)
+
+# хэш уже прочитанного содержимого (tar читается последовательно, в пул уходит только хэширование)
+def _hash_only(data):
+    return data, _content_hash(data)
+
+# элементы директории реальной OC: ("dir", путь) и ("file", путь, полный путь) без рекурсии в ссылки
+def _walk_dir(root):
+    stack = [("", root)]
+    while stack:
+        rel, path = stack.pop()
+        with os.scandir(path) as it:
+            items = sorted(it, key=lambda e: e.name)
+        for e in items:
+            child = rel + "/" + e.name if rel else e.name
+            if e.is_dir(follow_symlinks=False):
+                yield ("dir", child)
+                stack.append((child, e.path))
+            elif e.is_file(follow_symlinks=False):
+                yield ("file", child, e.path)
+            else:
+                yield ("skip", child)
+
+# задачи чтения для источника: ("dir", путь) / ("file", путь, размер, функция, аргументы) / ("skip", путь)
+def _import_jobs(src, kind, archive):
+    if kind == "dir":
+        for item in _walk_dir(src):
+            if item[0] == "file": # размер заранее не узнаем (лишний stat дороже чтения мелкого файла) -
+                # окно ограничивается числом файлов
+                yield ("file", item[1], 0, _read_host, (item[2],))
+            else:
+                yield item
+    elif kind == "zip":
+        for info in archive.infolist():
+            rel = _member_path(info.filename)
+            if rel is None:
+                yield ("skip", info.filename)
+            elif info.is_dir():
+                if rel:
+                    yield ("dir", rel)
+            else:
+                yield ("file", rel, info.file_size, _read_zip, (archive, info))
+    else:
+        for info in archive:
+            rel = _member_path(info.name)
+            if rel is None or not (info.isdir() or info.isfile()):
+                yield ("skip", info.name)
+            elif info.isdir():
+                if rel:
+                    yield ("dir", rel)
+            else: # содержимое tar читается по порядку в этом потоке
+                yield ("file", rel, info.size, _hash_only, (archive.extractfile(info).read(),))
+
+# импорт src (директория, .tar[.gz|.bz2|.xz] или .zip) в директорию dst VFS;
+# ошибки источника поднимаются сразу, перенос идет по мере чтения итератора (Progress раз в PROGRESS_SECONDS и в конце)
+def iter_import(vfs, src, dst="/", workers=None):
+    kind = host_kind(src)
+    if kind == "dir" and not os.path.isdir(src) or kind != "dir" and not os.path.isfile(src):
+        raise FileNotFoundError(src)
+    base = vfs.abspath(dst).rstrip("/")
+    if base:
+        vfs.mkdir(base, exist_ok=True)
+    archive = zipfile.ZipFile(src) if kind == "zip" else tarfile.open(src, "r:*") if kind == "tar" else None
+    # чтение файлов - в основном ожидание диска, потоков больше, чем ядер
+    return _import_steps(vfs, src, kind, archive, base, workers or min(32, (os.cpu_count() or 1) + 4))
+
+# сам импорт: чтение в пуле, запись в vfs по порядку источника
+def _import_steps(vfs, src, kind, archive, base, workers):
+    progress = Progress()
+    pending = deque() # (путь в vfs, размер, future) в порядке источника
+    in_flight = 0 # байт в работе
+
+    # записать в vfs самый старый прочитанный файл
+    def finish_oldest():
+        nonlocal in_flight
+        path, size, future = pending.popleft()
+        data, h = future.result()
+        vfs.write_bytes(path, data, content_hash=h)
+        in_flight -= size
+        progress.files += 1
+        progress.bytes += len(data)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="import") as pool:
+            for job in _import_jobs(src, kind, archive):
+                if job[0] == "skip":
+                    progress.skipped += 1
+                    continue
+                path = base + "/" + job[1]
+                if job[0] == "dir":
+                    vfs.mkdir(path, exist_ok=True)
+                    progress.dirs += 1
+                    continue
+                _, _, size, read, args = job
+                # окно заполнено - сначала дописываем уже прочитанное
+                while pending and (len(pending) >= workers * 4 or in_flight + size > WINDOW_BYTES):
+                    finish_oldest()
+                pending.append((path, size, pool.submit(read, *args)))
+                in_flight += size
+                if progress.due():
+                    yield progress
+            while pending:
+                finish_oldest()
+    finally:
+        if archive is not None:
+            archive.close()
+    progress.done = True
+    yield progress
+
+# импорт целиком (без промежуточного прогресса); возвращает итоговый Progress
+def import_tree(vfs, src, dst="/", workers=None):
+    for progress in iter_import(vfs, src, dst, workers):
+        pass
+    return progress
+
+# ЭКСПОРТ (VFS -> реальная OC)
+
+# запись файла реальной OC (в потоке пула)
+def _write_host(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+# обход поддерева VFS: ("dir", относительный путь) и ("file", относительный путь, абсолютный путь) по порядку имен
+def _walk_vfs(vfs, root):
+    stack = [("", root)]
+    while stack:
+        rel, path = stack.pop()
+        for name in reversed(vfs.listdir(path)): # стек - в обратном порядке, чтобы идти по алфавиту
+            child_rel = rel + "/" + name if rel else name
+            child = path.rstrip("/") + "/" + name
+            if vfs.is_dir(child):
+                stack.append((child_rel, child))
+                yield ("dir", child_rel)
+            else:
+                yield ("file", child_rel, child)
+
+# экспорт директории src VFS в dst (директория, .tar[.gz|.bz2|.xz] или .zip);
+# ошибки поднимаются сразу, перенос идет по мере чтения итератора (Progress раз в PROGRESS_SECONDS и в конце)
+def iter_export(vfs, dst, src="/", workers=None):
+    root = vfs.abspath(src)
+    if not vfs.is_dir(root):
+        raise NotADirectoryError(src)
+    return _export_steps(vfs, root, dst, host_kind(dst), workers)
+
+# сам экспорт: в директорию - через пул потоков, в архив - последовательно
+def _export_steps(vfs, root, dst, kind, workers):
+    progress = Progress()
+    if kind == "dir":
+        yield from _export_dir(vfs, root, dst, workers or min(32, (os.cpu_count() or 1) + 4), progress)
+    else:
+        yield from _export_archive(vfs, root, dst, kind, progress)
+    progress.done = True
+    yield progress
+
+# экспорт в директорию: содержимое читается из vfs здесь, файлы пишутся в пуле потоков
+def _export_dir(vfs, root, dst, workers, progress):
+    os.makedirs(dst, exist_ok=True)
+    pending = deque() # (размер, future)
+    in_flight = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export") as pool:
+        for item in _walk_vfs(vfs, root):
+            target = os.path.join(dst, *item[1].split("/"))
+            if item[0] == "dir":
+                os.makedirs(target, exist_ok=True)
+                progress.dirs += 1
+                continue
+            data = vfs.read_bytes(item[2]) # bytes или срез mmap - без копирования
+            while pending and (len(pending) >= workers * 4 or in_flight + len(data) > WINDOW_BYTES):
+                size, future = pending.popleft()
+                future.result() # ошибки записи поднимаются здесь
+                in_flight -= size
+            pending.append((len(data), pool.submit(_write_host, target, data)))
+            in_flight += len(data)
+            progress.files += 1
+            progress.bytes += len(data)
+            if progress.due():
+                yield progress
+        for _, future in pending:
+            future.result()
+
+# экспорт в архив: архив пишется последовательно, файлы - потоком кусков из vfs
+def _export_archive(vfs, root, dst, kind, progress):
+    if kind == "zip":
+        archive = zipfile.ZipFile(dst, "w", compression=zipfile.ZIP_DEFLATED)
+    else:
+        mode = next(m for ext, m in _TAR_WRITE_MODES.items() if dst.lower().endswith(ext))
+        archive = tarfile.open(dst, mode)
+    with archive:
+        for item in _walk_vfs(vfs, root):
+            if item[0] == "dir":
+                if kind == "zip":
+                    archive.writestr(item[1] + "/", b"")
+                else:
+                    info = tarfile.TarInfo(item[1])
+                    info.type, info.mode = tarfile.DIRTYPE, 0o755
+                    archive.addfile(info)
+                progress.dirs += 1
+                continue
+            size = vfs.file_size(item[2])
+            if kind == "zip":
+                with archive.open(item[1], "w", force_zip64=size >= 1 << 31) as out:
+                    for chunk in vfs.iter_bytes(item[2]):
+                        out.write(chunk)
+            else:
+                info = tarfile.TarInfo(item[1])
+                info.size, info.mode = size, 0o644
+                archive.addfile(info, io.BufferedReader(_ChunkReader(vfs.iter_bytes(item[2]))))
+            progress.files += 1
+            progress.bytes += size
+            if progress.due():
+                yield progress
+
+# файловый объект для чтения из потока кусков (tarfile читает содержимое через read, поверх - BufferedReader)
+class _ChunkReader(io.RawIOBase):
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._rest = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._rest:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._rest = memoryview(chunk).cast("B")
+        n = min(len(b), len(self._rest))
+        b[:n] = self._rest[:n]
+        self._rest = self._rest[n:]
+        return n
+
+# экспорт целиком (без промежуточного прогресса); возвращает итоговый Progress
+def export_tree(vfs, dst, src="/", workers=None):
+    for progress in iter_export(vfs, dst, src, workers):
+        pass
+    return progress
+
+# строка прогресса для консоли
+def format_progress(progress):
+    mb = progress.bytes / (1024 * 1024)
+    head = "готово" if progress.done else "в процессе"
+    line = f"{head}: файлов {progress.files}, директорий {progress.dirs}, {mb:.1f} МБ за {progress.seconds:.2f} с"
+    if progress.skipped:
+        line += f", пропущено {progress.skipped}"
+    return line
+
+if __name__ == "__main__":
+    import argparse
+    p = argparse.ArgumentParser(description="Импорт/экспорт файлов между реальной OC (директория, tar, zip) и образом VFS")
+    sub = p.add_subparsers(dest="op", required=True)
+    pi = sub.add_parser("import", help="Собрать образ из директории или архива")
+    pi.add_argument("src", help="Директория, .tar[.gz|.bz2|.xz] или .zip")
+    pi.add_argument("image", help="Образ VFS (если есть - файлы добавляются в него)")
+    pi.add_argument("--dst", default="/", help="Директория внутри VFS")
+    pi.add_argument("--compress", action="store_true", help="Сжать содержимое файлов (zlib/lzma по размеру)")
+    pi.add_argument("--workers", type=int, default=None, help="Число потоков чтения")
+    pe = sub.add_parser("export", help="Выгрузить образ в директорию или архив")
+    pe.add_argument("image", help="Образ VFS")
+    pe.add_argument("dst", help="Директория, .tar[.gz|.bz2|.xz] или .zip")
+    pe.add_argument("--src", default="/", help="Директория внутри VFS")
+    pe.add_argument("--workers", type=int, default=None, help="Число потоков записи")
+    a = p.parse_args()
+    try:
+        if a.op == "import":
+            v = open_vfs_from_json(a.image) if os.path.isfile(a.image) else JSONVFS(DirNode({}), a.image)
+            v.compress = a.compress
+            steps = iter_import(v, a.src, a.dst, a.workers)
+        else:
+            v = open_vfs_from_json(a.image)
+            steps = iter_export(v, a.dst, a.src, a.workers)
+        for progress in steps:
+            sys.stderr.write(format_progress(progress) + ("\n" if progress.done else "\r"))
+        if a.op == "import":
+            v._dump(a.image)
+    except OSError as e:
+        sys.stderr.write(f"Ошибка: {e}\n")
+        sys.exit(1)